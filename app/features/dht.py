@@ -0,0 +1,461 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Distributed hash table
+----------------------
+
+Finds peers without a tracker, through the Mainline DHT (BEP 5). Every node has a random 160-bit id; peers of a
+torrent are stored on the nodes whose ids are closest (by XOR) to its info-hash. Nodes talk KRPC: bencoded
+dictionaries over UDP, each query answered by a response or an error with the same transaction id.
+
+    ping            {"id"}                                    -> {"id"}
+    find_node       {"id", "target"}                          -> {"id", "nodes"}
+    get_peers       {"id", "info_hash"}                       -> {"id", "token", "values" or "nodes"}
+    announce_peer   {"id", "info_hash", "port", "token"}      -> {"id"}
+
+"nodes" is the compact node info of the closest nodes the responder knows (a 20-byte id followed by a 6-byte IPv4
+address each; "nodes6" holds IPv6 ones) and "values" a list of compact peer addresses.
+
+Lookups are iterative: the alpha closest nodes known are queried in parallel, the nodes they return join the
+candidates, and as soon as one answer arrives the next closest unqueried candidate is queried, so alpha queries are
+always in flight. The lookup ends once the k closest candidates have all answered or failed. announce_peer runs a
+get_peers lookup and then announces to the k closest nodes that answered, with the token each one handed out.
+
+A token is a hash of the requester's IP address and a secret that changes every 5 minutes; tokens made with the
+current or the previous secret are accepted, so a token is valid for 5 to 10 minutes and only from the address it
+was given to. The routing table (see app/repositories/routing_table.py) can be saved and loaded, so a restarted node
+keeps its id and starts from the nodes it knew instead of the bootstrap routers.
+"""
+
+import asyncio
+import hashlib
+import ipaddress
+import logging
+import os
+import random
+import socket
+import struct
+import time
+
+from app.features.parse_torrent_file import BencodeDecoder, BencodeEncoder, BencodeDecodeError
+from app.features.tracker_client import decode_compact_peers
+from app.repositories.routing_table import RoutingTable, ID_LENGTH, K
+
+logger = logging.getLogger(__name__)
+
+# Queries in flight during a lookup.
+ALPHA = 3
+# How often the token secret changes, in seconds.
+TOKEN_ROTATION = 5 * 60
+# How long an announced peer is kept, in seconds.
+PEER_TTL = 30 * 60
+# Peers returned in one get_peers response.
+MAX_VALUES = 50
+# Buckets without news for this long are refreshed, in seconds.
+REFRESH_INTERVAL = 15 * 60
+
+BOOTSTRAP_NODES = [("router.bittorrent.com", 6881), ("dht.transmissionbt.com", 6881), ("router.utorrent.com", 6881)]
+
+# KRPC error codes.
+GENERIC_ERROR = 201
+PROTOCOL_ERROR = 203
+METHOD_UNKNOWN = 204
+
+
+class DHTError(Exception):
+    """Raised when a DHT query times out or is answered with an error."""
+
+
+class _KRPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def encode_compact_address(address):
+    return ipaddress.ip_address(address[0]).packed + struct.pack(">H", address[1])
+
+
+# Returns the compact node info of nodes, as (IPv4 "nodes", IPv6 "nodes6").
+def encode_nodes(nodes):
+    nodes4, nodes6 = bytearray(), bytearray()
+    for node in nodes:
+        compact = encode_compact_address(node.address)
+        (nodes4 if len(compact) == 6 else nodes6).extend(node.node_id + compact)
+    return bytes(nodes4), bytes(nodes6)
+
+
+# Returns the (node id, (host, port)) entries of compact node info with addresses of address_length bytes.
+def decode_nodes(data, address_length=4):
+    size = ID_LENGTH + address_length + 2
+    nodes = []
+    for offset in range(0, len(data) - len(data) % size, size):
+        address = decode_compact_peers(data[offset + ID_LENGTH:offset + size], address_length)[0]
+        if address[1]:
+            nodes.append((bytes(data[offset:offset + ID_LENGTH]), address))
+    return nodes
+
+
+def _is_id(value):
+    return isinstance(value, bytes) and len(value) == ID_LENGTH
+
+
+class _DHTProtocol(asyncio.DatagramProtocol):
+    def __init__(self, node):
+        self.node = node
+
+    def datagram_received(self, data, address):
+        self.node._on_datagram(data, address[:2])
+
+    def error_received(self, error):
+        pass  # E.g. ICMP port unreachable: the query simply times out
+
+
+class DHTNode:
+    """
+    The DHTNode class is a node of the Mainline DHT, answering queries from other nodes and running lookups:
+    - node_id: The 20-byte id of the node.
+    - routing_table: The RoutingTable of the nodes it knows.
+    - k / alpha: Bucket size and lookup parallelism.
+    - timeout: Seconds to wait for the answer to a query.
+    - bootstrap_nodes: The (host, port) nodes to join the DHT through when the routing table is (almost) empty.
+    - state_path: Where close() saves the node id and routing table (see load), or None.
+    - queries_sent: The number of queries sent so far.
+    """
+    def __init__(self, node_id=None, k=K, alpha=ALPHA, timeout=2.0, bootstrap_nodes=BOOTSTRAP_NODES, state_path=None):
+        self.node_id = node_id or os.urandom(ID_LENGTH)
+        self.routing_table = RoutingTable(self.node_id, k)
+        self.k = k
+        self.alpha = alpha
+        self.timeout = timeout
+        self.bootstrap_nodes = list(bootstrap_nodes)
+        self.state_path = state_path
+        self.peers = {}  # info-hash -> {(host, port): expiry}
+        self.queries_sent = 0
+        self.transport = None
+        self._secrets = [os.urandom(16), os.urandom(16)]
+        self._secrets_rotated = time.monotonic()
+        self._transactions = {}  # transaction id -> (future, address)
+        self._next_transaction = random.getrandbits(16)
+        self._checking = set()  # ids of the nodes being pinged to see if they can be replaced
+        self._tasks = set()
+        self._handlers = {b"ping": self._on_ping, b"find_node": self._on_find_node,
+                          b"get_peers": self._on_get_peers, b"announce_peer": self._on_announce_peer}
+
+    # Returns a node with the id and routing table saved at state_path, or a new node if there is no usable state.
+    @classmethod
+    def load(cls, state_path, **kwargs):
+        try:
+            with open(state_path, "rb") as f:
+                state = BencodeDecoder(f.read(), strict=False).decode()
+            node_id = state["id"]
+            if not _is_id(node_id):
+                raise ValueError("Invalid node id")
+        except (OSError, BencodeDecodeError, KeyError, TypeError, ValueError):
+            return cls(state_path=state_path, **kwargs)
+        node = cls(bytes(node_id), state_path=state_path, **kwargs)
+        # Loaded nodes start out as least recently seen, to be replaced first if they turn out to be gone
+        for node_id, address in decode_nodes(state.get("nodes", b""), 4) + decode_nodes(state.get("nodes6", b""), 16):
+            node.routing_table.add(node_id, address, now=0)
+        return node
+
+    def save(self, state_path=None):
+        nodes4, nodes6 = encode_nodes(self.routing_table)
+        temporary = (state_path or self.state_path) + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(BencodeEncoder().encode({"id": self.node_id, "nodes": nodes4, "nodes6": nodes6}))
+        os.replace(temporary, state_path or self.state_path)
+
+    async def start(self, host="0.0.0.0", port=0):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: _DHTProtocol(self), local_addr=(host, port))
+        self._spawn(self._refresh_periodically())
+
+    @property
+    def address(self):
+        return self.transport.get_extra_info("sockname")[:2]
+
+    @property
+    def port(self):
+        return self.address[1]
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        if self.state_path is not None:
+            try:
+                self.save()
+            except OSError as error:
+                logger.warning("Cannot save the DHT state to %s: %s", self.state_path, error)
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    # Client side
+
+    # Sends a query and returns the "r" dictionary of the response. node_id, if known, is marked failed on a timeout.
+    async def query(self, address, method, arguments, node_id=None):
+        self._next_transaction = (self._next_transaction + 1) & 0xFFFF
+        transaction_id = struct.pack(">H", self._next_transaction)
+        future = asyncio.get_running_loop().create_future()
+        self._transactions[transaction_id] = (future, tuple(address))
+        message = {"t": transaction_id, "y": "q", "q": method, "a": dict(arguments, id=self.node_id)}
+        self.queries_sent += 1
+        try:
+            self.transport.sendto(BencodeEncoder().encode(message), tuple(address))
+            reply = await asyncio.wait_for(future, self.timeout)
+        except (asyncio.TimeoutError, OSError) as error:
+            if node_id is not None:
+                self.routing_table.mark_failed(node_id)
+            raise DHTError(f"No answer to {method} from {address[0]}:{address[1]}") from error
+        finally:
+            self._transactions.pop(transaction_id, None)
+        if reply.get("y") == b"e":
+            raise DHTError(f"Error answer to {method} from {address[0]}:{address[1]}: {reply.get('e')!r}")
+        response = reply.get("r")
+        if not isinstance(response, dict) or not _is_id(response.get("id")):
+            raise DHTError(f"Invalid answer to {method} from {address[0]}:{address[1]}")
+        self._add_node(response["id"], tuple(address))
+        return response
+
+    async def ping(self, address):
+        return (await self.query(address, "ping", {}))["id"]
+
+    # Joins the DHT: asks the bootstrap nodes (addresses, or self.bootstrap_nodes) for the nodes closest to our id if
+    # the routing table knows fewer than k nodes, then looks up our own id. Returns the size of the routing table.
+    async def bootstrap(self, addresses=None):
+        if len(self.routing_table) < self.k:
+            loop = asyncio.get_running_loop()
+            queries = []
+            for host, port in self.bootstrap_nodes if addresses is None else addresses:
+                try:
+                    infos = await loop.getaddrinfo(host, port, family=self.transport.get_extra_info("socket").family,
+                                                   type=socket.SOCK_DGRAM)
+                except OSError as error:
+                    logger.debug("Cannot resolve DHT bootstrap node %s: %s", host, error)
+                    continue
+                queries.append(self.query(infos[0][4][:2], "find_node", {"target": self.node_id}))
+            await asyncio.gather(*queries, return_exceptions=True)
+        await self.find_node(self.node_id)
+        return len(self.routing_table)
+
+    # Returns the (node id, address) of the k nodes closest to target that answered.
+    async def find_node(self, target):
+        nodes, _ = await self._lookup(target, "find_node", {"target": target})
+        return [(node_id, address) for node_id, address, _ in nodes]
+
+    # Returns the (host, port) peers of a torrent found on the DHT.
+    async def get_peers(self, info_hash):
+        _, peers = await self._lookup(info_hash, "get_peers", {"info_hash": info_hash})
+        return peers
+
+    # Announces that we have peers of a torrent listening on port (the port queries are sent from if None) to the
+    # closest nodes, and returns the peers found on the way.
+    async def announce_peer(self, info_hash, port=None):
+        nodes, peers = await self._lookup(info_hash, "get_peers", {"info_hash": info_hash})
+        arguments = {"info_hash": info_hash, "port": port or 0, "implied_port": 1 if port is None else 0}
+        await asyncio.gather(*(self.query(address, "announce_peer", dict(arguments, token=token), node_id)
+                               for node_id, address, token in nodes if token), return_exceptions=True)
+        return peers
+
+    # Looks up buckets that have not heard from any node for REFRESH_INTERVAL.
+    async def refresh(self):
+        for index in self.routing_table.stale_buckets(REFRESH_INTERVAL):
+            await self.find_node(self.routing_table.random_id(index))
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception as error:
+                logger.warning("DHT refresh failed: %r", error)
+
+    # Iterative lookup of target with method; returns the (node id, address, token) of the k closest nodes that
+    # answered, nearest first, and the peers they returned.
+    async def _lookup(self, target, method, arguments):
+        target_value = int.from_bytes(target, "big")
+
+        def distance(node_id):
+            return int.from_bytes(node_id, "big") ^ target_value
+
+        candidates = {node.node_id: node.address for node in self.routing_table.closest(target, self.k)}
+        queried, failed, answered, peers, pending = set(), set(), {}, {}, {}
+        try:
+            while True:
+                # Keep alpha queries in flight to the closest candidates not asked yet
+                closest = sorted((node_id for node_id in candidates if node_id not in failed), key=distance)[:self.k]
+                for node_id in closest:
+                    if len(pending) >= self.alpha:
+                        break
+                    if node_id not in queried:
+                        queried.add(node_id)
+                        task = asyncio.ensure_future(self.query(candidates[node_id], method, arguments, node_id))
+                        pending[task] = node_id
+                if not pending:
+                    break
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    node_id = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except DHTError:
+                        failed.add(node_id)
+                        continue
+                    answered[node_id] = response.get("token")
+                    for found_id, address in self._response_nodes(response):
+                        candidates.setdefault(found_id, address)
+                    values = response.get("values")
+                    for value in values if isinstance(values, list) else ():
+                        if isinstance(value, bytes) and len(value) in (6, 18):
+                            peers.update(dict.fromkeys(decode_compact_peers(value, len(value) - 2)))
+        finally:
+            for task in pending:
+                task.cancel()
+        nodes = sorted(answered, key=distance)[:self.k]
+        return [(node_id, candidates[node_id], answered[node_id]) for node_id in nodes], list(peers)
+
+    def _response_nodes(self, response):
+        nodes = []
+        for key, address_length in (("nodes", 4), ("nodes6", 16)):
+            if isinstance(response.get(key), bytes):
+                nodes += decode_nodes(response[key], address_length)
+        return [(node_id, address) for node_id, address in nodes if node_id != self.node_id]
+
+    # Adds a node that answered or queried us; a full bucket makes room if its least recently seen node is gone.
+    def _add_node(self, node_id, address):
+        stale = self.routing_table.add(node_id, address)
+        if stale is not None and stale.id not in self._checking and self.transport is not None:
+            self._checking.add(stale.id)
+            self._spawn(self._replace_if_gone(stale, node_id, address))
+
+    async def _replace_if_gone(self, stale, node_id, address):
+        try:
+            await self.query(stale.address, "ping", {})
+        except DHTError:
+            self.routing_table.remove(stale.node_id)
+            self.routing_table.add(node_id, address)
+        finally:
+            self._checking.discard(stale.id)
+
+    # Server side
+
+    def _on_datagram(self, data, address):
+        try:
+            message = BencodeDecoder(data, view_threshold=len(data) + 1, strict=False).decode()
+        except BencodeDecodeError:
+            return
+        if not isinstance(message, dict) or not isinstance(message.get("t"), bytes):
+            return
+        kind = message.get("y")
+        if kind == b"q":
+            self._on_query(message, address)
+        elif kind in (b"r", b"e"):
+            entry = self._transactions.get(message["t"])
+            if entry is not None and entry[1] == address and not entry[0].done():
+                entry[0].set_result(message)
+
+    def _on_query(self, message, address):
+        arguments = message.get("a")
+        try:
+            if not isinstance(arguments, dict) or not _is_id(arguments.get("id")):
+                raise _KRPCError(PROTOCOL_ERROR, "Invalid arguments")
+            handler = self._handlers.get(message.get("q"))
+            if handler is None:
+                raise _KRPCError(METHOD_UNKNOWN, "Method unknown")
+            response = handler(arguments, address)
+            response["id"] = self.node_id
+            reply = {"t": message["t"], "y": "r", "r": response}
+        except _KRPCError as error:
+            reply = {"t": message["t"], "y": "e", "e": [error.code, error.message]}
+        else:
+            if not arguments.get("ro"):
+                self._add_node(arguments["id"], address)
+        self.transport.sendto(BencodeEncoder().encode(reply), address)
+
+    def _on_ping(self, arguments, address):
+        return {}
+
+    def _on_find_node(self, arguments, address):
+        target = arguments.get("target")
+        if not _is_id(target):
+            raise _KRPCError(PROTOCOL_ERROR, "Invalid target")
+        nodes4, nodes6 = encode_nodes(self.routing_table.closest(target, self.k))
+        return {"nodes": nodes4, "nodes6": nodes6} if nodes6 else {"nodes": nodes4}
+
+    def _on_get_peers(self, arguments, address):
+        info_hash = arguments.get("info_hash")
+        if not _is_id(info_hash):
+            raise _KRPCError(PROTOCOL_ERROR, "Invalid info_hash")
+        response = {"token": self._token(address[0], self._current_secrets()[0])}
+        peers = self._stored_peers(info_hash)
+        if peers:
+            response["values"] = [encode_compact_address(peer) for peer in peers]
+        else:
+            response.update(self._on_find_node({"target": info_hash}, address))
+        return response
+
+    def _on_announce_peer(self, arguments, address):
+        info_hash, port, token = arguments.get("info_hash"), arguments.get("port"), arguments.get("token")
+        if not _is_id(info_hash) or not isinstance(token, bytes):
+            raise _KRPCError(PROTOCOL_ERROR, "Invalid arguments")
+        if arguments.get("implied_port"):
+            port = address[1]
+        if not isinstance(port, int) or not 0 < port < 65536:
+            raise _KRPCError(PROTOCOL_ERROR, "Invalid port")
+        if token not in (self._token(address[0], secret) for secret in self._current_secrets()):
+            raise _KRPCError(PROTOCOL_ERROR, "Bad token")
+        self.peers.setdefault(info_hash, {})[(address[0], port)] = time.monotonic() + PEER_TTL
+        return {}
+
+    def _stored_peers(self, info_hash):
+        stored = self.peers.get(info_hash)
+        if not stored:
+            return []
+        now = time.monotonic()
+        for peer in [peer for peer, expiry in stored.items() if expiry < now]:
+            del stored[peer]
+        if not stored:
+            del self.peers[info_hash]
+            return []
+        peers = list(stored)
+        return random.sample(peers, MAX_VALUES) if len(peers) > MAX_VALUES else peers
+
+    def _current_secrets(self):
+        if time.monotonic() - self._secrets_rotated > TOKEN_ROTATION:
+            self._secrets = [os.urandom(16), self._secrets[0]]
+            self._secrets_rotated = time.monotonic()
+        return self._secrets
+
+    @staticmethod
+    def _token(host, secret):
+        return hashlib.sha1(ipaddress.ip_address(host).packed + secret).digest()[:8]
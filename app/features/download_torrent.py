@@ -1,3 +1,4 @@
+
 """
 Copyright (C) 2023 Sergio Perea
 
@@ -20,34 +21,358 @@ Website: https://sperea.es
 Please give credit to the author and the website when using or redistributing this code.
 """
 
-import bencode
-import requests
-import time
+"""
+Downloading
+-----------
+
+The download engine keeps connections to many peers open at once on a single asyncio event loop. Each connection runs
+the peer wire protocol (see app/repositories/peer_wire.py): handshake, interested, then - while unchoked - pipelined
+16 KiB block requests, keeping up to pipeline_depth of them outstanding per peer.
+
+New pieces are chosen rarest first by a PiecePicker fed with every peer's bitfield and have messages; blocks of
+pieces already in progress are always finished first. Once every remaining piece has been handed out the engine goes
+into endgame mode: idle peers also request blocks that are still outstanding with other peers, and when a block
+arrives the duplicate requests are cancelled. This keeps a few slow peers from holding up the last pieces.
+
+Blocks of a piece are assembled in memory. When a piece is complete its SHA-1 is checked against the torrent's piece
+hashes; a good piece goes into a WriteBackCache (see app/repositories/write_back_cache.py) and is announced to every
+connected peer with a have message, a bad one is discarded and downloaded again. The cache writes the pieces into the
+payload files in ascending order and in large batches whenever it reaches cache_size bytes, and once more at the end.
+Those files and their directories are created before the first peer is contacted, sparse or fully allocated
+depending on allocation (see BTFileCollection.allocate).
+
+With file_priorities (a FilePriorities), only the pieces of the wanted files are downloaded, those of high priority
+files first, and the download is complete once every wanted piece is verified. Skipped files are not created, except
+those sharing a piece with a wanted file, which only receive their part of that piece.
+"""
+
+import asyncio
+import contextlib
+import logging
+
+from app.repositories import peer_wire
+from app.repositories.bt_file import ALLOCATE_SPARSE
+from app.repositories.piece_picker import PiecePicker
+from app.repositories.write_back_cache import WriteBackCache, DEFAULT_MEMORY_CAP
+
+logger = logging.getLogger(__name__)
+
+# Peers that sent data for this many pieces failing the hash check are dropped.
+MAX_HASH_FAILURES = 3
+
+# Errors that end the connection with one peer, but not the download.
+PEER_ERRORS = (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, peer_wire.PeerWireError)
+
+
+class DownloadError(Exception):
+    """Raised when every peer is gone before the download is complete, or when its data cannot be written."""
+
+
+class PieceDownload:
+    """
+    The PieceDownload class assembles the blocks of one piece:
+    - index: The piece index.
+    - buffer: The piece data received so far.
+    - pending: The offsets of the blocks that have not been requested yet.
+    - peers: The peers that sent blocks of the piece.
+    """
+    __slots__ = ("index", "buffer", "pending", "missing", "peers")
+
+    def __init__(self, index, size, block_size=peer_wire.BLOCK_SIZE):
+        self.index = index
+        self.buffer = bytearray(size)
+        self.pending = list(range(0, size, block_size))[::-1]  # Popped from the end, in order
+        self.missing = set(range(0, size, block_size))
+        self.peers = set()
 
+    def block_length(self, begin):
+        return min(peer_wire.BLOCK_SIZE, len(self.buffer) - begin)
+
+    # Stores a block, returns True once every block has been received.
+    def add_block(self, begin, block):
+        if begin in self.missing and len(block) == self.block_length(begin):
+            self.buffer[begin:begin + len(block)] = block
+            self.missing.discard(begin)
+        return not self.missing
+
+
+class Peer:
+    """
+    The Peer class holds the state of one connection:
+    - connection: The PeerConnection.
+    - bitfield: The pieces the peer has.
+    - choked: Whether the peer is choking us.
+    - requested: The (index, begin, length) blocks requested from the peer and not received yet.
+    - hash_failures: The number of pieces the peer sent data for that failed the hash check.
+    """
+    __slots__ = ("connection", "bitfield", "choked", "requested", "hash_failures")
+
+    def __init__(self, connection, bitfield_length):
+        self.connection = connection
+        self.bitfield = bytearray(bitfield_length)
+        self.choked = True
+        self.requested = set()
+        self.hash_failures = 0
+
+    def has(self, index):
+        return bool(self.bitfield[index >> 3] & (0x80 >> (index & 7)))
+
+    def set_have(self, index):
+        self.bitfield[index >> 3] |= 0x80 >> (index & 7)
+
+
+# DownloadTorrentUseCase class downloads a torrent's payload from a list of (host, port) peers into output_directory.
+# Several downloads can share resources: connection_slots (an asyncio.Semaphore bounding the connections of all of
+# them), download_limiter (a TokenBucket for the received data) and disk_executor (the pool doing the disk writes).
+# file_priorities (a FilePriorities) restricts the download to the wanted files.
 class DownloadTorrentUseCase:
 
-    def __init__(self, torrent_file, tracker_url):
-        self.torrent_file = torrent_file
-        self.tracker_url = tracker_url
+    def __init__(self, meta_info, output_directory, peers, peer_id=None, max_connections=50, pipeline_depth=16,
+                 timeout=120, cache_size=DEFAULT_MEMORY_CAP, allocation=ALLOCATE_SPARSE, connection_slots=None,
+                 download_limiter=None, disk_executor=None, file_priorities=None):
+        self.meta_info = meta_info
+        self.output_directory = output_directory
+        self.peers = [tuple(peer) for peer in peers]
+        self.peer_id = peer_id or peer_wire.generate_peer_id()
+        self.max_connections = max_connections
+        self.pipeline_depth = pipeline_depth
+        self.timeout = timeout
+        self.allocation = allocation
+        self.connection_slots = connection_slots
+        self.download_limiter = download_limiter
+        self.disk_executor = disk_executor
+        self.file_priorities = file_priorities
+        self.piece_hashes = meta_info.info.piece_hashes
+        self.bt_files = meta_info.create_btfile_collection()
+        self.cache = WriteBackCache(self.bt_files, self.piece_hashes, output_directory, cache_size)
+        self.active = {}  # piece index -> PieceDownload
+        self.requesters = {}  # (piece index, begin) -> peers the block is requested from
+        self.peer_states = set()
+        self.picker = None
+        self.complete = None
+        self.remaining = 0  # Wanted pieces not verified yet
+        self.disk_error = None  # The OSError that stopped the download, if writing failed
+        self._slots = None
+        self._tasks = []  # Peer tasks of the running download
+        self._running = None  # Those not finished yet, or None when the download is not running
 
     def download(self):
-        # Get the info hash
-        info_hash = get_info_hash(self.torrent_file)
+        return asyncio.run(self.download_async())
+
+    # Downloads every missing wanted piece and returns the torrent's PieceHashTable.
+    async def download_async(self):
+        self.bt_files.allocate(self.output_directory, self.allocation, self.file_priorities)
+        self.complete = asyncio.Event()
+        piece_count = len(self.piece_hashes)
+        priorities = None if self.file_priorities is None else self.file_priorities.piece_priorities()
+        missing = [i for i in range(piece_count) if not self.piece_hashes.is_verified(i)
+                   and (priorities is None or priorities[i])]
+        self.picker = PiecePicker(piece_count, missing, priorities=priorities)
+        self.remaining = len(missing)
+        if not self.remaining:
+            return self.piece_hashes
+        self._slots = asyncio.Semaphore(self.max_connections)
+        self._tasks = [asyncio.create_task(self._run_peer(host, port, self._slots)) for host, port in self.peers]
+        self._running = running = set(self._tasks)
+        waiter = asyncio.create_task(self.complete.wait())
+        try:
+            # Until the download is complete or every peer is gone (add_peers may add to running meanwhile)
+            while running and not self.complete.is_set():
+                done, _ = await asyncio.wait(running | {waiter}, return_when=asyncio.FIRST_COMPLETED)
+                running -= done
+        finally:
+            self._running = None
+            waiter.cancel()
+            for peer in list(self.peer_states):
+                peer.connection.close()
+            results = await asyncio.gather(*self._tasks, return_exceptions=True)
+            try:
+                await self._run_disk(self.cache.flush)
+            except OSError as error:
+                self.disk_error = self.disk_error or error
+            finally:
+                self.bt_files.close()
+        if self.disk_error is not None:
+            raise DownloadError(f"Cannot write the downloaded data: {self.disk_error}") from self.disk_error
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        if self.remaining:
+            raise DownloadError(f"Download incomplete: {len(missing) - self.remaining}/{len(missing)} missing pieces received")
+        print('The torrent has been downloaded.')
+        return self.piece_hashes
+
+    # Adds (host, port) peers found while downloading, e.g. by a later announce. New ones are connected to right away.
+    def add_peers(self, peers):
+        for host, port in peers:
+            if (host, port) in self.peers:
+                continue
+            self.peers.append((host, port))
+            if self._running is not None and not self.complete.is_set():
+                task = asyncio.create_task(self._run_peer(host, port, self._slots))
+                self._tasks.append(task)
+                self._running.add(task)
+
+    async def _run_disk(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.disk_executor, function, *args)
+
+    async def _run_peer(self, host, port, slots):
+        async with slots, self.connection_slots or contextlib.nullcontext():
+            if self.complete.is_set():
+                return
+            try:
+                connection = await peer_wire.PeerConnection.open(host, port, self.timeout)
+            except PEER_ERRORS as error:
+                logger.debug("Cannot connect to %s:%s: %r", host, port, error)
+                return
+            peer = Peer(connection, len(self.piece_hashes.bitfield))
+            self.peer_states.add(peer)
+            try:
+                await connection.send_handshake(self.meta_info.info_hash, self.peer_id)
+                await connection.read_handshake(self.meta_info.info_hash)
+                await connection.send_message(peer_wire.INTERESTED)
+                await self._exchange(peer)
+            except PEER_ERRORS as error:
+                logger.debug("Peer %s:%s disconnected: %r", host, port, error)
+            finally:
+                self.peer_states.discard(peer)
+                self.picker.remove_bitfield(peer.bitfield)
+                self._release_requests(peer)
+                connection.close()
+                self._wake_peers()
+
+    # Message loop of one peer until the download is complete.
+    async def _exchange(self, peer):
+        connection = peer.connection
+        while not self.complete.is_set():
+            if not peer.choked and self._fill_requests(peer):
+                await connection.drain()
+            message_id, payload = await connection.read_message()
+            if message_id == peer_wire.PIECE:
+                if self.download_limiter is not None:
+                    await self.download_limiter.consume(len(payload))
+                await self._on_block(peer, *peer_wire.decode_piece(payload))
+            elif message_id == peer_wire.HAVE:
+                index = peer_wire.decode_have(payload)
+                if index < len(self.piece_hashes) and not peer.has(index):
+                    peer.set_have(index)
+                    self.picker.add_have(index)
+            elif message_id == peer_wire.BITFIELD:
+                if len(payload) != len(peer.bitfield):
+                    raise peer_wire.PeerWireError("Invalid bitfield length")
+                self.picker.remove_bitfield(peer.bitfield)
+                peer.bitfield[:] = payload
+                self.picker.add_bitfield(peer.bitfield)
+            elif message_id == peer_wire.UNCHOKE:
+                peer.choked = False
+            elif message_id == peer_wire.CHOKE:
+                peer.choked = True
+                self._release_requests(peer)
+                self._wake_peers()
+
+    # Queues requests until pipeline_depth blocks are outstanding, returns whether any was queued.
+    def _fill_requests(self, peer):
+        queued = False
+        while len(peer.requested) < self.pipeline_depth:
+            block = self._next_block(peer)
+            if block is None:
+                break
+            peer.requested.add(block)
+            self.requesters.setdefault(block[:2], set()).add(peer)
+            peer.connection.write_message(peer_wire.REQUEST, peer_wire.encode_block(*block))
+            queued = True
+        return queued
+
+    # Picks the next block to request from a peer: continue a piece in progress,
+    # start the rarest piece the peer has or, in endgame, duplicate a request.
+    def _next_block(self, peer):
+        for piece in self.active.values():
+            if piece.pending and peer.has(piece.index):
+                begin = piece.pending.pop()
+                return piece.index, begin, piece.block_length(begin)
+        index = self.picker.pick(peer.has)
+        if index is not None:
+            piece = self.active[index] = PieceDownload(index, self.piece_hashes.piece_size(index))
+            begin = piece.pending.pop()
+            return index, begin, piece.block_length(begin)
+        if not len(self.picker):
+            return self._endgame_block(peer)
+        return None
+
+    # Every piece has been handed out: request a block still outstanding elsewhere.
+    def _endgame_block(self, peer):
+        for piece in self.active.values():
+            if peer.has(piece.index):
+                for begin in piece.missing:
+                    block = (piece.index, begin, piece.block_length(begin))
+                    if block not in peer.requested:
+                        return block
+        return None
 
-        # Connect to the tracker
-        announce_url = connect_to_tracker(info_hash, self.tracker_url)
+    # Hands out blocks that became available again to unchoked peers, which may be
+    # idle waiting for messages. Writes are flushed by the transport on its own.
+    def _wake_peers(self):
+        for peer in list(self.peer_states):
+            if not peer.choked:
+                self._fill_requests(peer)
 
-        # Get the piece length
-        piece_length = 256 * 1024
+    # Gives the blocks requested from a peer back to their pieces, so other peers can fetch them.
+    def _release_requests(self, peer):
+        for index, begin, _ in peer.requested:
+            requesters = self.requesters.get((index, begin))
+            if requesters is not None:
+                requesters.discard(peer)
+                if requesters:
+                    continue  # Still requested from another peer (endgame)
+                del self.requesters[(index, begin)]
+            piece = self.active.get(index)
+            if piece is not None and begin in piece.missing and begin not in piece.pending:
+                piece.pending.append(begin)
+        peer.requested.clear()
 
-        # Download all the pieces
-        for piece_index in range(len(info_hash)):
-            download_piece(info_hash, piece_index, piece_length, announce_url)
+    # A block has arrived: cancel the duplicate requests sent to other peers in endgame.
+    def _cancel_duplicates(self, peer, index, begin, length):
+        for other in self.requesters.pop((index, begin), ()):
+            if other is not peer and (index, begin, length) in other.requested:
+                other.requested.discard((index, begin, length))
+                other.connection.write_message(peer_wire.CANCEL, peer_wire.encode_block(index, begin, length))
 
-        # Combine the pieces into a single file
-        with open('output.torrent', 'wb') as f:
-            for piece_index in range(len(info_hash)):
-                with open('piece-%d' % piece_index, 'rb') as piece_file:
-                    f.write(piece_file.read())
+    async def _on_block(self, peer, index, begin, block):
+        request = (index, begin, len(block))
+        if request not in peer.requested:
+            return  # Unrequested or cancelled block
+        peer.requested.discard(request)
+        self._cancel_duplicates(peer, index, begin, len(block))
+        piece = self.active.get(index)
+        if piece is not None:
+            piece.peers.add(peer)
+            if piece.add_block(begin, block):
+                await self._finish_piece(piece)
 
-        print('The torrent has been downloaded.')
\ No newline at end of file
+    async def _finish_piece(self, piece):
+        del self.active[piece.index]
+        # Hashing a piece takes a while: it runs in the disk pool rather than holding up the event loop
+        if not await self._run_disk(self.cache.add, piece.index, piece.buffer):
+            logger.warning("Piece %d failed hash check, downloading it again", piece.index)
+            self.picker.unpick(piece.index)
+            for peer in piece.peers:
+                peer.hash_failures += 1
+                if peer.hash_failures >= MAX_HASH_FAILURES:
+                    peer.connection.close()
+            self._wake_peers()
+            return
+        if self.cache.is_full():
+            # Also holds this peer back until the cache has room again
+            try:
+                await self._run_disk(self.cache.flush)
+            except OSError as error:
+                # Not the peer's fault (e.g. the disk is full): stop the whole download
+                logger.warning("Cannot write the downloaded data, stopping: %r", error)
+                self.disk_error = error
+                self.complete.set()
+                return
+        for other in list(self.peer_states):
+            other.connection.write_message(peer_wire.HAVE, peer_wire.encode_have(piece.index))
+        self.remaining -= 1
+        if not self.remaining:
+            self.complete.set()
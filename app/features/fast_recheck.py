@@ -0,0 +1,134 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Fast recheck
+------------
+
+Knowing which pieces of a download are good normally means hashing the whole payload again. Instead, the result of
+each check is persisted in a resume file inside the output directory (named after the info-hash). It holds the
+bitfield of verified pieces and the size and modification time of every file at the time of the check.
+
+On the next run only the pieces that touch a file whose size or modification time changed (or that appeared or
+disappeared) are hashed again; the state of every other piece is taken from the resume file. Pieces touching missing
+files are simply not verified. A resume file for a different torrent or piece layout is ignored.
+
+With file_priorities (a FilePriorities), changed pieces that no wanted file needs are marked as not verified instead
+of being hashed.
+"""
+
+import json
+import os
+
+from app.features.verify_pieces import VerifyPieces
+
+RESUME_VERSION = 1
+
+
+def resume_path(output_directory, info_hash):
+    return os.path.join(output_directory, f".{info_hash.hex()}.resume")
+
+
+# FastRecheck class verifies the pieces of a torrent's payload, reusing the previous result where possible. With
+# use_mmap, pieces are hashed straight from memory maps of the files.
+class FastRecheck:
+    def __init__(self, meta_info, output_directory, workers=None, use_processes=False, file_priorities=None,
+                 use_mmap=False):
+        self.meta_info = meta_info
+        self.output_directory = output_directory
+        self.workers = workers
+        self.use_processes = use_processes
+        self.use_mmap = use_mmap
+        self.file_priorities = file_priorities
+        self.resume_file = resume_path(output_directory, meta_info.info_hash)
+
+    def load(self):
+        try:
+            with open(self.resume_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, piece_hashes, states):
+        state = {
+            "version": RESUME_VERSION,
+            "info_hash": self.meta_info.info_hash.hex(),
+            "piece_length": piece_hashes.piece_length,
+            "pieces": len(piece_hashes),
+            "bitfield": piece_hashes.bitfield.hex(),
+            "files": [list(file_state) if file_state else None for file_state in states],
+        }
+        # Write then rename, so an interrupted save never leaves a truncated resume file
+        temporary = self.resume_file + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temporary, self.resume_file)
+
+    # Returns the torrent's PieceHashTable with the verified pieces marked, and
+    # the number of pieces that actually had to be hashed.
+    def execute(self):
+        piece_hashes = self.meta_info.info.piece_hashes
+        piece_length = piece_hashes.piece_length
+        bt_files = self.meta_info.create_btfile_collection(use_mmap=self.use_mmap)
+        try:
+            files = bt_files.get_files()
+            states = bt_files.file_states(self.output_directory)
+            previous = self._previous_state(piece_hashes, len(files))
+
+            stale = set()
+            missing = set()
+            for index, (bt_file, state) in enumerate(zip(files, states)):
+                pieces = bt_files.file_pieces(bt_file, piece_length)
+                if state is None:
+                    missing.update(pieces)
+                elif previous is None or previous["files"][index] != list(state):
+                    stale.update(pieces)
+            stale -= missing
+            if self.file_priorities is not None:
+                priorities = self.file_priorities.piece_priorities()
+                unwanted = {index for index in stale if not priorities[index]}
+                missing |= unwanted
+                stale -= unwanted
+
+            piece_hashes.bitfield = bytes.fromhex(previous["bitfield"]) if previous else bytes(len(piece_hashes.bitfield))
+            for index in missing:
+                piece_hashes.set_verified(index, False)
+            verifier = VerifyPieces(bt_files, piece_length, self.output_directory, self.workers, self.use_processes)
+            for index, digest in verifier.digests(sorted(stale)):
+                piece_hashes.verify(index, digest)
+        finally:
+            bt_files.close()
+
+        if os.path.isdir(self.output_directory):
+            self.save(piece_hashes, states)
+        return piece_hashes, len(stale)
+
+    def _previous_state(self, piece_hashes, file_count):
+        previous = self.load()
+        if (previous is None or previous.get("version") != RESUME_VERSION
+                or previous.get("info_hash") != self.meta_info.info_hash.hex()
+                or previous.get("piece_length") != piece_hashes.piece_length
+                or previous.get("pieces") != len(piece_hashes)
+                or len(previous.get("files", ())) != file_count):
+            return None
+        return previous
@@ -0,0 +1,385 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Fetching metadata
+-----------------
+
+A magnet link only carries the info-hash of a torrent; its info dictionary (the metadata) is downloaded from peers
+with the metadata extension, ut_metadata (BEP 9), over the extension protocol (BEP 10):
+
+1. Both ends set the extension bit in their handshake and send an extension handshake. A peer that has the metadata
+   lists ut_metadata in its "m" dictionary and gives the size of the metadata as metadata_size.
+2. The metadata is split into 16 KiB pieces, requested one by one with a bencoded {"msg_type": 0, "piece": i}. The
+   answer is {"msg_type": 1, "piece": i, "total_size": n} followed by the piece data, or {"msg_type": 2, "piece": i}
+   when the peer rejects the request.
+
+Several peers are asked at once and share a MetadataAssembler, which hands each of them pieces nobody has requested
+yet; once every piece has been handed out, idle peers duplicate the requests still outstanding. The assembled
+dictionary is accepted only if its SHA-1 digest is the info-hash, and is then turned into a torrent file parsed by
+ParseTorrentFile, so a magnet link ends up as the same MetaInfo as a .torrent file would.
+"""
+
+import asyncio
+import collections
+import hashlib
+import logging
+
+from app.features.dht import DHTError
+from app.features.parse_torrent_file import BencodeDecoder, BencodeEncoder, BencodeDecodeError, ParseTorrentFile
+from app.features.tracker_client import TrackerClient, TrackerError, TrackerTiers
+from app.repositories import peer_wire
+from app.repositories.magnet_link import MagnetLink
+
+logger = logging.getLogger(__name__)
+
+UT_METADATA = "ut_metadata"
+# Extended message id peers are asked to send us ut_metadata messages with.
+UT_METADATA_ID = 1
+METADATA_PIECE_SIZE = 16 * 1024
+# Largest metadata accepted from a peer.
+MAX_METADATA_SIZE = 64 * 1024 * 1024
+# Times the assembled metadata may fail the info-hash check before giving up.
+MAX_METADATA_FAILURES = 3
+
+METADATA_REQUEST = 0
+METADATA_DATA = 1
+METADATA_REJECT = 2
+
+# Errors that end the connection with one peer, but not the fetch.
+PEER_ERRORS = (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, peer_wire.PeerWireError)
+
+
+class MetadataError(Exception):
+    """Raised when the metadata cannot be fetched from any peer."""
+
+
+def encode_extension_handshake(metadata_size=None):
+    fields = {"m": {UT_METADATA: UT_METADATA_ID}}
+    if metadata_size is not None:
+        fields["metadata_size"] = metadata_size
+    return BencodeEncoder().encode(fields)
+
+
+def decode_extension_handshake(payload):
+    try:
+        handshake = BencodeDecoder(payload, strict=False).decode()
+    except BencodeDecodeError as error:
+        raise peer_wire.PeerWireError(f"Invalid extension handshake: {error}") from None
+    if not isinstance(handshake, dict) or not isinstance(handshake.get("m", {}), dict):
+        raise peer_wire.PeerWireError("Invalid extension handshake")
+    return handshake
+
+
+def encode_metadata_message(msg_type, piece, total_size=None, data=b""):
+    fields = {"msg_type": msg_type, "piece": piece}
+    if total_size is not None:
+        fields["total_size"] = total_size
+    return BencodeEncoder().encode(fields) + bytes(data)
+
+
+# Returns (msg_type, piece, total_size, data) of a ut_metadata message; data follows the dictionary in data messages.
+def decode_metadata_message(payload):
+    decoder = BencodeDecoder(payload, strict=False)
+    try:
+        fields = decoder.decode()
+    except BencodeDecodeError as error:
+        raise peer_wire.PeerWireError(f"Invalid metadata message: {error}") from None
+    if not isinstance(fields, dict) or not isinstance(fields.get("msg_type"), int) \
+            or not isinstance(fields.get("piece"), int):
+        raise peer_wire.PeerWireError("Invalid metadata message")
+    return fields["msg_type"], fields["piece"], fields.get("total_size"), decoder.view[decoder.index:]
+
+
+class MetadataAssembler:
+    """
+    The MetadataAssembler class collects the metadata pieces sent by every peer:
+    - info_hash: The SHA-1 digest the metadata must have.
+    - size: The metadata size in use, chosen among those of the connected peers: the one that failed the
+      info-hash check the fewest times, then the one most peers report. None while no peer reported one.
+    - failures: How many times the assembled metadata failed the info-hash check.
+    """
+    def __init__(self, info_hash):
+        self.info_hash = info_hash
+        self.size = None
+        self.failures = 0
+        self._votes = collections.Counter()
+        self._failed = collections.Counter()
+        self._pieces = []
+        self._pending = collections.deque()
+
+    # Counts the size reported by a connected peer, returns whether it is usable. The size in use only changes
+    # when there is none, so peers that disagree wait for it to fail the info-hash check instead of being dropped.
+    def add_peer(self, size):
+        if not isinstance(size, int) or not 0 < size <= MAX_METADATA_SIZE:
+            return False
+        self._votes[size] += 1
+        if self.size is None:
+            self._choose()
+        return True
+
+    # Forgets the size of a peer that went away; when no connected peer has the size in use, another is chosen.
+    def remove_peer(self, size):
+        self._votes[size] -= 1
+        if self._votes[size] <= 0:
+            del self._votes[size]
+            if size == self.size and not self.is_complete():
+                self._choose()
+
+    def _choose(self):
+        self.size = min(self._votes, key=lambda size: (self._failed[size], -self._votes[size]), default=None)
+        self._reset()
+
+    def _reset(self):
+        count = (self.size + METADATA_PIECE_SIZE - 1) // METADATA_PIECE_SIZE if self.size else 0
+        self._pieces = [None] * count
+        self._pending = collections.deque(range(count))
+
+    def piece_length(self, piece):
+        return min(METADATA_PIECE_SIZE, self.size - piece * METADATA_PIECE_SIZE)
+
+    # Returns a piece to request that is not in exclude: one nobody asked for yet or, once every piece has been
+    # handed out, one still missing. None when there is none.
+    def next_piece(self, exclude=()):
+        while self._pending:
+            piece = self._pending.popleft()
+            if self._pieces[piece] is None:
+                return piece
+        for piece, data in enumerate(self._pieces):
+            if data is None and piece not in exclude:
+                return piece
+        return None
+
+    # Offers a requested piece again, e.g. when the peer rejected it or went away.
+    def release(self, piece):
+        if 0 <= piece < len(self._pieces) and self._pieces[piece] is None and piece not in self._pending:
+            self._pending.appendleft(piece)
+
+    # Stores a piece, returns True once the metadata is complete and matches the info-hash.
+    def add(self, piece, data):
+        if not 0 <= piece < len(self._pieces) or len(data) != self.piece_length(piece):
+            raise peer_wire.PeerWireError(f"Invalid metadata piece {piece}")
+        if self._pieces[piece] is None:
+            self._pieces[piece] = bytes(data)
+        if any(data is None for data in self._pieces):
+            return False
+        if hashlib.sha1(self.data()).digest() == self.info_hash:
+            return True
+        self.failures += 1
+        logger.warning("Metadata failed the info-hash check, fetching it again")
+        if self.failures >= MAX_METADATA_FAILURES:
+            raise MetadataError("The metadata sent by peers does not match the info-hash")
+        # The size itself may be wrong: choose again, preferring sizes that did not fail yet
+        self._failed[self.size] += 1
+        self._choose()
+        return False
+
+    def is_complete(self):
+        return bool(self._pieces) and all(data is not None for data in self._pieces)
+
+    def data(self):
+        return b"".join(self._pieces)
+
+
+# Builds the contents of a torrent file around a bencoded info dictionary, kept byte for byte so that its info-hash
+# does not change. "announce" and "announce-list" sort before "info", so the dictionary stays canonical.
+def torrent_file_bytes(info_bytes, trackers=()):
+    fields = {}
+    if trackers:
+        fields["announce"] = trackers[0]
+        fields["announce-list"] = [[url] for url in trackers]
+    return BencodeEncoder().encode(fields)[:-1] + b"4:info" + bytes(info_bytes) + b"e"
+
+
+# FetchMetadataUseCase class downloads the info dictionary of a magnet link (a MagnetLink or its URI) from up to
+# max_connections peers at once and returns the MetaInfo of the torrent; the torrent file contents are kept as
+# torrent_bytes, e.g. to be saved. Peers are those of the link, those its trackers return if it has any and, given a
+# running DHTNode as dht, those the DHT knows of.
+class FetchMetadataUseCase:
+
+    def __init__(self, magnet, peers=None, peer_id=None, max_connections=20, pipeline_depth=4, timeout=30,
+                 tracker_client=None, port=6881, dht=None):
+        self.magnet = magnet if isinstance(magnet, MagnetLink) else MagnetLink.parse(magnet)
+        self.peers = list(self.magnet.peers if peers is None else peers)
+        self.peer_id = peer_id or peer_wire.generate_peer_id()
+        self.max_connections = max_connections
+        self.pipeline_depth = pipeline_depth
+        self.timeout = timeout
+        self.tracker_client = tracker_client
+        self.port = port
+        self.dht = dht
+        self.assembler = MetadataAssembler(self.magnet.info_hash)
+        self.torrent_bytes = None
+        self.connections = set()
+        self._size_changed = asyncio.Event()
+        self._stopped = False
+        self.complete = None
+
+    def execute(self):
+        return asyncio.run(self.execute_async())
+
+    async def execute_async(self):
+        if self.magnet.trackers:
+            await self._announce()
+        if self.dht is not None:
+            await self._find_dht_peers()
+        if not self.peers:
+            raise MetadataError("No peers to fetch the metadata from")
+        self.complete = asyncio.Event()
+        slots = asyncio.Semaphore(self.max_connections)
+        tasks = [asyncio.create_task(self._fetch_from(host, port, slots)) for host, port in self.peers]
+        waiter = asyncio.create_task(self.complete.wait())
+        try:
+            running = set(tasks)
+            while running and not self.complete.is_set():
+                done, _ = await asyncio.wait(running | {waiter}, return_when=asyncio.FIRST_COMPLETED)
+                running -= done
+                if any(task is not waiter and task.exception() for task in done):
+                    break  # The metadata keeps failing the info-hash check
+        finally:
+            waiter.cancel()
+            self._stopped = True
+            self._notify_size()
+            for connection in list(self.connections):
+                connection.close()
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        if not self.complete.is_set():
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            raise MetadataError(f"Could not fetch the metadata of {self.magnet.info_hash.hex()} from any peer")
+        self.torrent_bytes = torrent_file_bytes(self.assembler.data(), self.magnet.trackers)
+        return ParseTorrentFile(self.magnet.name or self.magnet.info_hash.hex()).parse_bytes(self.torrent_bytes)
+
+    # Adds the peers returned by the trackers of the link.
+    async def _announce(self):
+        client = self.tracker_client or TrackerClient()
+        try:
+            tiers = TrackerTiers(self.magnet.tracker_tiers())
+            # The size is unknown until the metadata arrives: any amount left announces a leecher
+            response = await tiers.announce(client, self.magnet.info_hash, self.peer_id, self.port,
+                                            left=self.magnet.length or 1, event="started")
+            self.peers += [peer for peer in response.peers if peer not in self.peers]
+        except TrackerError as error:
+            logger.debug("Announce of %s failed: %s", self.magnet.info_hash.hex(), error)
+        finally:
+            if self.tracker_client is None:
+                client.close()
+
+    # Adds the peers of the torrent found on the DHT.
+    async def _find_dht_peers(self):
+        try:
+            peers = await self.dht.get_peers(self.magnet.info_hash)
+        except DHTError as error:
+            logger.debug("DHT lookup of %s failed: %s", self.magnet.info_hash.hex(), error)
+            return
+        self.peers += [peer for peer in peers if peer not in self.peers]
+
+    async def _fetch_from(self, host, port, slots):
+        async with slots:
+            if self.complete.is_set():
+                return
+            try:
+                connection = await peer_wire.PeerConnection.open(host, port, self.timeout)
+            except PEER_ERRORS as error:
+                logger.debug("Cannot connect to %s:%s: %r", host, port, error)
+                return
+            self.connections.add(connection)
+            requested = set()
+            try:
+                await connection.send_handshake(self.magnet.info_hash, self.peer_id, peer_wire.EXTENSION_PROTOCOL)
+                await connection.read_handshake(self.magnet.info_hash)
+                if not peer_wire.supports_extensions(connection.reserved):
+                    return
+                await connection.send_extended(peer_wire.EXTENDED_HANDSHAKE, encode_extension_handshake())
+                await self._exchange(connection, requested)
+            except PEER_ERRORS as error:
+                logger.debug("Peer %s:%s disconnected: %r", host, port, error)
+            finally:
+                self.connections.discard(connection)
+                for piece in requested:
+                    self.assembler.release(piece)
+                connection.close()
+
+    # Message loop of one peer until the metadata is complete or the peer cannot provide it.
+    async def _exchange(self, connection, requested):
+        remote_id = size = None
+        try:
+            while not self.complete.is_set():
+                if size is not None:
+                    if size != self.assembler.size:
+                        # The peer has other metadata than the size in use: wait until its own size is chosen
+                        requested.clear()
+                        if not await self._wait_for_size(size):
+                            return
+                    while len(requested) < self.pipeline_depth:
+                        piece = self.assembler.next_piece(requested)
+                        if piece is None:
+                            break
+                        requested.add(piece)
+                        connection.write_message(peer_wire.EXTENDED, bytes([remote_id]) +
+                                                 encode_metadata_message(METADATA_REQUEST, piece))
+                    await connection.drain()
+                message_id, payload = await connection.read_message()
+                if message_id != peer_wire.EXTENDED:
+                    continue
+                extended_id, payload = peer_wire.decode_extended(payload)
+                if extended_id == peer_wire.EXTENDED_HANDSHAKE and size is None:
+                    handshake = decode_extension_handshake(payload)
+                    remote_id = handshake.get("m", {}).get(UT_METADATA)
+                    if not isinstance(remote_id, int) or not 0 < remote_id < 256 \
+                            or not self.assembler.add_peer(handshake.get("metadata_size")):
+                        return  # The peer does not have the metadata
+                    size = handshake["metadata_size"]
+                    self._notify_size()
+                elif extended_id == UT_METADATA_ID:
+                    msg_type, piece, _, data = decode_metadata_message(payload)
+                    if piece not in requested:
+                        continue
+                    requested.discard(piece)
+                    if size != self.assembler.size:
+                        continue  # Asked for before the size in use changed
+                    if msg_type == METADATA_REJECT:
+                        self.assembler.release(piece)
+                        return
+                    if msg_type == METADATA_DATA and self.assembler.add(piece, data):
+                        self.complete.set()
+                        return
+                    self._notify_size()
+        finally:
+            if size is not None:
+                self.assembler.remove_peer(size)
+                self._notify_size()
+
+    # Returns once the assembler uses size, or False when the fetch ends before.
+    async def _wait_for_size(self, size):
+        while size != self.assembler.size:
+            if self.complete.is_set() or self._stopped:
+                return False
+            await self._size_changed.wait()
+        return True
+
+    # Wakes up the peers waiting in _wait_for_size, e.g. after the size in use changed.
+    def _notify_size(self):
+        self._size_changed.set()
+        self._size_changed = asyncio.Event()
@@ -0,0 +1,139 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Bulk indexing
+-------------
+
+Catalogues a directory tree of .torrent files: every file is parsed with ParseTorrentFile and summarised as one JSON
+object per line (JSON Lines):
+
+    {"path": ..., "name": ..., "info_hash": ..., "total_size": ..., "file_count": ..., "trackers": [...]}
+
+Parsing is spread over a process pool. Paths are sent to the workers in chunks, which keeps the inter-process traffic
+to a few messages per chunk size torrents, and only a bounded number of chunks is in flight at any time. Records are
+written as soon as their chunk is done, in directory walk order, so memory stays flat however large the collection.
+A file that cannot be read or parsed gets an {"path": ..., "error": ...} record and does not stop the others.
+"""
+
+import collections
+import concurrent.futures
+import json
+import os
+
+from app.features.parse_torrent_file import ParseTorrentFile
+
+# Torrent files sent to a worker at a time.
+CHUNK_SIZE = 64
+
+
+# Yields the paths of the .torrent files under root, walking it depth first in name order.
+def iter_torrent_paths(root):
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.name.endswith(".torrent") and entry.is_file():
+                yield entry.path
+        directories.extend(reversed(subdirectories))
+
+
+# Parses one torrent file into its index record.
+def index_torrent(path):
+    try:
+        meta_info = ParseTorrentFile(path).execute()
+        trackers = list(dict.fromkeys(str(tracker) for tier in meta_info.tracker_tiers() for tracker in tier))
+        record = {
+            "path": path,
+            "name": meta_info.info.name,
+            "info_hash": meta_info.info_hash.hex(),
+            "total_size": meta_info.info.total_length(),
+            "file_count": len(meta_info.files) if meta_info.files else 1,
+            "trackers": trackers,
+        }
+        if meta_info.info_hash_v2 is not None:
+            record["info_hash_v2"] = meta_info.info_hash_v2.hex()
+        return record
+    except Exception as error:
+        return {"path": path, "error": f"{type(error).__name__}: {error}"}
+
+
+def index_chunk(paths):
+    return [index_torrent(path) for path in paths]
+
+
+def _chunks(paths, size):
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# IndexTorrentsUseCase class writes the JSON Lines index of the torrent files under root to output (a text file).
+class IndexTorrentsUseCase:
+    def __init__(self, root, output, workers=None, chunk_size=CHUNK_SIZE):
+        self.root = root
+        self.output = output
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        # Chunks in flight: enough to keep every worker busy while results are written
+        self.max_in_flight = 2 * self.workers
+
+    # Yields the index records, in walk order.
+    def records(self):
+        chunks = _chunks(iter_torrent_paths(self.root), self.chunk_size)
+        if self.workers == 1:
+            for chunk in chunks:
+                yield from index_chunk(chunk)
+            return
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as executor:
+            pending = collections.deque()
+            for chunk in chunks:
+                if len(pending) >= self.max_in_flight:
+                    yield from pending.popleft().result()
+                pending.append(executor.submit(index_chunk, chunk))
+            while pending:
+                yield from pending.popleft().result()
+
+    # Writes every record and returns (torrents indexed, errors).
+    def execute(self):
+        indexed = errors = 0
+        for record in self.records():
+            self.output.write(json.dumps(record) + "\n")
+            if "error" in record:
+                errors += 1
+            else:
+                indexed += 1
+        self.output.flush()
+        return indexed, errors
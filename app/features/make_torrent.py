@@ -0,0 +1,151 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Torrent creation
+----------------
+
+Builds a .torrent file for a file or a directory tree:
+
+1. The files are listed (a directory is walked in name order) into a BTFileCollection, laid out one after another as
+   the torrent payload.
+2. Unless given, the piece length is chosen from the total size: the smallest power of two from 16 KiB up to 16 MiB
+   that keeps the torrent under TARGET_PIECES pieces, so the metainfo stays small for any dataset.
+3. The pieces are hashed in parallel with VerifyPieces, through the collection's offset-based reads. Digests come
+   back in order and at most memory_budget bytes of piece data are in flight. Only the 20-byte hashes are kept, so a
+   multi-terabyte dataset is hashed with bounded memory. progress(done, total) is called as the bytes are hashed.
+4. The metainfo is written with BencodeEncoder.
+"""
+
+import hashlib
+import os
+import time
+
+from app.features.parse_torrent_file import BencodeEncoder
+from app.features.verify_pieces import VerifyPieces, MEMORY_BUDGET
+from app.repositories.bt_file import BTFileCollection
+from app.repositories.file_table import FileTable
+
+MIN_PIECE_LENGTH = 16 * 1024
+MAX_PIECE_LENGTH = 16 * 1024 * 1024
+TARGET_PIECES = 2000
+
+CREATED_BY = "download_torrent_cli/1.0"
+
+
+# Returns the piece length for a payload of total_size bytes.
+def auto_piece_length(total_size):
+    piece_length = MIN_PIECE_LENGTH
+    while piece_length < MAX_PIECE_LENGTH and total_size > piece_length * TARGET_PIECES:
+        piece_length *= 2
+    return piece_length
+
+
+# Lists the files to share as (path relative to the root directory, size), in name order.
+def walk_files(root):
+    files = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                files.append((os.path.relpath(path, root), os.path.getsize(path)))
+    files.sort(key=lambda file: file[0].split(os.sep))
+    return files
+
+
+# MakeTorrentUseCase class creates the .torrent file for the file or directory at source. With use_mmap, the pieces
+# are hashed straight from memory maps of the files.
+class MakeTorrentUseCase:
+    def __init__(self, source, output_path, trackers=None, piece_length=None, comment=None, private=False,
+                 workers=None, use_processes=False, memory_budget=MEMORY_BUDGET, progress=None, use_mmap=False):
+        self.source = os.path.abspath(source)
+        self.output_path = output_path
+        # Trackers as tiers: a list of URLs is one tier per URL. Empty tiers are left out
+        self.trackers = [[tier] if isinstance(tier, str) else list(tier) for tier in trackers or [] if tier]
+        self.piece_length = piece_length
+        self.comment = comment
+        self.private = private
+        self.workers = workers
+        self.use_processes = use_processes
+        self.memory_budget = memory_budget
+        self.progress = progress
+        self.use_mmap = use_mmap
+
+    # Returns the BTFileCollection of the payload and the directory its paths are relative to.
+    def create_btfile_collection(self):
+        if os.path.isdir(self.source):
+            root, files = self.source, walk_files(self.source)
+        else:
+            root, files = os.path.dirname(self.source), [(os.path.basename(self.source), os.path.getsize(self.source))]
+        table = FileTable()
+        for path, size in files:
+            table.append(path.split(os.sep), size)
+        return BTFileCollection(table, use_mmap=self.use_mmap), root
+
+    # Hashes the payload and returns the concatenated piece hashes.
+    def hash_pieces(self, collection, root, piece_length):
+        total = collection.total_size()
+        pieces = bytearray()
+        verifier = VerifyPieces(collection, piece_length, root, self.workers, self.use_processes, self.memory_budget)
+        for index, digest in verifier.digests():
+            pieces += digest
+            if self.progress is not None:
+                self.progress(min(total, (index + 1) * piece_length), total)
+        return pieces
+
+    def info_dictionary(self, collection, piece_length, pieces):
+        info = {"name": os.path.basename(self.source), "piece length": piece_length, "pieces": pieces}
+        if os.path.isdir(self.source):
+            info["files"] = [{"length": bt_file.size, "path": bt_file.components}
+                             for bt_file in collection.get_files()]
+        else:
+            info["length"] = collection.total_size()
+        if self.private:
+            info["private"] = 1
+        return info
+
+    # Writes the .torrent file and returns its info-hash.
+    def execute(self):
+        collection, root = self.create_btfile_collection()
+        try:
+            total = collection.total_size()
+            if total == 0:
+                raise ValueError(f"Nothing to share in {self.source}")
+            piece_length = self.piece_length or auto_piece_length(total)
+            info = self.info_dictionary(collection, piece_length, self.hash_pieces(collection, root, piece_length))
+        finally:
+            collection.close()
+
+        metainfo = {"info": info, "created by": CREATED_BY, "creation date": int(time.time())}
+        if self.trackers:
+            metainfo["announce"] = self.trackers[0][0]
+            if len(self.trackers) > 1 or len(self.trackers[0]) > 1:
+                metainfo["announce-list"] = self.trackers
+        if self.comment:
+            metainfo["comment"] = self.comment
+        # Write then rename, so an interrupted run never leaves a truncated .torrent file
+        temporary = self.output_path + ".tmp"
+        with open(temporary, "wb") as f:
+            BencodeEncoder(f).encode(metainfo)
+        os.replace(temporary, self.output_path)
+        return hashlib.sha1(BencodeEncoder().encode(info)).digest()
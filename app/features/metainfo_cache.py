@@ -0,0 +1,232 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Metainfo cache
+--------------
+
+Decoding a large .torrent file again on every run costs real time. MetaInfoCache keeps the result of
+ParseTorrentFile.execute() in a cache directory, in a binary format that is loaded without any bencode decoding:
+
+    magic 'BTMC' | format version (1 byte) | header length (4 bytes, big endian) | header | info dictionary or pieces
+
+The header is the marshal serialization of the small fields (trackers, names, file list, info-hashes...). The raw
+bencoded info dictionary follows it unchanged when the MetaInfo kept it (so a seeder can serve it to magnet links),
+otherwise just the pieces table; the header says where the pieces table is. An entry is opened as a read-only memory
+map, and the pieces table and info dictionary handed to the MetaInfo are memoryviews of that map: their pages are only
+read from disk when they are actually looked at.
+
+Entries are named after the SHA-1 of the .torrent file content. A small alias file, named after the file's path,
+size and modification time, points to its entry, so a hit needs a single stat() of the .torrent file. When the alias
+does not match (the file was touched, copied or renamed), the content is hashed, and an entry with the same content
+is still found. Entries and aliases are evicted least recently used first once they take more than max_size bytes;
+hits refresh the modification time used for that order.
+
+The cache directory must be trusted: marshal data is not meant to be loaded from untrusted sources.
+"""
+
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+
+from app.features.parse_torrent_file import ParseTorrentFile
+from app.repositories.file_table import FileTable
+from app.repositories.meta_info import MetaInfo, TorrentInfo, Tracker
+
+MAGIC = b"BTMC"
+FORMAT_VERSION = 2
+MARSHAL_VERSION = 4
+_PREFIX = struct.Struct(">4sBI")
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+# Serializes a MetaInfo into the cache entry format.
+def dump_meta_info(meta_info):
+    info = meta_info.info
+    pieces = bytes(info.pieces)
+    body, pieces_offset = pieces, 0
+    info_bytes = getattr(meta_info, "info_bytes", None)
+    if info_bytes is not None:
+        info_bytes = bytes(info_bytes)
+        key = b"6:pieces%d:" % len(pieces)
+        found = info_bytes.find(key + pieces)
+        if found >= 0:
+            body, pieces_offset = info_bytes, found + len(key)
+    tiers = meta_info.announce_tiers or []
+    header = marshal.dumps({
+        "announce": str(meta_info.announce) if meta_info.announce is not None else None,
+        "announce_list": [str(tracker) for tracker in meta_info.announce_list or []],
+        "announce_tiers": [[str(tracker) for tracker in tier] for tier in tiers],
+        "comment": meta_info.comment,
+        "created_by": meta_info.created_by,
+        "creation_date": meta_info.creation_date,
+        "encoding": meta_info.encoding,
+        "name": info.name,
+        "piece_length": info.piece_length,
+        "length": info.length,
+        "private": info.private,
+        "files": None if meta_info.files is None else [(f.path, f.length) for f in meta_info.files],
+        "info_hash": meta_info.info_hash,
+        "info_hash_v2": meta_info.info_hash_v2,
+        "info_dictionary": body is not pieces,
+        "pieces": (pieces_offset, len(pieces)),
+    }, MARSHAL_VERSION)
+    return _PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)) + header + body
+
+
+# Builds a MetaInfo from a cache entry; data may be a memory map, whose pieces table is then not copied.
+def load_meta_info(data):
+    view = memoryview(data)
+    if len(view) < _PREFIX.size:
+        raise ValueError("Truncated cache entry")
+    magic, version, header_length = _PREFIX.unpack_from(view)
+    if magic != MAGIC or version != FORMAT_VERSION or _PREFIX.size + header_length > len(view):
+        raise ValueError("Not a cache entry of this version")
+    header = marshal.loads(view[_PREFIX.size:_PREFIX.size + header_length])
+    body = view[_PREFIX.size + header_length:]
+    pieces_offset, pieces_length = header["pieces"]
+    if pieces_offset + pieces_length > len(body):
+        raise ValueError("Truncated cache entry")
+    pieces = body[pieces_offset:pieces_offset + pieces_length]
+    files = None
+    if header["files"] is not None:
+        files = FileTable()
+        for path, length in header["files"]:
+            files.append(path, length)
+    info = TorrentInfo(name=header["name"], piece_length=header["piece_length"], pieces=pieces,
+                       length=header["length"], files=files, private=header["private"])
+    return MetaInfo(
+        announce=Tracker(header["announce"]) if header["announce"] is not None else None,
+        announce_list=[Tracker(url) for url in header["announce_list"]],
+        announce_tiers=[[Tracker(url) for url in tier] for tier in header["announce_tiers"]],
+        comment=header["comment"],
+        created_by=header["created_by"],
+        creation_date=header["creation_date"],
+        encoding=header["encoding"],
+        info=info,
+        files=files,
+        info_hash=header["info_hash"],
+        info_hash_v2=header["info_hash_v2"],
+        info_bytes=body if header["info_dictionary"] else None,
+    )
+
+
+# MetaInfoCache class returns the MetaInfo of .torrent files, parsing each distinct file only once.
+class MetaInfoCache:
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _alias_path(self, file_path, stat):
+        key = f"{os.path.realpath(file_path)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode("utf-8", "surrogateescape")
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + ".alias")
+
+    def _entry_path(self, content_hash):
+        return os.path.join(self.directory, content_hash + ".meta")
+
+    # Returns the MetaInfo of the .torrent file at file_path.
+    def load(self, file_path):
+        stat = os.stat(file_path)
+        alias = self._alias_path(file_path, stat)
+        try:
+            with open(alias, "r", encoding="ascii") as f:
+                meta_info = self._open_entry(f.read().strip())
+            if meta_info is not None:
+                self._touch(alias)
+                self.hits += 1
+                return meta_info
+        except (FileNotFoundError, ValueError):
+            pass
+
+        with open(file_path, "rb") as f:
+            content_hash = hashlib.sha1(f.read()).hexdigest()
+        meta_info = self._open_entry(content_hash)
+        if meta_info is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            meta_info = ParseTorrentFile(file_path).execute()
+            self._write(self._entry_path(content_hash), dump_meta_info(meta_info))
+        self._write(alias, content_hash.encode("ascii"))
+        self._evict()
+        return meta_info
+
+    # Loads an entry, or returns None if it is missing or unreadable.
+    def _open_entry(self, content_hash):
+        path = self._entry_path(content_hash)
+        try:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            meta_info = load_meta_info(data)
+        except (FileNotFoundError, ValueError, EOFError, KeyError, TypeError):
+            return None
+        self._touch(path)
+        return meta_info
+
+    def _write(self, path, data):
+        # Write then rename, so readers never see a partial entry
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    # Removes the least recently used files until the cache fits in max_size.
+    def _evict(self):
+        files = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((".meta", ".alias")):
+                stat = entry.stat()
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+        for _, size, path in sorted(files):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    # Total size of the cache files, in bytes.
+    def size(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory)
+                   if entry.name.endswith((".meta", ".alias")))
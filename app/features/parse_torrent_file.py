@@ -46,98 +46,642 @@ For more information on the BitTorrent protocol,
 please refer to the [official BitTorrent specification](https://www.bittorrent.org/beps/bep_0003.html).
 """
 
+import hashlib
+import io
+import mmap
+import os
 import urllib.parse
-from app.repositories.meta_info import TorrentInfo, MetaInfo, TorrentFile, Tracker, FileInfo
+from app.repositories.file_table import FileTable
+from app.repositories.meta_info import TorrentInfo, MetaInfo, Tracker, FileInfo
+
+# Byte strings at least this long are returned as zero-copy memoryview slices
+# of the input buffer instead of bytes copies (e.g. the 'pieces' blob).
+VIEW_THRESHOLD = 1024
+
+_DICT = ord(b'd')
+_LIST = ord(b'l')
+_INT = ord(b'i')
+_END = ord(b'e')
+_COLON = ord(b':')
+_ZERO = ord(b'0')
+_NINE = ord(b'9')
+
+
+class BencodeDecodeError(ValueError):
+    """Raised when the input is not valid, canonical bencoded data."""
+
+
+# Dictionary keys are returned as text. A few keys are binary (the info-hashes
+# keying a scrape response): bytes that are not UTF-8 are kept as surrogate
+# escapes, and key.encode("utf-8", "surrogateescape") gives them back.
+def _key(raw_key):
+    return raw_key.decode("utf-8", "surrogateescape")
+
 
 # BencodeDecoder class is responsible for decoding bencoded data.
+#
+# The whole value is decoded in a single pass over the buffer: integers and
+# length prefixes are located with bytes.find and validated in bulk instead of
+# byte by byte, and byte strings of at least view_threshold bytes are returned
+# as memoryview slices sharing the input buffer rather than copies.
+#
+# In strict mode (the default) only canonical bencoding is accepted: no leading
+# zeros, no i-0e, and dictionary keys unique and sorted as raw bytes.
 class BencodeDecoder:
-    def __init__(self, data, index=0):
-        self.data = data
+    def __init__(self, data, index=0, view_threshold=VIEW_THRESHOLD, strict=True):
+        # bytes.find needs a contiguous bytes-like object (bytes or a memory map),
+        # zero-copy slicing needs a view; keep both over the same buffer. Anything
+        # else, bytearray included, is copied once: its slices would be mutable
+        # bytearrays, unusable as dictionary keys.
+        self.data = data if isinstance(data, (bytes, mmap.mmap)) else bytes(data)
+        self.view = memoryview(self.data)
         self.index = index
+        self.view_threshold = view_threshold
+        self.strict = strict
+        self._decode_at, self._string_span, self._skip = self._engine()
 
-    # The decode method determines the appropriate decoding method to use.
+    # Decodes the value starting at self.index and leaves self.index just past it.
     def decode(self):
-        if self.data[self.index] == ord(b'd'):
-            return self.decode_dictionary()
-        elif self.data[self.index] == ord(b'l'):
-            return self.decode_list()
-        elif self.data[self.index] == ord(b'i'):
-            return self.decode_integer()
-        else:
-            return self.decode_string()
+        value, self.index = self.decode_at(self.index)
+        return value
 
-    # Decodes a bencoded dictionary.
-    def decode_dictionary(self):
+    # Decodes the value starting at index, returns it with the offset just past it.
+    def decode_at(self, index):
+        try:
+            return self._decode_at(index)
+        except (IndexError, RecursionError):
+            raise BencodeDecodeError(f"Truncated or malformed data after offset {index}") from None
+
+    # Decodes the dictionary starting at self.index like decode() does, and also
+    # records the (start, end) offsets of each of its values, e.g. the exact bytes
+    # of the 'info' dictionary. Returns the dictionary and the spans by key.
+    def decode_with_spans(self):
+        data = self.data
+        index = self.index
+        if index >= len(data) or data[index] != _DICT:
+            raise BencodeDecodeError(f"Expected a dictionary at offset {index}")
         dct = {}
-        self.index += 1
-        while self.data[self.index] != ord(b'e'):
-            key = self.decode_string()
-            value = self.decode()
-            dct[key.decode()] = value
-        self.index += 1
-        return dct
-
-    # Decodes a bencoded list.
-    def decode_list(self):
-        lst = []
-        self.index += 1
-        while self.data[self.index] != ord(b'e'):
-            item = self.decode()
-            lst.append(item)
-        self.index += 1
-        return lst
-
-    # Decodes a bencoded integer.
-    def decode_integer(self):
-        end = self.data.index(b'e', self.index)
-        integer = int(self.data[self.index + 1:end])
-        self.index = end + 1
-        return integer
-
-    # Decodes a bencoded string.
-    def decode_string(self):
-        start = self.index
-        while chr(self.data[self.index]).isdigit():
-            self.index += 1
-        colon = self.data.index(b':', self.index)
-        length = int(self.data[start:colon].decode())
-        end = colon + 1 + length
-        string = self.data[colon + 1:end]
-        self.index = end
-        return string
+        spans = {}
+        previous_key = None
+        index += 1
+        try:
+            while data[index] != _END:
+                start, end = self._string_span(index)
+                key = data[start:end]
+                if self.strict and previous_key is not None and key <= previous_key:
+                    raise BencodeDecodeError(f"Dictionary key {key!r} at offset {index} is not sorted or duplicated")
+                previous_key = key
+                text_key = _key(key)
+                dct[text_key], index = self._decode_at(end)
+                spans[text_key] = (end, index)
+        except (IndexError, RecursionError):
+            raise BencodeDecodeError(f"Truncated or malformed data after offset {index}") from None
+        self.index = index + 1
+        return dct, spans
+
+    # Returns the offset just past the value starting at index without building
+    # any Python object for it. Skipped values are only checked structurally.
+    def skip(self, index):
+        try:
+            return self._skip(index)
+        except IndexError:
+            raise BencodeDecodeError(f"Truncated or malformed data after offset {index}") from None
+
+    # The decoding functions are closures over the buffer so that the hot loop
+    # only touches local variables.
+    def _engine(self):
+        data = self.data
+        view = self.view
+        find = data.find
+        size = len(data)
+        view_threshold = self.view_threshold
+        strict = self.strict
+        key_cache = {}
+
+        # Returns the (start, end) offsets of the string whose prefix starts at index.
+        def string_span(index):
+            first = data[index]
+            if data[index + 1] == _COLON and _ZERO <= first <= _NINE:
+                # Single digit length, by far the most common case.
+                start = index + 2
+                end = start + first - _ZERO
+            else:
+                colon = find(b':', index)
+                digits = data[index:colon]
+                if colon < 0 or not digits.isdigit() or first == _ZERO:
+                    raise BencodeDecodeError(f"Invalid string length at offset {index}")
+                start = colon + 1
+                end = start + int(digits)
+            if end > size:
+                raise BencodeDecodeError(f"String at offset {index} runs past the end of data")
+            return start, end
+
+        def decode_integer(index):
+            end = find(b'e', index)
+            digits = data[index + 1:end]
+            if end < 0 or not digits.isdigit() or (digits[0] == _ZERO and len(digits) > 1):
+                # Negative numbers: '-' followed by a non-zero leading digit.
+                if end < 0 or digits[:1] != b'-' or not digits[1:].isdigit() or digits[1] == _ZERO:
+                    raise BencodeDecodeError(f"Invalid integer at offset {index}")
+            return int(digits), end + 1
+
+        def decode_dictionary(index):
+            dct = {}
+            previous_key = None
+            index += 1
+            while data[index] != _END:
+                start, end = string_span(index)
+                key = data[start:end]
+                if strict and previous_key is not None and key <= previous_key:
+                    raise BencodeDecodeError(f"Dictionary key {key!r} at offset {index} is not sorted or duplicated")
+                previous_key = key
+                # Keys repeat a lot ('length', 'path'...), decode each one once.
+                text_key = key_cache.get(key)
+                if text_key is None:
+                    text_key = key_cache[key] = _key(key)
+                dct[text_key], index = decode(end)
+            return dct, index + 1
+
+        def decode_list(index):
+            lst = []
+            append = lst.append
+            index += 1
+            while data[index] != _END:
+                item, index = decode(index)
+                append(item)
+            return lst, index + 1
+
+        # Determines the appropriate decoding function to use.
+        def decode(index):
+            token = data[index]
+            if token == _DICT:
+                return decode_dictionary(index)
+            if token == _LIST:
+                return decode_list(index)
+            if token == _INT:
+                return decode_integer(index)
+            if _ZERO <= token <= _NINE:
+                start, end = string_span(index)
+                if end - start >= view_threshold:
+                    return view[start:end], end
+                return data[start:end], end
+            raise BencodeDecodeError(f"Unexpected byte {chr(token)!r} at offset {index}")
+
+        # Walks a value's tokens to find where it ends: strings are jumped over
+        # by their length prefix, integers by their terminator.
+        def skip(index):
+            depth = 0
+            while True:
+                token = data[index]
+                if token == _DICT or token == _LIST:
+                    depth += 1
+                    index += 1
+                    continue
+                if token == _END:
+                    if depth == 0:
+                        raise BencodeDecodeError(f"Unexpected end marker at offset {index}")
+                    depth -= 1
+                    index += 1
+                elif token == _INT:
+                    end = find(b'e', index)
+                    if end < 0:
+                        raise BencodeDecodeError(f"Invalid integer at offset {index}")
+                    index = end + 1
+                elif _ZERO <= token <= _NINE:
+                    index = string_span(index)[1]
+                else:
+                    raise BencodeDecodeError(f"Unexpected byte {chr(token)!r} at offset {index}")
+                if depth == 0:
+                    return index
+
+        return decode, string_span, skip
+
+
+# LazyBencodeDecoder class returns proxies instead of decoded containers.
+#
+# Dictionaries and lists come back as LazyBencodeDict / LazyBencodeList objects
+# that only locate and decode their children when they are accessed; children
+# that are never looked at are skipped over without creating any object. Each
+# proxy can also return the exact raw bytes of a child (e.g. the 'info' slice),
+# so metadata-only queries cost O(bytes touched) instead of O(file size).
+class LazyBencodeDecoder:
+    def __init__(self, data, index=0, view_threshold=VIEW_THRESHOLD, strict=True):
+        self.decoder = BencodeDecoder(data, index, view_threshold, strict)
+
+    def decode(self):
+        return _lazy_value(self.decoder, self.decoder.index)
+
+
+def _lazy_value(decoder, index):
+    token = decoder.data[index]
+    if token == _DICT:
+        return LazyBencodeDict(decoder, index)
+    if token == _LIST:
+        return LazyBencodeList(decoder, index)
+    return decoder.decode_at(index)[0]
+
+
+# Dictionary proxy. Keys are scanned incrementally, only as far as needed to
+# answer a lookup: since keys are sorted, a missing key is detected as soon as a
+# greater key is reached.
+class LazyBencodeDict:
+    __slots__ = ("decoder", "start", "_spans", "_values", "_cursor", "_last_key", "_end")
+
+    def __init__(self, decoder, start):
+        self.decoder = decoder
+        self.start = start
+        self._spans = {}  # key -> (start, end) of its value
+        self._values = {}
+        self._cursor = start + 1
+        self._last_key = None
+        self._end = None
+
+    # Scans key/value pairs until key (bytes) is found or the dictionary ends.
+    def _scan(self, key=None):
+        decoder = self.decoder
+        data = decoder.data
+        while self._end is None:
+            if key is not None and decoder.strict and self._last_key is not None and self._last_key >= key:
+                return
+            index = self._cursor
+            try:
+                if data[index] == _END:
+                    self._end = index + 1
+                    return
+                start, end = decoder._string_span(index)
+            except IndexError:
+                raise BencodeDecodeError("Unterminated dictionary") from None
+            raw_key = data[start:end]
+            if decoder.strict and self._last_key is not None and raw_key <= self._last_key:
+                raise BencodeDecodeError(f"Dictionary key {raw_key!r} at offset {index} is not sorted or duplicated")
+            value_end = decoder.skip(end)
+            self._spans[_key(raw_key)] = (end, value_end)
+            self._last_key = raw_key
+            self._cursor = value_end
+
+    def _find(self, key):
+        if key not in self._spans and self._end is None:
+            self._scan(key.encode())
+        return self._spans[key]
+
+    # Returns the (start, end) offsets of the whole dictionary, or of a value.
+    def span(self, key=None):
+        if key is not None:
+            return self._find(key)
+        self._scan()
+        return self.start, self._end
+
+    # Returns the raw bencoded bytes of the dictionary, or of a value, as a
+    # memoryview slice of the input buffer.
+    def raw(self, key=None):
+        start, end = self.span(key)
+        return self.decoder.view[start:end]
+
+    # Fully decodes the dictionary into plain Python objects.
+    def materialize(self):
+        return self.decoder.decode_at(self.start)[0]
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        value = self._values[key] = _lazy_value(self.decoder, self._find(key)[0])
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self._find(key)
+        except KeyError:
+            return False
+        return True
+
+    def keys(self):
+        self._scan()
+        return self._spans.keys()
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return f"LazyBencodeDict(start={self.start})"
+
+
+# List proxy. Item offsets are found incrementally, up to the requested index.
+class LazyBencodeList:
+    __slots__ = ("decoder", "start", "_spans", "_values", "_end")
+
+    def __init__(self, decoder, start):
+        self.decoder = decoder
+        self.start = start
+        self._spans = []  # (start, end) of each item found so far
+        self._values = {}
+        self._end = None
+
+    def _scan(self, index=None):
+        decoder = self.decoder
+        data = decoder.data
+        cursor = self._spans[-1][1] if self._spans else self.start + 1
+        while self._end is None and (index is None or len(self._spans) <= index):
+            try:
+                if data[cursor] == _END:
+                    self._end = cursor + 1
+                    return
+            except IndexError:
+                raise BencodeDecodeError("Unterminated list") from None
+            item_end = decoder.skip(cursor)
+            self._spans.append((cursor, item_end))
+            cursor = item_end
+
+    def _find(self, index):
+        if index < 0:
+            index += len(self)
+        if index >= len(self._spans):
+            self._scan(index)
+        if not 0 <= index < len(self._spans):
+            raise IndexError("list index out of range")
+        return index, self._spans[index]
+
+    def span(self, index=None):
+        if index is not None:
+            return self._find(index)[1]
+        self._scan()
+        return self.start, self._end
+
+    def raw(self, index=None):
+        start, end = self.span(index)
+        return self.decoder.view[start:end]
+
+    def materialize(self):
+        return self.decoder.decode_at(self.start)[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index, (start, _) = self._find(index)
+        try:
+            return self._values[index]
+        except KeyError:
+            pass
+        value = self._values[index] = _lazy_value(self.decoder, start)
+        return value
+
+    def __iter__(self):
+        index = 0
+        while True:
+            try:
+                yield self[index]
+            except IndexError:
+                return
+            index += 1
+
+    def __len__(self):
+        self._scan()
+        return len(self._spans)
+
+    def __repr__(self):
+        return f"LazyBencodeList(start={self.start})"
+
+
+def _raw_key(key):
+    if isinstance(key, str):
+        return key.encode("utf-8", "surrogateescape")
+    if isinstance(key, (bytes, bytearray, memoryview)):
+        return bytes(key)
+    raise TypeError(f"Dictionary keys must be strings, not {type(key).__name__}")
+
+
+# BencodeEncoder class is responsible for encoding values as bencoded data, the reverse of BencodeDecoder.
+#
+# Values are taken in the form the decoder produces them: dictionaries (str or bytes keys, written sorted as raw
+# bytes; str keys are UTF-8 with surrogate escapes restored), lists or tuples, integers, and byte strings given as
+# bytes, bytearray, memoryview or str. Lazy dictionaries and lists are copied from their raw span as they are. So
+# decoding a canonical file and encoding the result gives back the same bytes.
+#
+# The output is written incrementally to output: a bytearray is appended to, anything else must have a write()
+# method (e.g. a file). Small tokens are gathered in a buffer allocated once with buffer_size bytes, written out as
+# soon as a token fills it, so no write is much larger than buffer_size. Byte strings of at least view_threshold bytes
+# (such as 'pieces') are written straight from the caller's object as memoryviews and never copied into the buffer.
+class BencodeEncoder:
+    def __init__(self, output=None, buffer_size=64 * 1024, view_threshold=VIEW_THRESHOLD):
+        self.output = output
+        self.buffer_size = buffer_size
+        self.view_threshold = view_threshold
+
+    # Encodes value into output; without an output, returns the encoding as bytes.
+    def encode(self, value):
+        output = bytearray() if self.output is None else self.output
+        if isinstance(output, bytearray):
+            self._encode(value, output, None)
+        else:
+            # Allocated once with buffer_size bytes, then overwritten from its start after each write
+            self._encode(value, io.BytesIO(bytes(self.buffer_size)), output.write)
+        return bytes(output) if self.output is None else None
+
+    # Without write, tokens are appended to the bytearray buffer; with it, buffer is a BytesIO written out by write.
+    def _encode(self, value, buffer, write):
+        buffer_size = self.buffer_size
+        view_threshold = self.view_threshold
+        if write is None:
+            extend, position = buffer.extend, None
+        else:
+            extend, position = buffer.write, buffer.tell
+
+        def flush():
+            used = buffer.tell()
+            if used:
+                write(buffer.getbuffer()[:used].tobytes())
+                buffer.seek(0)
+
+        def encode_string(string):
+            if type(string) is memoryview and (string.ndim != 1 or string.itemsize != 1):
+                string = string.cast("B")
+            length = len(string)
+            extend(b"%d:" % length)
+            if write is not None and length >= view_threshold:
+                # Hand large values over as they are, after what is buffered
+                flush()
+                write(memoryview(string))
+                return
+            extend(string)
+
+        def encode_dictionary(dct):
+            extend(b"d")
+            items = [(_raw_key(key), item) for key, item in dct.items()]
+            items.sort(key=lambda pair: pair[0])
+            previous = None
+            for key, item in items:
+                if key == previous:
+                    raise ValueError(f"Duplicate dictionary key {key!r}")
+                previous = key
+                extend(b"%d:" % len(key))
+                extend(key)
+                encode(item)
+            extend(b"e")
+
+        def encode_list(lst):
+            extend(b"l")
+            for item in lst:
+                encode(item)
+            extend(b"e")
+
+        def encode(item):
+            kind = type(item)
+            if kind is dict:
+                encode_dictionary(item)
+            elif kind is list or kind is tuple:
+                encode_list(item)
+            elif kind is int or kind is bool:
+                extend(b"i%de" % item)
+            elif kind is bytes or kind is bytearray or kind is memoryview:
+                encode_string(item)
+            elif kind is str:
+                encode_string(item.encode("utf-8", "surrogateescape"))
+            elif kind is LazyBencodeDict or kind is LazyBencodeList:
+                encode_string_raw(item.raw())
+            elif isinstance(item, dict):
+                encode_dictionary(item)
+            elif isinstance(item, (list, tuple)):
+                encode_list(item)
+            elif isinstance(item, int):
+                extend(b"i%de" % item)
+            elif isinstance(item, (bytes, bytearray, memoryview)):
+                encode_string(item)
+            elif isinstance(item, str):
+                encode_string(item.encode("utf-8", "surrogateescape"))
+            else:
+                raise TypeError(f"Cannot bencode a value of type {kind.__name__}")
+            if position is not None and position() >= buffer_size:
+                flush()
+
+        # Already bencoded data, copied as it is.
+        def encode_string_raw(raw):
+            if write is not None and len(raw) >= view_threshold:
+                flush()
+                write(raw)
+            else:
+                extend(raw)
+
+        try:
+            encode(value)
+        except RecursionError:
+            raise ValueError("Value nested too deeply to bencode") from None
+        if write is not None:
+            flush()
+
+
+# Bencoded text fields may come back as bytes or, when long, as memoryview slices.
+def _text(value):
+    return str(value, "utf-8")
+
+# Computes the info-hashes straight from the raw bencoded info dictionary: the
+# v1 SHA-1 digest and, when v2 is true, the v2 (BEP 52) SHA-256 digest.
+def hash_info(raw_info, v2=False):
+    return hashlib.sha1(raw_info).digest(), hashlib.sha256(raw_info).digest() if v2 else None
+
 
 # ParseTorrentFile class parses a torrent file and extracts relevant information.
+#
+# The info-hashes are computed from the exact byte span of the 'info' dictionary
+# recorded while decoding, never by re-encoding it. The v2 (SHA-256) hash is
+# computed for v2/hybrid torrents ('meta version' 2) unless hash_v2 forces it
+# on or off.
 class ParseTorrentFile:
-    def __init__(self, file_path):
+    def __init__(self, file_path, hash_v2=None):
         self.file_path = file_path
+        self.hash_v2 = hash_v2
+
+    # Returns the v1 info-hash of the torrent file, reading only up to the end of
+    # its 'info' dictionary. The memory map is closed before returning.
+    def info_hash(self):
+        data = self._map()
+        try:
+            root = self._lazy_root(data)
+            info = root.raw("info")
+            try:
+                return hash_info(info)[0]
+            finally:
+                # Views of the map must be gone for it to close
+                info.release()
+                root.decoder.view.release()
+        finally:
+            try:
+                data.close()
+            except BufferError:
+                pass  # Still viewed from the traceback of an error: released along with it
+
+    # Returns the torrent dictionary as a LazyBencodeDict over a read-only memory
+    # map of the file, so only the pages that are actually looked at are read.
+    # The caller owns the map (root.decoder.data): it stays open while the
+    # dictionary or views taken from it are referenced, and is released with
+    # them, or earlier by closing it once those views are released.
+    def execute_lazy(self):
+        return self._lazy_root(self._map())
+
+    def _map(self):
+        with open(self.file_path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                raise BencodeDecodeError(f"Empty torrent file: {self.file_path}")
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _lazy_root(self, data):
+        root = LazyBencodeDecoder(data).decode()
+        if not isinstance(root, LazyBencodeDict):
+            raise BencodeDecodeError(f"Torrent file is not a bencoded dictionary: {self.file_path}")
+        return root
 
     def execute(self):
         # Read the torrent file.
         with open(self.file_path, "rb") as file:
             data = file.read()
+        return self.parse_bytes(data)
 
+    # Builds the MetaInfo from the contents of a torrent file, e.g. one assembled
+    # from a magnet link (see app/features/fetch_metadata.py).
+    def parse_bytes(self, data):
         # Decode the bencoded data.
         decoder = BencodeDecoder(data)
-        torrent_dict = decoder.decode()
+        torrent_dict, spans = decoder.decode_with_spans()
 
         # Extract information from the torrent dictionary.
         info_dict = torrent_dict["info"]
-        files = []
+        info_start, info_end = spans["info"]
+        hash_v2 = self.hash_v2 if self.hash_v2 is not None else info_dict.get("meta version", 1) >= 2
+        info_hash, info_hash_v2 = hash_info(decoder.view[info_start:info_end], hash_v2)
+        # The files go into a columnar FileTable: directory components are interned
+        # once in its prefix tree and no path string is built here.
+        files = FileTable()
         if "files" in info_dict:
             for file_info in info_dict["files"]:
-                file_path = "/".join([path.decode() for path in file_info["path"]])
-                file_length = file_info["length"]
-                files.append(TorrentFile(file_path, file_length))
+                files.append([_text(path) for path in file_info["path"]], file_info["length"])
 
         announce_list = []
+        announce_tiers = []
         if "announce-list" in torrent_dict:
             for announce_group in torrent_dict["announce-list"]:
-                for announce_url in announce_group:
-                    announce_list.append(Tracker(announce_url.decode()))
+                tier = [Tracker(_text(announce_url)) for announce_url in announce_group]
+                if tier:
+                    announce_tiers.append(tier)
+                    announce_list.extend(tier)
 
         # Create TorrentInfo object.
         torrent_info = TorrentInfo(
-            name=info_dict["name"].decode(),
+            name=_text(info_dict["name"]),
             piece_length=info_dict["piece length"],
             pieces=info_dict["pieces"],
             length=info_dict.get("length"),
@@ -147,14 +691,18 @@ class ParseTorrentFile:
 
         # Create MetaInfo object.
         torrent = MetaInfo(
-            announce=Tracker(torrent_dict["announce"].decode()),
+            announce=Tracker(_text(torrent_dict["announce"])) if "announce" in torrent_dict else None,
             announce_list=announce_list,
+            announce_tiers=announce_tiers,
             comment=torrent_dict.get("comment"),
             created_by=torrent_dict.get("created by"),
             creation_date=torrent_dict.get("creation date"),
             encoding=torrent_dict.get("encoding"),
             info=torrent_info,
             files=files if files else None,
+            info_hash=info_hash,
+            info_hash_v2=info_hash_v2,
+            info_bytes=decoder.view[info_start:info_end],
         )
 
         return torrent
\ No newline at end of file
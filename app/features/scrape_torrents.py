@@ -0,0 +1,115 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Batch scrape
+------------
+
+Checking the health of many swarms with one announce per torrent is slow and counts as a client joining each swarm.
+A scrape asks a tracker for the seeders, leechers and completed downloads of many torrents in a single request.
+
+The info-hashes of the torrents are grouped by tracker: each torrent is scraped on the first of its trackers, in
+announce-list order, that supports scraping. Each group is split into requests of at most the protocol limit (74
+info-hashes over UDP, 64 over HTTP). Requests to different trackers run concurrently, while requests to the same
+tracker are spaced at least min_request_interval seconds apart so a tracker is never flooded.
+"""
+
+import asyncio
+import time
+
+from app.features.tracker_client import TrackerClient, TrackerError, scrape_limit, scrape_url
+
+
+class RateLimiter:
+    """
+    The RateLimiter class spaces the requests sent to one tracker:
+    - interval: Minimum number of seconds between the start of two requests.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._next = 0
+
+    async def wait(self):
+        async with self._lock:
+            delay = self._next - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next = time.monotonic() + self.interval
+
+
+# ScrapeTorrentsUseCase class scrapes the trackers of many torrents and returns {info_hash: ScrapeResult}.
+# Trackers that could not be scraped are reported in self.errors ({tracker URL: message}).
+class ScrapeTorrentsUseCase:
+    def __init__(self, meta_infos, client=None, max_concurrency=16, min_request_interval=1.0):
+        self.meta_infos = meta_infos
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.min_request_interval = min_request_interval
+        self.errors = {}
+
+    # Groups the info-hashes by the tracker they will be scraped on: {tracker URL: [info_hash, ...]}
+    def groups(self):
+        groups = {}
+        seen = set()
+        for meta_info in self.meta_infos:
+            info_hash = meta_info.info_hash
+            if info_hash is None or info_hash in seen:
+                continue
+            for tier in meta_info.tracker_tiers():
+                url = next((str(tracker) for tracker in tier if scrape_url(str(tracker))), None)
+                if url is not None:
+                    groups.setdefault(url, []).append(info_hash)
+                    seen.add(info_hash)
+                    break
+        return groups
+
+    def execute(self):
+        return asyncio.run(self.execute_async())
+
+    async def execute_async(self):
+        client = self.client or TrackerClient()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = {}
+        self.errors = {}
+
+        async def scrape(url, limiter, info_hashes):
+            await limiter.wait()
+            async with semaphore:
+                try:
+                    results.update(await client.scrape(url, info_hashes))
+                except TrackerError as error:
+                    self.errors[url] = str(error)
+
+        try:
+            requests = []
+            for url, info_hashes in self.groups().items():
+                limiter = RateLimiter(self.min_request_interval)
+                limit = scrape_limit(url)
+                requests += [scrape(url, limiter, info_hashes[start:start + limit])
+                             for start in range(0, len(info_hashes), limit)]
+            await asyncio.gather(*requests)
+        finally:
+            if self.client is None:
+                client.close()
+        return results
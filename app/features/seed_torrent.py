@@ -0,0 +1,150 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Seeding
+-------
+
+Serves the verified pieces of a torrent to other peers over the peer wire protocol: after the handshake the seeder
+announces its pieces with a bitfield, unchokes every interested peer and answers block requests by reading them
+straight from the payload files - or from the WriteBackCache of a download still in progress, for pieces that have
+not been written yet.
+
+When the info dictionary of the torrent is known byte for byte (metadata, by default meta_info.info_bytes), the seeder
+also supports the extension protocol and serves it to peers that joined from a magnet link (ut_metadata, see
+app/features/fetch_metadata.py).
+"""
+
+import asyncio
+import logging
+
+from app.features.fetch_metadata import (UT_METADATA, UT_METADATA_ID, METADATA_PIECE_SIZE, METADATA_REQUEST,
+                                         METADATA_DATA, METADATA_REJECT, encode_extension_handshake,
+                                         decode_extension_handshake, encode_metadata_message, decode_metadata_message)
+from app.repositories import peer_wire
+
+# Largest block a peer may request.
+MAX_REQUEST_LENGTH = 128 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+# SeedTorrentUseCase class uploads the pieces of a torrent found in output_directory. The uploads of several torrents
+# can share an upload_limiter (a TokenBucket) and a disk_executor (the pool doing the disk reads). With use_mmap,
+# blocks are sent from memory maps of the files instead of pread copies.
+class SeedTorrentUseCase:
+    def __init__(self, meta_info, output_directory, piece_hashes=None, peer_id=None, timeout=120, bt_files=None,
+                 cache=None, upload_limiter=None, disk_executor=None, metadata=None, use_mmap=False):
+        self.meta_info = meta_info
+        self.output_directory = output_directory
+        # Pieces to serve: those marked verified in the table
+        self.piece_hashes = piece_hashes or meta_info.info.piece_hashes
+        self.peer_id = peer_id or peer_wire.generate_peer_id()
+        self.timeout = timeout
+        self.bt_files = bt_files or meta_info.create_btfile_collection(use_mmap=use_mmap)
+        self.cache = cache
+        self.upload_limiter = upload_limiter
+        self.disk_executor = disk_executor
+        # The bencoded info dictionary served over ut_metadata, if known
+        self.metadata = metadata if metadata is not None else getattr(meta_info, "info_bytes", None)
+        self.server = None
+
+    async def start(self, host="0.0.0.0", port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.bt_files.close()
+
+    async def handle(self, reader, writer):
+        await self.accept(peer_wire.PeerConnection(reader, writer, self.timeout))
+
+    # Serves an incoming connection, whose handshake may already have been read (e.g. by a listener shared by
+    # several torrents that dispatches on the info-hash).
+    async def accept(self, connection, handshake_read=False):
+        try:
+            if not handshake_read:
+                await connection.read_handshake(self.meta_info.info_hash)
+            reserved = peer_wire.EXTENSION_PROTOCOL if self.metadata is not None else bytes(8)
+            await connection.send_handshake(self.meta_info.info_hash, self.peer_id, reserved)
+            await self.serve(connection)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, peer_wire.PeerWireError) as error:
+            logger.debug("Peer %s disconnected: %r", connection.address, error)
+        finally:
+            connection.close()
+
+    # Answers the messages of a peer once the handshake is done.
+    async def serve(self, connection):
+        extensions = self.metadata is not None and peer_wire.supports_extensions(connection.reserved)
+        if extensions:
+            await connection.send_extended(peer_wire.EXTENDED_HANDSHAKE, encode_extension_handshake(len(self.metadata)))
+        if self.piece_hashes.verified_count():
+            await connection.send_message(peer_wire.BITFIELD, self.piece_hashes.bitfield)
+        remote_ids = {}  # Extension name -> extended message id the peer wants
+        while True:
+            message_id, payload = await connection.read_message()
+            if message_id == peer_wire.INTERESTED:
+                await connection.send_message(peer_wire.UNCHOKE)
+            elif message_id == peer_wire.REQUEST:
+                index, begin, length = peer_wire.decode_block(payload)
+                block = await self.read_block(index, begin, length)
+                if self.upload_limiter is not None:
+                    await self.upload_limiter.consume(length)
+                await connection.send_piece(index, begin, block)
+            elif message_id == peer_wire.EXTENDED and extensions:
+                await self._on_extended(connection, remote_ids, *peer_wire.decode_extended(payload))
+
+    async def _on_extended(self, connection, remote_ids, extended_id, payload):
+        if extended_id == peer_wire.EXTENDED_HANDSHAKE:
+            remote_ids.update(decode_extension_handshake(payload).get("m", {}))
+        elif extended_id == UT_METADATA_ID:
+            remote_id = remote_ids.get(UT_METADATA)
+            msg_type, piece, _, _ = decode_metadata_message(payload)
+            if msg_type != METADATA_REQUEST or not isinstance(remote_id, int) or not 0 < remote_id < 256:
+                return
+            start = piece * METADATA_PIECE_SIZE
+            if 0 <= start < len(self.metadata):
+                message = encode_metadata_message(METADATA_DATA, piece, len(self.metadata),
+                                                  self.metadata[start:start + METADATA_PIECE_SIZE])
+            else:
+                message = encode_metadata_message(METADATA_REJECT, piece)
+            await connection.send_extended(remote_id, message)
+
+    async def read_block(self, index, begin, length):
+        if not 0 <= index < len(self.piece_hashes) or not self.piece_hashes.is_verified(index):
+            raise peer_wire.PeerWireError(f"Request for a piece we do not have: {index}")
+        start, end = self.piece_hashes.piece_range(index)
+        if length <= 0 or length > MAX_REQUEST_LENGTH or begin < 0 or start + begin + length > end:
+            raise peer_wire.PeerWireError(f"Invalid request: {index}/{begin}/{length}")
+        block = self.cache.read(index, begin, length) if self.cache is not None else None
+        if block is None:
+            block = await asyncio.get_running_loop().run_in_executor(
+                self.disk_executor, self.bt_files.read_offset, start + begin, length, self.output_directory)
+        return block
@@ -0,0 +1,316 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Sessions
+--------
+
+A session runs many torrents at once on a single asyncio event loop, sharing the resources of the host between them:
+
+- a global connection limit: an asyncio.Semaphore every peer connection of every torrent must hold. Each torrent may
+  also use at most its fair share of it (the limit divided by the number of torrents), so a torrent with a large swarm
+  cannot take every slot;
+- global download and upload rate limits: two TokenBuckets, serving the connections of all torrents in turn;
+- one thread pool for the disk: piece checks, writes and reads of every torrent run there, so hundreds of torrents
+  never mean hundreds of threads hitting the disk;
+- one listening socket: incoming connections are handed to the torrent named by the info-hash of their handshake;
+- optionally one DHT node (see app/features/dht.py), finding peers for every public torrent when trackers do not.
+
+Each torrent goes through the same steps: the data already in the output directory is rechecked (see
+app/features/fast_recheck.py), peers are fetched from its trackers and the DHT unless they were given, the missing pieces are
+downloaded, and the resume file is updated. The trackers are announced to again every 'interval' they ask for, as long
+as the session runs, and the peers they return join the download. Meanwhile its verified pieces are served to other peers. A torrent that
+fails does not stop the others; its error is kept in its TorrentJob.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+
+from app.features.download_torrent import DownloadTorrentUseCase
+from app.features.fast_recheck import FastRecheck
+from app.features.parse_torrent_file import ParseTorrentFile
+from app.features.seed_torrent import SeedTorrentUseCase
+from app.features.tracker_client import TrackerClient, TrackerError, TrackerTiers
+from app.repositories import peer_wire
+from app.repositories.bt_file import ALLOCATE_SPARSE
+from app.repositories.token_bucket import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+CHECKING = "checking"
+DOWNLOADING = "downloading"
+COMPLETE = "complete"
+FAILED = "failed"
+
+# Seconds to wait before announcing again when every tracker of a torrent failed.
+ANNOUNCE_RETRY = 60
+
+
+class TorrentJob:
+    """
+    The TorrentJob class holds one torrent of a session:
+    - meta_info: The parsed torrent.
+    - output_directory: Where its payload is stored.
+    - peers: The (host, port) peers to download from, or None to ask the trackers.
+    - state: One of queued, checking, downloading, complete and failed.
+    - error: Why the torrent failed, if it did.
+    - rehashed: The number of pieces hashed by the recheck.
+    - file_priorities: The FilePriorities selecting the files to download, or None for all of them.
+    - announcer: The task re-announcing it to its trackers, or None.
+    """
+    def __init__(self, meta_info, output_directory, peers=None, file_priorities=None):
+        self.meta_info = meta_info
+        self.output_directory = output_directory
+        self.peers = peers
+        self.file_priorities = file_priorities
+        self.state = QUEUED
+        self.error = None
+        self.rehashed = 0
+        self.seeder = None
+        self.announcer = None
+
+    @property
+    def piece_hashes(self):
+        return self.meta_info.info.piece_hashes
+
+    # Indexes of the pieces to download.
+    def wanted_pieces(self):
+        if self.file_priorities is None:
+            return range(len(self.piece_hashes))
+        return self.file_priorities.wanted_pieces()
+
+    # Bytes still to download.
+    def left(self):
+        piece_hashes = self.piece_hashes
+        return sum(piece_hashes.piece_size(index) for index in self.wanted_pieces()
+                   if not piece_hashes.is_verified(index))
+
+    # Whether every wanted piece is verified.
+    def is_complete(self):
+        if self.file_priorities is None:
+            return self.piece_hashes.is_complete()
+        return all(self.piece_hashes.is_verified(index) for index in self.wanted_pieces())
+
+    def __str__(self):
+        progress = f"{self.piece_hashes.verified_count()}/{len(self.piece_hashes)} pieces"
+        return f"{self.meta_info.info.name}: {self.state}, {progress}" + (f" ({self.error})" if self.error else "")
+
+
+class Session:
+    """
+    The Session class downloads and serves many torrents with shared limits:
+    - output_directory: The default directory for the payloads.
+    - max_connections: Peer connections allowed across all torrents.
+    - download_rate / upload_rate: Global limits in bytes per second, or None.
+    - disk_workers: Threads of the shared disk pool.
+    - dht: A DHTNode to find peers with, started and bootstrapped by run() if it is not running yet, or None.
+    - use_mmap: Whether rechecks and uploads read the payloads through memory maps rather than pread copies.
+    """
+    def __init__(self, output_directory, max_connections=200, download_rate=None, upload_rate=None, disk_workers=4,
+                 host="0.0.0.0", port=0, peer_id=None, tracker_client=None, allocation=ALLOCATE_SPARSE, timeout=120,
+                 metainfo_cache=None, dht=None, use_mmap=False):
+        self.output_directory = output_directory
+        self.max_connections = max_connections
+        self.download_rate = download_rate
+        self.upload_rate = upload_rate
+        self.disk_workers = disk_workers
+        self.host = host
+        self.port = port
+        self.peer_id = peer_id or peer_wire.generate_peer_id()
+        self.tracker_client = tracker_client
+        self.allocation = allocation
+        self.timeout = timeout
+        self.metainfo_cache = metainfo_cache
+        self.dht = dht
+        self.use_mmap = use_mmap
+        self.jobs = {}  # info-hash -> TorrentJob
+        self.server = None
+
+    # Adds a torrent from a .torrent path (through the MetaInfoCache, if the session has one) or a MetaInfo.
+    # Returns its TorrentJob; its file_priorities can be set until the session runs.
+    def add_torrent(self, source, peers=None, output_directory=None, file_priorities=None):
+        if not isinstance(source, str):
+            meta_info = source
+        elif self.metainfo_cache is not None:
+            meta_info = self.metainfo_cache.load(source)
+        else:
+            meta_info = ParseTorrentFile(source).execute()
+        if meta_info.info_hash in self.jobs:
+            raise ValueError(f"Torrent {meta_info.info.name} is already in the session")
+        job = self.jobs[meta_info.info_hash] = TorrentJob(
+            meta_info, output_directory or self.output_directory, None if peers is None else list(peers),
+            file_priorities)
+        return job
+
+    # Adds a .torrent file, or every .torrent file of a directory. Returns the new TorrentJobs.
+    def add_path(self, path):
+        if not os.path.isdir(path):
+            return [self.add_torrent(path)]
+        return [self.add_torrent(os.path.join(path, name)) for name in sorted(os.listdir(path))
+                if name.endswith(".torrent") and os.path.isfile(os.path.join(path, name))]
+
+    def run(self, seed=False):
+        return asyncio.run(self.run_async(seed))
+
+    # Runs every torrent until it is complete or has failed, then returns the TorrentJobs.
+    # With seed, keeps serving the torrents afterwards until cancelled.
+    async def run_async(self, seed=False):
+        jobs = list(self.jobs.values())
+        self.connection_slots = asyncio.Semaphore(self.max_connections)
+        self.download_limiter = TokenBucket(self.download_rate)
+        self.upload_limiter = TokenBucket(self.upload_rate)
+        self.disk_executor = concurrent.futures.ThreadPoolExecutor(self.disk_workers, "session-disk")
+        client = self.tracker_client or TrackerClient()
+        start_dht = self.dht is not None and self.dht.transport is None
+        try:
+            self.server = await asyncio.start_server(self._handle, self.host, self.port)
+            if start_dht:
+                await self.dht.start(self.host)
+                await self.dht.bootstrap()
+            share = max(1, self.max_connections // max(1, len(jobs)))
+            await asyncio.gather(*(self._run_job(job, client, share) for job in jobs))
+            if seed:
+                await self.server.serve_forever()
+        finally:
+            await self.close()
+            if start_dht:
+                await self.dht.close()
+            if self.tracker_client is None:
+                client.close()
+            self.disk_executor.shutdown()
+        return jobs
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        announcers = [job.announcer for job in self.jobs.values() if job.announcer is not None]
+        for announcer in announcers:
+            announcer.cancel()
+        await asyncio.gather(*announcers, return_exceptions=True)
+        for job in self.jobs.values():
+            job.announcer = None
+            if job.seeder is not None:
+                await job.seeder.close()
+                job.seeder = None
+
+    @property
+    def listen_port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def _run_job(self, job, client, max_connections):
+        loop = asyncio.get_running_loop()
+        try:
+            job.state = CHECKING
+            recheck = FastRecheck(job.meta_info, job.output_directory, workers=1, file_priorities=job.file_priorities,
+                                  use_mmap=self.use_mmap)
+            if os.path.isdir(job.output_directory):
+                _, job.rehashed = await loop.run_in_executor(self.disk_executor, recheck.execute)
+
+            download = DownloadTorrentUseCase(
+                job.meta_info, job.output_directory, job.peers or [], self.peer_id, max_connections,
+                timeout=self.timeout, allocation=self.allocation, connection_slots=self.connection_slots,
+                download_limiter=self.download_limiter, disk_executor=self.disk_executor,
+                file_priorities=job.file_priorities)
+            job.seeder = SeedTorrentUseCase(
+                job.meta_info, job.output_directory, peer_id=self.peer_id, timeout=self.timeout,
+                cache=download.cache, upload_limiter=self.upload_limiter, disk_executor=self.disk_executor,
+                use_mmap=self.use_mmap)
+            if job.is_complete():
+                job.state = COMPLETE
+                return
+
+            tiers = None
+            if job.peers is None:
+                tiers = TrackerTiers.from_meta_info(job.meta_info)
+                download.peers = await self._find_peers(job, client, tiers)
+                job.announcer = asyncio.create_task(self._announce_periodically(job, client, tiers, download))
+            job.state = DOWNLOADING
+            await download.download_async()
+            job.state = COMPLETE
+            bt_files = job.meta_info.create_btfile_collection()
+            recheck.save(job.piece_hashes, bt_files.file_states(job.output_directory))
+            if tiers is not None:
+                try:
+                    await tiers.announce(client, job.meta_info.info_hash, self.peer_id, self.listen_port,
+                                         event="completed")
+                except TrackerError as error:
+                    logger.debug("Completed announce of %s failed: %s", job.meta_info.info.name, error)
+        except Exception as error:
+            logger.warning("Torrent %s failed: %r", job.meta_info.info.name, error)
+            job.state = FAILED
+            job.error = str(error) or type(error).__name__
+            if job.announcer is not None:
+                job.announcer.cancel()
+
+    # Returns the peers of a torrent from its trackers and, unless it is private, from the DHT. Tracker errors are
+    # only fatal without a DHT to fall back on.
+    async def _find_peers(self, job, client, tiers):
+        info_hash = job.meta_info.info_hash
+        use_dht = self.dht is not None and not job.meta_info.info.private
+        peers = []
+        try:
+            response = await tiers.announce(client, info_hash, self.peer_id, self.listen_port,
+                                            left=job.left(), event="started")
+            peers = list(response.peers)
+        except TrackerError as error:
+            if not use_dht:
+                raise
+            logger.debug("Announce of %s failed, using the DHT only: %s", job.meta_info.info.name, error)
+        if use_dht:
+            peers += [peer for peer in await self.dht.announce_peer(info_hash, self.listen_port) if peer not in peers]
+        return peers
+
+    # Announces a torrent again whenever its trackers' 'interval' has passed (never before 'min interval'), until the
+    # session closes. Peers returned while it is downloading join the download.
+    async def _announce_periodically(self, job, client, tiers, download):
+        while True:
+            await asyncio.sleep(tiers.next_announce_in())
+            if tiers.next_announce_in() or not tiers.can_announce():
+                continue  # Announced meanwhile, e.g. the completed event
+            try:
+                response = await tiers.announce(client, job.meta_info.info_hash, self.peer_id, self.listen_port,
+                                                left=job.left())
+            except TrackerError as error:
+                logger.debug("Announce of %s failed: %s", job.meta_info.info.name, error)
+                await asyncio.sleep(ANNOUNCE_RETRY)
+                continue
+            download.add_peers(response.peers)
+
+    # Incoming connection: hand it to the torrent its handshake asks for.
+    async def _handle(self, reader, writer):
+        connection = peer_wire.PeerConnection(reader, writer, self.timeout)
+        try:
+            info_hash = await connection.read_handshake()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, peer_wire.PeerWireError):
+            connection.close()
+            return
+        job = self.jobs.get(info_hash)
+        if job is None or job.seeder is None:
+            connection.close()
+            return
+        await job.seeder.accept(connection, handshake_read=True)
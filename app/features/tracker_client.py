@@ -0,0 +1,538 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Trackers
+--------
+
+A tracker tells a client which peers are in the swarm of a torrent. This module speaks both tracker protocols:
+
+- HTTP trackers (BEP 3): a GET on the announce URL with the torrent and transfer state as query parameters. The
+  bencoded response holds the re-announce interval and the peers, normally in the compact form of BEP 23: 6 bytes per
+  IPv4 peer (and 18 per IPv6 peer in 'peers6'). Connections are kept alive and reused for later requests.
+- UDP trackers (BEP 15): a connect request returns a connection id, valid for a minute, that is then used for
+  announce requests. Every request is retried with an exponential timeout. One socket is shared by all UDP trackers.
+
+Both protocols also answer scrape requests: the seeders, leechers and completed downloads of several torrents at once.
+An HTTP scrape goes to the announce URL with its last 'announce' path segment replaced by 'scrape' (trackers whose
+announce URL does not follow that convention cannot be scraped); a UDP scrape carries up to 74 info-hashes.
+
+Torrents list trackers in tiers (BEP 12). Each tier is shuffled once; trackers are tried in order, tier after tier,
+and a tracker that answers is moved to the front of its tier so it is tried first next time. A tracker's 'interval'
+and 'min interval' decide when the next announce is due.
+"""
+
+import asyncio
+import ipaddress
+import os
+import random
+import socket
+import struct
+import time
+import urllib.parse
+
+from app.features.parse_torrent_file import BencodeDecoder
+
+EVENTS = {None: 0, "completed": 1, "started": 2, "stopped": 3}
+
+# UDP tracker protocol (BEP 15)
+UDP_PROTOCOL_ID = 0x41727101980
+CONNECT = 0
+ANNOUNCE = 1
+SCRAPE = 2
+ERROR = 3
+# Connection ids are valid for one minute; stop using them a little earlier.
+CONNECTION_ID_LIFETIME = 55
+
+DEFAULT_INTERVAL = 1800
+
+# Info-hashes per scrape request: the UDP limit comes from the packet size, the HTTP one keeps the URL short enough
+# for common tracker software.
+UDP_SCRAPE_LIMIT = 74
+HTTP_SCRAPE_LIMIT = 64
+
+
+class TrackerError(Exception):
+    """Raised when a tracker cannot be reached or answers with a failure."""
+
+
+class AnnounceResponse:
+    """
+    The AnnounceResponse class holds the answer of a tracker to an announce:
+    - interval: Seconds to wait before the next regular announce.
+    - min_interval: Seconds before which the client must not announce again, if given.
+    - peers: The list of (host, port) peers.
+    - complete / incomplete: The number of seeders and leechers, if given.
+    - tracker_id: The id to send back in the next announces, if given.
+    """
+    def __init__(self, interval, peers, min_interval=None, complete=None, incomplete=None, tracker_id=None):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.peers = peers
+        self.complete = complete
+        self.incomplete = incomplete
+        self.tracker_id = tracker_id
+
+    def __str__(self):
+        return f"AnnounceResponse(interval={self.interval}, peers={len(self.peers)}, complete={self.complete}, incomplete={self.incomplete})"
+
+
+class ScrapeResult:
+    """
+    The ScrapeResult class holds the swarm statistics of one torrent:
+    - seeders: Peers with the complete torrent.
+    - leechers: Peers still downloading.
+    - completed: Downloads completed so far, as counted by the tracker.
+    """
+    def __init__(self, seeders, leechers, completed):
+        self.seeders = seeders
+        self.leechers = leechers
+        self.completed = completed
+
+    def __eq__(self, other):
+        return isinstance(other, ScrapeResult) and \
+            (self.seeders, self.leechers, self.completed) == (other.seeders, other.leechers, other.completed)
+
+    def __repr__(self):
+        return f"ScrapeResult(seeders={self.seeders}, leechers={self.leechers}, completed={self.completed})"
+
+
+# Returns the scrape URL of an announce URL, or None if the tracker does not support scraping.
+def scrape_url(url):
+    if url.startswith("udp:"):
+        return url
+    parts = urllib.parse.urlsplit(url)
+    head, _, last = parts.path.rpartition("/")
+    if not last.startswith("announce"):
+        return None
+    return urllib.parse.urlunsplit(parts._replace(path=f"{head}/scrape{last[len('announce'):]}"))
+
+
+# Returns how many info-hashes a single scrape request to this tracker may carry.
+def scrape_limit(url):
+    return UDP_SCRAPE_LIMIT if url.startswith("udp:") else HTTP_SCRAPE_LIMIT
+
+
+# Decodes a compact peer list: 4 (IPv4) or 16 (IPv6) address bytes followed by a 2-byte port, per peer.
+def decode_compact_peers(data, address_length=4):
+    data = bytes(data)
+    size = address_length + 2
+    peers = []
+    for offset in range(0, len(data) - len(data) % size, size):
+        host = str(ipaddress.ip_address(data[offset:offset + address_length]))
+        peers.append((host, struct.unpack_from(">H", data, offset + address_length)[0]))
+    return peers
+
+
+def _text(value):
+    return str(value, "utf-8", "replace")
+
+
+# Parses the bencoded body of an HTTP announce response.
+def parse_announce_response(body):
+    try:
+        response = BencodeDecoder(body, strict=False).decode()
+    except ValueError as error:
+        raise TrackerError(f"Invalid tracker response: {error}") from None
+    if not isinstance(response, dict):
+        raise TrackerError("Invalid tracker response")
+    if "failure reason" in response:
+        raise TrackerError(f"Tracker failure: {_text(response['failure reason'])}")
+    peers = response.get("peers", b"")
+    if isinstance(peers, list):
+        try:
+            peers = [(_text(peer["ip"]), peer["port"]) for peer in peers]
+        except (KeyError, TypeError) as error:
+            raise TrackerError(f"Invalid peer in tracker response: {error!r}") from None
+    else:
+        peers = decode_compact_peers(peers)
+    peers += decode_compact_peers(response.get("peers6", b""), 16)
+    tracker_id = response.get("tracker id")
+    return AnnounceResponse(
+        interval=response.get("interval", DEFAULT_INTERVAL),
+        min_interval=response.get("min interval"),
+        peers=peers,
+        complete=response.get("complete"),
+        incomplete=response.get("incomplete"),
+        tracker_id=bytes(tracker_id) if tracker_id is not None else None,
+    )
+
+
+# Parses the bencoded body of an HTTP scrape response into {info_hash: ScrapeResult}.
+def parse_scrape_response(body):
+    try:
+        response = BencodeDecoder(body, strict=False).decode()
+    except ValueError as error:
+        raise TrackerError(f"Invalid scrape response: {error}") from None
+    if not isinstance(response, dict):
+        raise TrackerError("Invalid scrape response")
+    if "failure reason" in response:
+        raise TrackerError(f"Tracker failure: {_text(response['failure reason'])}")
+    return {
+        info_hash.encode("utf-8", "surrogateescape"): ScrapeResult(
+            stats.get("complete", 0), stats.get("incomplete", 0), stats.get("downloaded", 0))
+        for info_hash, stats in response.get("files", {}).items()
+    }
+
+
+class HTTPTrackerClient:
+    """
+    The HTTPTrackerClient class sends GET requests to HTTP(S) trackers over asyncio streams, keeping one idle
+    keep-alive connection per tracker host for reuse.
+    """
+    def __init__(self, timeout=15):
+        self.timeout = timeout
+        self._idle = {}  # (scheme, host, port) -> (reader, writer)
+
+    async def get(self, url, params):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https"):
+            raise TrackerError(f"Unsupported tracker URL: {url}")
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        key = (parsed.scheme, parsed.hostname, port)
+        query = urllib.parse.urlencode(params, quote_via=urllib.parse.quote)
+        if parsed.query:
+            query = parsed.query + "&" + query
+        host = parsed.hostname if parsed.port is None else f"{parsed.hostname}:{parsed.port}"
+        request = (f"GET {parsed.path or '/'}?{query} HTTP/1.1\r\nHost: {host}\r\n"
+                   f"User-Agent: download_torrent_cli/1.0\r\nAccept-Encoding: identity\r\n"
+                   f"Connection: keep-alive\r\n\r\n").encode()
+
+        connection = self._idle.pop(key, None)
+        if connection is not None:
+            try:
+                return await asyncio.wait_for(self._exchange(key, connection, request), self.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, EOFError):
+                connection[1].close()  # The idle connection went stale: retry on a fresh one
+        try:
+            connection = await asyncio.wait_for(
+                asyncio.open_connection(parsed.hostname, port, ssl=parsed.scheme == "https"), self.timeout)
+            return await asyncio.wait_for(self._exchange(key, connection, request), self.timeout)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, EOFError) as error:
+            raise TrackerError(f"Cannot reach tracker {url}: {error!r}") from None
+
+    async def _exchange(self, key, connection, request):
+        reader, writer = connection
+        writer.write(request)
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise EOFError("Connection closed")
+        parts = status_line.decode("latin-1").split(None, 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise TrackerError(f"Invalid HTTP status line: {status_line!r}")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close" and not parts[0].endswith("1.0")
+        try:
+            body = await self._read_body(reader, headers)
+        except ValueError as error:
+            writer.close()
+            raise TrackerError(f"Invalid HTTP response body: {error}") from None
+        if body is None:
+            body = await reader.read()
+            keep_alive = False
+
+        if keep_alive:
+            self._idle[key] = connection
+        else:
+            writer.close()
+        if parts[1] != "200":
+            raise TrackerError(f"Tracker answered HTTP {parts[1]}")
+        return bytes(body)
+
+    # Reads a chunked or Content-Length body; returns None when the body runs until the connection closes.
+    @staticmethod
+    async def _read_body(reader, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+            return body
+        if "content-length" in headers:
+            length = int(headers["content-length"])
+            if length < 0:
+                raise ValueError(f"negative Content-Length {length}")
+            return await reader.readexactly(length)
+        return None
+
+    async def announce(self, url, info_hash, peer_id, port, uploaded=0, downloaded=0, left=0, event=None,
+                       numwant=None, tracker_id=None):
+        params = {"info_hash": info_hash, "peer_id": peer_id, "port": port, "uploaded": uploaded,
+                  "downloaded": downloaded, "left": left, "compact": 1}
+        if event:
+            params["event"] = event
+        if numwant is not None:
+            params["numwant"] = numwant
+        if tracker_id is not None:
+            params["trackerid"] = tracker_id
+        return parse_announce_response(await self.get(url, params))
+
+    async def scrape(self, url, info_hashes):
+        target = scrape_url(url)
+        if target is None:
+            raise TrackerError(f"Tracker {url} does not support scrape")
+        return parse_scrape_response(await self.get(target, [("info_hash", info_hash) for info_hash in info_hashes]))
+
+    def close(self):
+        while self._idle:
+            self._idle.popitem()[1][1].close()
+
+
+class _UDPTrackerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, transactions):
+        self.transactions = transactions
+
+    def datagram_received(self, data, address):
+        if len(data) >= 8:
+            future = self.transactions.pop(struct.unpack_from(">I", data, 4)[0], None)
+            if future is not None and not future.done():
+                future.set_result(data)
+
+    def error_received(self, error):
+        pass  # E.g. ICMP port unreachable: the request simply times out
+
+
+class UDPTrackerClient:
+    """
+    The UDPTrackerClient class talks to UDP trackers (BEP 15) through a single shared socket per address family.
+    Connection ids are cached per tracker while valid, and every request is retried up to `retries` times with a
+    timeout doubling from `timeout` seconds (the specification uses 15 seconds and 8 retries).
+    """
+    def __init__(self, timeout=15, retries=3):
+        self.timeout = timeout
+        self.retries = retries
+        self._transports = {}  # address family -> transport
+        self._transactions = {}  # transaction id -> future
+        self._connections = {}  # (host, port) -> (connection id, expiry)
+
+    async def _transport(self, family):
+        transport = self._transports.get(family)
+        if transport is None:
+            loop = asyncio.get_running_loop()
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: _UDPTrackerProtocol(self._transactions), family=family,
+                local_addr=("::" if family == socket.AF_INET6 else "0.0.0.0", 0))
+            self._transports[family] = transport
+        return transport
+
+    async def _resolve(self, host, port):
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+        if not infos:
+            raise TrackerError(f"Cannot resolve {host}")
+        family, _, _, _, address = infos[0]
+        return family, address
+
+    # Sends a request (without its transaction id) and returns the matching response.
+    async def _request(self, address, family, build):
+        transport = await self._transport(family)
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            transaction_id = struct.unpack(">I", os.urandom(4))[0]
+            future = self._transactions[transaction_id] = loop.create_future()
+            transport.sendto(build(transaction_id), address)
+            try:
+                data = await asyncio.wait_for(future, self.timeout * 2 ** attempt)
+            except asyncio.TimeoutError:
+                continue
+            finally:
+                self._transactions.pop(transaction_id, None)
+            action = struct.unpack_from(">I", data)[0]
+            if action == ERROR:
+                raise TrackerError(f"Tracker failure: {_text(data[8:])}")
+            return action, data
+        raise TrackerError(f"No answer from UDP tracker {address[0]}:{address[1]}")
+
+    async def _connection_id(self, address, family):
+        cached = self._connections.get(address)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        action, data = await self._request(
+            address, family, lambda tid: struct.pack(">QII", UDP_PROTOCOL_ID, CONNECT, tid))
+        if action != CONNECT or len(data) < 16:
+            raise TrackerError("Invalid connect response")
+        connection_id = struct.unpack_from(">Q", data, 8)[0]
+        self._connections[address] = (connection_id, time.monotonic() + CONNECTION_ID_LIFETIME)
+        return connection_id
+
+    # Sends a request that needs a connection id, connecting first if necessary. Returns the address family the
+    # tracker was reached over, the action and the response.
+    async def request(self, url, build):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme != "udp" or not parsed.port:
+            raise TrackerError(f"Unsupported tracker URL: {url}")
+        try:
+            family, address = await self._resolve(parsed.hostname, parsed.port)
+            connection_id = await self._connection_id(address, family)
+        except OSError as error:
+            # E.g. socket.gaierror for a name that does not resolve
+            raise TrackerError(f"Cannot reach UDP tracker {url}: {error!r}") from None
+        try:
+            return (family,) + await self._request(address, family, lambda tid: build(connection_id, tid))
+        except OSError as error:
+            self._connections.pop(address, None)
+            raise TrackerError(f"Cannot reach UDP tracker {url}: {error!r}") from None
+        except TrackerError:
+            self._connections.pop(address, None)
+            raise
+
+    async def announce(self, url, info_hash, peer_id, port, uploaded=0, downloaded=0, left=0, event=None,
+                       numwant=None, tracker_id=None):
+        key = struct.unpack(">I", os.urandom(4))[0]
+
+        def build(connection_id, transaction_id):
+            return struct.pack(">QII20s20sQQQIIIiH", connection_id, ANNOUNCE, transaction_id, info_hash, peer_id,
+                               downloaded, left, uploaded, EVENTS[event], 0, key,
+                               -1 if numwant is None else numwant, port)
+        family, action, data = await self.request(url, build)
+        if action != ANNOUNCE or len(data) < 20:
+            raise TrackerError("Invalid announce response")
+        interval, leechers, seeders = struct.unpack_from(">III", data, 8)
+        # Peers are of the address family the announce was sent over
+        peers = decode_compact_peers(data[20:], 16 if family == socket.AF_INET6 else 4)
+        return AnnounceResponse(interval, peers, complete=seeders, incomplete=leechers)
+
+    async def scrape(self, url, info_hashes):
+        info_hashes = list(info_hashes)
+        if len(info_hashes) > UDP_SCRAPE_LIMIT:
+            raise TrackerError(f"A UDP scrape carries at most {UDP_SCRAPE_LIMIT} info-hashes")
+        _, action, data = await self.request(url, lambda connection_id, transaction_id: struct.pack(
+            ">QII", connection_id, SCRAPE, transaction_id) + b"".join(info_hashes))
+        if action != SCRAPE:
+            raise TrackerError("Invalid scrape response")
+        # Entries come back in request order: seeders, completed, leechers
+        entries = min(len(info_hashes), (len(data) - 8) // 12)
+        return {info_hash: ScrapeResult(seeders, leechers, completed)
+                for info_hash, (seeders, completed, leechers)
+                in zip(info_hashes, struct.iter_unpack(">III", data[8:8 + 12 * entries]))}
+
+    def close(self):
+        for transport in self._transports.values():
+            transport.close()
+        self._transports.clear()
+        for future in self._transactions.values():
+            future.cancel()
+        self._transactions.clear()
+
+
+class TrackerClient:
+    """
+    The TrackerClient class sends announces to HTTP(S) and UDP trackers, choosing the protocol from the URL. It owns
+    the reusable HTTP connections and the UDP socket, so one client should be shared by every torrent.
+    """
+    def __init__(self, timeout=15, udp_retries=3):
+        self.http = HTTPTrackerClient(timeout)
+        self.udp = UDPTrackerClient(timeout, udp_retries)
+
+    def _client(self, url):
+        return self.udp if url.startswith("udp:") else self.http
+
+    async def announce(self, url, info_hash, peer_id, port, **params):
+        return await self._client(url).announce(url, info_hash, peer_id, port, **params)
+
+    # Scrapes at most scrape_limit(url) info-hashes in one request.
+    async def scrape(self, url, info_hashes):
+        return await self._client(url).scrape(url, info_hashes)
+
+    def close(self):
+        self.http.close()
+        self.udp.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+class TrackerTiers:
+    """
+    The TrackerTiers class announces a torrent following the announce-list rules (BEP 12):
+    - tiers: The tiers of tracker URLs, each one shuffled once.
+    - interval / min_interval: From the last successful announce.
+
+    Trackers are tried in order within a tier and tiers in order; the tracker that answers is moved to the front of its
+    tier.
+    """
+    def __init__(self, tiers, rng=None):
+        rng = rng or random.Random()
+        self.tiers = []
+        for tier in tiers:
+            urls = [str(tracker) for tracker in tier]
+            rng.shuffle(urls)
+            if urls:
+                self.tiers.append(urls)
+        self.interval = None
+        self.min_interval = None
+        self.last_announce = None
+        self.tracker_id = None
+        self.last_error = None
+
+    @classmethod
+    def from_meta_info(cls, meta_info, rng=None):
+        return cls(meta_info.tracker_tiers(), rng)
+
+    async def announce(self, client, info_hash, peer_id, port, **params):
+        errors = []
+        for tier in self.tiers:
+            for position, url in enumerate(tier):
+                try:
+                    response = await client.announce(url, info_hash, peer_id, port, tracker_id=self.tracker_id,
+                                                     **params)
+                except TrackerError as error:
+                    errors.append(f"{url}: {error}")
+                    continue
+                tier.insert(0, tier.pop(position))
+                self.interval = response.interval
+                self.min_interval = response.min_interval
+                self.tracker_id = response.tracker_id or self.tracker_id
+                self.last_announce = time.monotonic()
+                return response
+        self.last_error = "; ".join(errors) or "No trackers"
+        raise TrackerError(f"All trackers failed: {self.last_error}")
+
+    # Seconds until the next regular announce is due (0 if due now), never before 'min interval' has passed.
+    def next_announce_in(self, now=None):
+        if self.last_announce is None:
+            return 0
+        now = time.monotonic() if now is None else now
+        return max(0, self.last_announce + max(self.interval or DEFAULT_INTERVAL, self.min_interval or 0) - now)
+
+    # Whether an early announce (e.g. more peers wanted) is allowed by 'min interval'.
+    def can_announce(self, now=None):
+        if self.last_announce is None or not self.min_interval:
+            return True
+        now = time.monotonic() if now is None else now
+        return now >= self.last_announce + self.min_interval
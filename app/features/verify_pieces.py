@@ -0,0 +1,125 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Piece verification
+------------------
+
+Every piece of the torrent payload is hashed with SHA-1 and compared with the hash stored in the 'pieces' value of the
+info dictionary. Pieces are independent, so they are hashed in parallel:
+
+- With threads (the default), workers share the BTFileCollection: reads use os.pread on pooled descriptors and hashlib
+  releases the GIL while hashing, so threads scale across cores.
+- With processes, each worker opens its own collection over the same files and only sends back 20-byte digests.
+
+Pieces are read the way the collection reads them: with pread copies, or as views of memory maps when it was built
+with use_mmap (workers of a process pool then map the files too).
+
+Results are always produced in piece order, and the number of pieces read but not yet hashed is bounded by a memory
+budget, so rechecking a very large payload never holds more than memory_budget bytes of piece data.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import os
+
+from app.repositories.bt_file import BTFile, BTFileCollection
+
+# Default bound on the piece data held in memory by the workers at any time.
+MEMORY_BUDGET = 64 * 1024 * 1024
+
+
+# Per-process state for process pool workers.
+_worker = {}
+
+
+def _init_worker(files, output_directory, use_mmap):
+    _worker["collection"] = BTFileCollection([BTFile(*file) for file in files], use_mmap=use_mmap)
+    _worker["output_directory"] = output_directory
+
+
+def _hash_in_worker(offset, amount):
+    return hashlib.sha1(_worker["collection"].read_offset(offset, amount, _worker["output_directory"])).digest()
+
+
+# VerifyPieces class hashes the pieces of a BTFileCollection in parallel.
+class VerifyPieces:
+    def __init__(self, bt_file_collection, piece_length, output_directory, workers=None, use_processes=False,
+                 memory_budget=MEMORY_BUDGET):
+        if piece_length <= 0:
+            raise ValueError("Invalid piece length")
+        self.bt_file_collection = bt_file_collection
+        self.piece_length = piece_length
+        self.output_directory = output_directory
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        # Number of pieces that may be in flight at once, at least one per worker
+        self.max_in_flight = max(self.workers, memory_budget // piece_length)
+
+    def piece_count(self):
+        return -(-self.bt_file_collection.total_size() // self.piece_length)
+
+    # Yields (piece index, SHA-1 digest) for the given piece indexes (every piece by default), in order.
+    def digests(self, indexes=None):
+        indexes = range(self.piece_count()) if indexes is None else indexes
+        with self._executor() as executor:
+            hash_piece = self._hash_function()
+            pending = collections.deque()
+            for index in indexes:
+                if len(pending) >= self.max_in_flight:
+                    yield pending[0][0], pending.popleft()[1].result()
+                offset = index * self.piece_length
+                pending.append((index, executor.submit(hash_piece, offset, self.piece_length)))
+            while pending:
+                yield pending[0][0], pending.popleft()[1].result()
+
+    def _executor(self):
+        if self.use_processes:
+            files = [(f.path, f.size, f.start_byte, f.end_byte) for f in self.bt_file_collection.get_files()]
+            return concurrent.futures.ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(files, self.output_directory, self.bt_file_collection.maps is not None))
+        return concurrent.futures.ThreadPoolExecutor(self.workers)
+
+    def _hash_function(self):
+        if self.use_processes:
+            return _hash_in_worker
+        collection = self.bt_file_collection
+        output_directory = self.output_directory
+
+        def hash_piece(offset, amount):
+            return hashlib.sha1(collection.read_offset(offset, amount, output_directory)).digest()
+        return hash_piece
+
+    # Hashes every piece. Without piece_hashes, returns the list of digests in piece
+    # order. With a PieceHashTable, records which pieces match in the table and
+    # returns its bitfield of verified pieces.
+    def execute(self, piece_hashes=None):
+        if piece_hashes is None:
+            return [digest for _, digest in self.digests()]
+        if len(piece_hashes) != self.piece_count():
+            raise ValueError(f"Expected {self.piece_count()} piece hashes, got {len(piece_hashes)}")
+        for index, digest in self.digests():
+            piece_hashes.verify(index, digest)
+        return piece_hashes.bitfield
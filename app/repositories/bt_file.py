@@ -22,12 +22,37 @@ Please give credit to the author and the website when using or redistributing th
 """
 
 """
-This code defines two classes: BTFile and BTFileCollection. The purpose of this code is to manage the reading and writing of files in a torrent file collection, as well as to compute SHA-1 hashes for data verification. This is particularly useful in applications that work with torrent files, such as torrent download clients.
+This code defines four classes: BTFile, FileHandlePool, MappedFilePool and BTFileCollection. The purpose of this code is to manage the reading and writing of files in a torrent file collection, as well as to compute SHA-1 hashes for data verification. This is particularly useful in applications that work with torrent files, such as torrent download clients.
 """
 
-from base64 import encode, encodebytes
+import collections
+import contextlib
+import errno
 import os
 import hashlib
+import mmap
+import threading
+
+from app.repositories.file_table import FileTable
+
+# Default bound on the number of files a collection keeps open at once.
+MAX_OPEN_FILES = 64
+
+# Buffers passed to a single pwritev call (the usual IOV_MAX).
+MAX_IOVECS = 1024
+
+# How BTFileCollection.allocate sizes the payload files:
+# - ALLOCATE_NONE only creates them (they grow as pieces are written),
+# - ALLOCATE_SPARSE extends them to their final size without reserving disk blocks (ftruncate),
+# - ALLOCATE_FULL reserves every block up front (posix_fallocate), avoiding fragmentation and
+#   out-of-space errors halfway through a download at the cost of writing the whole size once.
+ALLOCATE_NONE = "none"
+ALLOCATE_SPARSE = "sparse"
+ALLOCATE_FULL = "full"
+ALLOCATION_MODES = (ALLOCATE_NONE, ALLOCATE_SPARSE, ALLOCATE_FULL)
+
+# Size of the zero-filled writes used where posix_fallocate is not available.
+ZERO_FILL_CHUNK = 1024 * 1024
 
 class BTFile:
     """
@@ -44,89 +69,287 @@ class BTFile:
         self.end_byte = end_byte
 
     def get_info_hash(self):
-        # Open the torrent file
-        with open(self.path, 'rb') as f:
-            torrent_data = encodebytes.bdecode(f.read())
+        # Returns the v1 info-hash of the torrent file at self.path
+        return BTFileCollection.get_info_hash(self.path)
+
+
+class FileHandlePool:
+    """
+    The FileHandlePool class keeps a bounded, least-recently-used set of open file descriptors:
+    - max_open_files: The number of descriptors kept open; the least recently used idle one is closed beyond that.
+
+    Files are opened lazily on first use, read-only until a write needs them read-write. Callers do all I/O through
+    os.pread / os.pwrite, which take an explicit position, so one descriptor can be shared between threads without any
+    seek races. A descriptor currently in use is never closed by eviction.
+    """
+    def __init__(self, max_open_files=MAX_OPEN_FILES):
+        if max_open_files < 1:
+            raise ValueError("max_open_files must be at least 1")
+        self.max_open_files = max_open_files
+        self._handles = collections.OrderedDict()  # (path, writable) -> [fd, users]
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def open(self, path, writable=False):
+        key = self._acquire(path, writable)
+        try:
+            yield self._handles[key][0]
+        finally:
+            self._release(key)
+
+    def _acquire(self, path, writable):
+        with self._lock:
+            # Reads can go through a read-write descriptor if one is already open
+            key = (path, True)
+            if not writable and key not in self._handles:
+                key = (path, False)
+            handle = self._handles.get(key)
+            if handle is None:
+                fd = os.open(path, (os.O_RDWR if writable else os.O_RDONLY) | getattr(os, "O_BINARY", 0))
+                handle = self._handles[key] = [fd, 0]
+            handle[1] += 1
+            self._handles.move_to_end(key)
+            self._evict()
+            return key
+
+    def _release(self, key):
+        with self._lock:
+            self._handles[key][1] -= 1
+            self._evict()
+
+    def _evict(self):
+        # Close the least recently used idle descriptors beyond the limit
+        if len(self._handles) <= self.max_open_files:
+            return
+        for key in list(self._handles):
+            if len(self._handles) <= self.max_open_files:
+                break
+            fd, users = self._handles[key]
+            if users == 0:
+                del self._handles[key]
+                os.close(fd)
+
+    def __len__(self):
+        return len(self._handles)
+
+    def close(self):
+        with self._lock:
+            while self._handles:
+                os.close(self._handles.popitem(last=False)[1][0])
+
+
+class MappedFilePool:
+    """
+    The MappedFilePool class keeps a bounded, least-recently-used set of read-only memory maps of files:
+    - max_open_files: The number of maps kept; the least recently used one is released beyond that.
+
+    Files are mapped lazily, on first read, and remapped if they have grown past the mapped length. An empty file cannot
+    be mapped: it reads as empty bytes until it has data. A map that still has
+    memoryviews exported when it is evicted cannot be closed; it is dropped and closed once the last view goes away.
+    """
+    def __init__(self, max_open_files=MAX_OPEN_FILES):
+        if max_open_files < 1:
+            raise ValueError("max_open_files must be at least 1")
+        self.max_open_files = max_open_files
+        self._maps = collections.OrderedDict()  # path -> mmap
+        self._lock = threading.Lock()
 
-        # Get the info hash
-        info_hash = torrent_data['info']['pieces'][0]['hash']
+    # Returns a map of path covering at least the first `length` bytes when the file is that long. The map may be
+    # closed by another thread's eviction as soon as this returns: use view() or read() to access it safely.
+    def get(self, path, length=0):
+        with self._lock:
+            return self._get(path, length)
 
-        return info_hash
+    # Returns a memoryview of `length` bytes at `start` of path (shorter if the file is). The view is taken while the
+    # pool is locked, and a map with views cannot be closed by an eviction, so the view stays valid.
+    def view(self, path, start, length):
+        with self._lock:
+            return memoryview(self._get(path, start + length))[start:start + length]
+
+    # Returns a copy of `length` bytes at `start` of path (shorter if the file is).
+    def read(self, path, start, length):
+        with self._lock:
+            return self._get(path, start + length)[start:start + length]
+
+    def _get(self, path, length):
+        mapped = self._maps.get(path)
+        if mapped is None or len(mapped) < length:
+            if mapped is not None:
+                self._release(self._maps.pop(path))
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b""  # E.g. a skipped file allocate() created empty
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[path] = mapped
+        self._maps.move_to_end(path)
+        while len(self._maps) > self.max_open_files:
+            self._release(self._maps.popitem(last=False)[1])
+        return mapped
+
+    @staticmethod
+    def _release(mapped):
+        try:
+            mapped.close()
+        except BufferError:
+            pass  # Views are still exported, the map is closed when they are released
+
+    def __len__(self):
+        return len(self._maps)
+
+    def close(self):
+        with self._lock:
+            while self._maps:
+                self._release(self._maps.popitem(last=False)[1])
 
 
 class BTFileCollection:
     """
     The BTFileCollection class represents a collection of BTFile objects and has the following functions:
-        - add_file: Adds a BTFile object to the collection.
-        - get_files: Returns the list of BTFile objects in the collection.
-        - read_offset: Reads a specific amount of bytes (amount) from a specific position (offset) in the files of the collection. Returns the read data as a bytearray object.
+        - add_file: Adds a BTFile object (or any object with path, size and start_byte) to the collection.
+        - get_files: Returns the FileTable of the collection, a sequence of FileView objects with the BTFile properties.
+        - file_spans: Yields the part of each file overlapping a byte range of the torrent, found by bisection on the start offsets of the file table.
+        - read_offset: Reads a specific amount of bytes (amount) from a specific position (offset) in the files of the collection. Returns the read data as a bytearray object, or as a memoryview in mmap storage mode.
         - write_offset: Writes data at a specific position (offset) in the files of the collection. The data is written at the specified position across all appropriate files in the collection.
         - all_sha1_split_every: Computes and returns a list of SHA-1 hashes for each piece_length-byte block of data across all files in the collection. This is useful for data integrity verification in torrent download applications.
         - total_size: Returns the total size in bytes of all files in the collection.
+        - file_pieces: Returns the range of piece indexes holding bytes of a given file.
+        - file_states: Returns the size and modification time of each file on disk, used to detect changed files.
+        - close: Closes the files kept open by the collection. Collections can also be used as context managers.
+
+    File I/O goes through a FileHandlePool (see max_open_files) with positional reads and writes, so files are not
+    reopened for every block. With use_mmap=True reads are served from lazily created memory maps instead: a range inside
+    a single file is returned as a memoryview of its map without copying, and a range crossing files is gathered once
+    into a preallocated buffer. Writes always go through os.pwrite, which shared maps see immediately.
     """
-    def __init__(self, files=None):
-        self.files = files or []
+    def __init__(self, files=None, max_open_files=MAX_OPEN_FILES, use_mmap=False):
+        # The files are kept in a FileTable; a list of BTFile objects is converted to one
+        self.files = files if isinstance(files, FileTable) else FileTable.from_files(files or [])
+        # Open descriptors shared by every read and write on the collection
+        self.handles = FileHandlePool(max_open_files)
+        # Memory maps used for reads in mmap storage mode
+        self.maps = MappedFilePool(max_open_files) if use_mmap else None
 
     def add_file(self, bt_file):
-        self.files.append(bt_file)
+        self.files.append(bt_file.path, bt_file.size, bt_file.start_byte)
 
     def get_files(self):
         return self.files
 
+    def file_spans(self, offset, amount):
+        # Yields (bt_file, position in the file, length) for each file overlapping
+        # the torrent byte range [offset, offset + amount), in order. Only the
+        # overlapping files are visited: the first one is found by bisection on
+        # the starts column of the file table.
+        files = self.files
+        starts, lengths = files.starts, files.lengths
+        end = offset + amount
+        index = files.find(offset)
+        while index < len(starts) and starts[index] < end:
+            start, size = starts[index], lengths[index]
+            if size and start + size > offset:
+                file_start = max(offset, start) - start
+                file_end = min(end, start + size) - start
+                yield files[index], file_start, file_end - file_start
+            index += 1
+
     def read_offset(self, offset, amount, output_directory):
-        # Initialize empty bytearray for data 
-        # and current offset to 0
+        if self.maps is not None:
+            return self._read_mapped(offset, amount, output_directory)
+        # Read each overlapping file's part of the range, in order
         data = bytearray()
-        current_offset = 0
+        for bt_file, file_start, length in self.file_spans(offset, amount):
+            with self.handles.open(os.path.join(output_directory, bt_file.path)) as fd:
+                while length > 0:
+                    chunk = os.pread(fd, length, file_start)
+                    if not chunk:
+                        break  # The file is shorter than expected
+                    data.extend(chunk)
+                    file_start += len(chunk)
+                    length -= len(chunk)
+        # Return the data as a bytearray object
+        return data
 
-        # Loop through each file in the torrent and check 
-        # if the requested data is in the file
+    def _read_mapped(self, offset, amount, output_directory):
+        spans = list(self.file_spans(offset, amount))
+        if len(spans) == 1:
+            # The whole range lies in one file: a view of its map, no copy at all
+            bt_file, file_start, length = spans[0]
+            return self.maps.view(os.path.join(output_directory, bt_file.path), file_start, length)
+        # The range crosses files: gather the parts into a single buffer
+        data = bytearray(amount)
+        position = 0
+        for bt_file, file_start, length in spans:
+            part = self.maps.read(os.path.join(output_directory, bt_file.path), file_start, length)
+            data[position:position + len(part)] = part
+            position += len(part)
+            if len(part) < length:
+                break  # The file is shorter than expected
+        del data[position:]
+        return memoryview(data)
 
-        for bt_file in self.get_files():
-            if (bt_file.start_byte <= offset <= bt_file.end_byte) or (bt_file.start_byte <= offset + amount - 1 <= bt_file.end_byte):
-                file_start = max(0, offset - current_offset)
-                file_end = min(bt_file.end_byte + 1, offset + amount - current_offset)
+    def write_offset(self, offset, data, output_directory):
+        # Write each overlapping file's part of the data, in order
+        data = memoryview(data)
+        written = 0
+        for bt_file, file_start, length in self.file_spans(offset, len(data)):
+            with self.handles.open(os.path.join(output_directory, bt_file.path), writable=True) as fd:
+                end = written + length
+                while written < end:
+                    count = os.pwrite(fd, data[written:end], file_start)
+                    if not count:
+                        raise OSError(errno.EIO, f"No bytes written to {bt_file.path}")
+                    file_start += count
+                    written += count
 
-                with open(os.path.join(output_directory, bt_file.path), 'rb') as f:
-                    f.seek(file_start)
-                    file_data = f.read(file_end - file_start)
-                    data.extend(file_data)
+    # Writes consecutive buffers starting at offset, as write_offset(offset, b"".join(buffers)) would but without
+    # joining them: each file's part goes down in as few pwritev calls as possible.
+    def write_buffers(self, offset, buffers, output_directory):
+        if not hasattr(os, "pwritev"):
+            return self.write_offset(offset, b"".join(buffers), output_directory)
+        views = collections.deque(memoryview(buffer).cast("B") for buffer in buffers if len(buffer))
+        for bt_file, file_start, length in self.file_spans(offset, sum(len(view) for view in views)):
+            # The buffers, or parts of them, that fall into this file
+            parts = []
+            while length:
+                view = views.popleft()
+                if len(view) > length:
+                    views.appendleft(view[length:])
+                    view = view[:length]
+                parts.append(view)
+                length -= len(view)
+            with self.handles.open(os.path.join(output_directory, bt_file.path), writable=True) as fd:
+                while parts:
+                    count = os.pwritev(fd, parts[:MAX_IOVECS], file_start)
+                    if not count:
+                        raise OSError(errno.EIO, f"No bytes written to {bt_file.path}")
+                    file_start += count
+                    # Drop what was written, keeping the rest of a partly written buffer
+                    while count and count >= len(parts[0]):
+                        count -= len(parts.pop(0))
+                    if count:
+                        parts[0] = parts[0][count:]
 
-            current_offset += bt_file.size
-        # Return the data as a bytearray object
-        return data
+    # Closes every file descriptor and memory map held by the collection
+    def close(self):
+        self.handles.close()
+        if self.maps is not None:
+            self.maps.close()
 
-    def write_offset(self, offset, data, output_directory):
-        # Initialize remaining_data to the entire data 
-        # and current offset to 0
-        remaining_data = data
-        current_offset = 0
+    def __enter__(self):
+        return self
 
-        for bt_file in self.get_files():
-            if (bt_file.start_byte <= offset <= bt_file.end_byte) or (bt_file.start_byte <= offset + len(data) - 1 <= bt_file.end_byte):
-                # Calculate the start and end positions within the file
-                file_start = max(0, offset - current_offset)
-                file_end = min(bt_file.end_byte + 1, offset + len(data) - current_offset)
-                # Write the data to the file
-                with open(os.path.join(output_directory, bt_file.path), 'rb+') as f:
-                    f.seek(file_start)
-                    f.write(remaining_data[:file_end - file_start])
-                    f.flush()
-                    remaining_data = remaining_data[file_end - file_start:]
-                # If all the data has been written, exit the loop
-                if not remaining_data:
-                    break
-
-            current_offset += bt_file.size
+    def __exit__(self, *exc_info):
+        self.close()
 
     def all_sha1_split_every(self, piece_length, output_directory):
         # Initialize current offset to 0 
         # and an empty list for the SHA1 hashes
         current_offset = 0
         sha1_list = []
+        total_size = self.total_size()
         # Loop through the torrent and compute a SHA1 hash 
         # for each piece of data of length piece_length
-        while current_offset < self.total_size():
+        while current_offset < total_size:
             data = self.read_offset(current_offset, piece_length, output_directory)
             sha1_hash = hashlib.sha1(data).digest()
             sha1_list.append(sha1_hash)
@@ -134,15 +357,76 @@ class BTFileCollection:
         # Return the list of SHA1 hashes
         return sha1_list
 
+    # Creates the directory tree and the payload files under output_directory, sized according to mode.
+    # Existing files are never shrunk, so data already downloaded is kept. With priorities (a FilePriorities),
+    # only the wanted files are sized; skipped files holding bytes of a wanted piece are only created, and
+    # the other skipped files are not touched.
+    def allocate(self, output_directory, mode=ALLOCATE_SPARSE, priorities=None):
+        if mode not in ALLOCATION_MODES:
+            raise ValueError(f"Invalid allocation mode {mode!r}, expected one of {', '.join(ALLOCATION_MODES)}")
+        root = os.path.realpath(output_directory)
+        needed = None if priorities is None else priorities.needed_files()
+        for index, bt_file in enumerate(self.files):
+            if needed is not None and index not in needed:
+                continue
+            file_mode = mode if priorities is None or priorities.is_wanted(index) else ALLOCATE_NONE
+            path = os.path.realpath(os.path.join(root, bt_file.path))
+            if os.path.commonpath([root, path]) != root or path == root:
+                raise ValueError(f"File path {bt_file.path!r} is outside the output directory")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                current_size = os.fstat(fd).st_size
+                if file_mode == ALLOCATE_NONE or current_size >= bt_file.size:
+                    continue
+                if file_mode == ALLOCATE_SPARSE:
+                    os.ftruncate(fd, bt_file.size)
+                else:
+                    self._allocate_full(fd, current_size, bt_file.size)
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def _allocate_full(fd, start, size):
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, start, size - start)
+                return
+            except OSError as error:
+                if error.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                    raise
+        # The file system cannot reserve blocks: write zeros instead
+        zeros = bytes(min(ZERO_FILL_CHUNK, size - start))
+        while start < size:
+            count = os.pwrite(fd, zeros[:size - start], start)
+            if not count:
+                raise OSError(errno.EIO, "No bytes written while allocating")
+            start += count
+
     def total_size(self):
-        return sum(file.size for file in self.files)
-    
-    def get_info_hash(torrent_file):
-        # Open the torrent file
-        with open(torrent_file, 'rb') as f:
-            torrent_data = encode.bdecode(f.read())
+        return self.files.total_size()
 
-        # Get the info hash
-        info_hash = torrent_data['info']['pieces'][0]['hash']
+    def file_pieces(self, bt_file, piece_length):
+        # Returns the range of piece indexes that hold bytes of bt_file
+        if not bt_file.size:
+            return range(0)
+        return range(bt_file.start_byte // piece_length, bt_file.end_byte // piece_length + 1)
 
-        return info_hash
\ No newline at end of file
+    def file_states(self, output_directory):
+        # Returns the (size, mtime in ns) of each file on disk, or None for missing files
+        states = []
+        for bt_file in self.files:
+            try:
+                stat = os.stat(os.path.join(output_directory, bt_file.path))
+            except FileNotFoundError:
+                states.append(None)
+            else:
+                states.append((stat.st_size, stat.st_mtime_ns))
+        return states
+    
+    @staticmethod
+    def get_info_hash(torrent_file):
+        # The SHA-1 of the raw 'info' bytes of the torrent file. Imported here
+        # because the parser itself depends on this module.
+        from app.features.parse_torrent_file import ParseTorrentFile
+        return ParseTorrentFile(torrent_file).info_hash()
\ No newline at end of file
@@ -0,0 +1,137 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+This code defines the FilePriorities class, which selects the files of a torrent to download.
+
+Every file gets a priority: skip (not downloaded), normal, or high (downloaded first). Pieces do not follow file
+boundaries, so the priorities are mapped to pieces: a file covers the pieces from start_byte // piece_length to
+end_byte // piece_length, and a piece gets the highest priority among the files it holds bytes of. The first and last
+pieces of a file may be shared with its neighbours; when a wanted piece is shared with a skipped file (a boundary
+piece), the skipped file's part of it has to be downloaded and stored too, or the piece could not be verified. Those
+skipped files are created on disk, but only ever hold the bytes of their boundary pieces (see
+BTFileCollection.allocate); every other skipped file is left alone.
+"""
+
+import fnmatch
+from array import array
+
+PRIORITY_SKIP = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+# Priority names, as accepted on the command line.
+PRIORITY_LEVELS = {"skip": PRIORITY_SKIP, "normal": PRIORITY_NORMAL, "high": PRIORITY_HIGH}
+
+
+class FilePriorities:
+    """
+    The FilePriorities class holds the priority of each file of a torrent and has the following functions:
+    - set: Sets the priority of the file at an index.
+    - set_matching: Sets the priority of the files whose path matches a glob pattern, returns how many matched.
+    - select: Skips every file not matching one of the wanted patterns and raises the ones matching a high pattern.
+    - file_pieces: Returns the range of piece indexes holding bytes of the file at an index.
+    - piece_priorities: Returns the priority of every piece, the highest of the files it holds bytes of.
+    - wanted_pieces: Returns the indexes of the pieces to download (priority above skip).
+    - boundary_pieces: Returns the wanted pieces that are shared with a skipped file.
+    - needed_files: Returns the indexes of the files that have to exist on disk: the wanted ones and the skipped ones
+      holding bytes of a boundary piece.
+    """
+    def __init__(self, files, piece_length, default=PRIORITY_NORMAL):
+        self.files = files
+        self.piece_length = piece_length
+        self.priorities = array("b", [default]) * len(files)
+        total_size = sum(bt_file.size for bt_file in files)
+        self.piece_count = (total_size + piece_length - 1) // piece_length
+
+    @classmethod
+    def from_meta_info(cls, meta_info, default=PRIORITY_NORMAL):
+        files = meta_info.create_btfile_collection().get_files()
+        return cls(files, meta_info.info.piece_length, default)
+
+    def set(self, index, priority):
+        if priority not in PRIORITY_LEVELS.values():
+            raise ValueError(f"Invalid file priority {priority!r}")
+        self.priorities[index] = priority
+
+    def set_matching(self, pattern, priority):
+        matched = 0
+        for index, bt_file in enumerate(self.files):
+            if fnmatch.fnmatchcase(bt_file.path, pattern):
+                self.set(index, priority)
+                matched += 1
+        return matched
+
+    def select(self, wanted=None, high=None):
+        if wanted:
+            for index, bt_file in enumerate(self.files):
+                if not any(fnmatch.fnmatchcase(bt_file.path, pattern) for pattern in wanted):
+                    self.priorities[index] = PRIORITY_SKIP
+        for pattern in high or ():
+            self.set_matching(pattern, PRIORITY_HIGH)
+        return self
+
+    def is_wanted(self, index):
+        return self.priorities[index] != PRIORITY_SKIP
+
+    def file_pieces(self, index):
+        bt_file = self.files[index]
+        if not bt_file.size:
+            return range(0)
+        return range(bt_file.start_byte // self.piece_length, bt_file.end_byte // self.piece_length + 1)
+
+    def piece_priorities(self):
+        pieces = array("b", bytes(self.piece_count))
+        for index, priority in enumerate(self.priorities):
+            covered = self.file_pieces(index)
+            if not covered or priority == PRIORITY_SKIP:
+                continue
+            first, last = covered[0], covered[-1]
+            # Pieces between the first and the last one hold bytes of this file only
+            if last - first > 1:
+                pieces[first + 1:last] = array("b", [priority]) * (last - first - 1)
+            pieces[first] = max(pieces[first], priority)
+            pieces[last] = max(pieces[last], priority)
+        return pieces
+
+    def wanted_pieces(self):
+        return [index for index, priority in enumerate(self.piece_priorities()) if priority != PRIORITY_SKIP]
+
+    # Yields (file index, its first piece, its last piece) for each skipped file with a wanted piece at either end.
+    def _skipped_on_boundaries(self, pieces):
+        for index, priority in enumerate(self.priorities):
+            covered = self.file_pieces(index)
+            if priority == PRIORITY_SKIP and covered and (pieces[covered[0]] or pieces[covered[-1]]):
+                yield index, covered[0], covered[-1]
+
+    def boundary_pieces(self):
+        pieces = self.piece_priorities()
+        boundary = set()
+        for _, first, last in self._skipped_on_boundaries(pieces):
+            boundary.update(piece for piece in (first, last) if pieces[piece])
+        return boundary
+
+    def needed_files(self):
+        needed = {index for index, priority in enumerate(self.priorities) if priority != PRIORITY_SKIP}
+        needed.update(index for index, _, _ in self._skipped_on_boundaries(self.piece_priorities()))
+        return needed
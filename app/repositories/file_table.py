@@ -0,0 +1,213 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+This code defines the FileTable class, a compact columnar table of the files of a torrent, and FileView, the view
+object handed out for each of its rows.
+
+A torrent with hundreds of thousands of files used to cost several hundred bytes per file: a TorrentFile from the
+parser, a BTFile for the BTFileCollection, and a "/"-joined path string in each. The table keeps one row per file in
+parallel columns instead:
+- lengths and starts: array('q') columns with the size of each file and its offset in the torrent byte range,
+- directories: an array('q') column with the directory node of each file,
+- names: the last path component of each file,
+and the directories themselves as a prefix tree of interned components, so a directory shared by thousands of files
+is stored once. Paths are only rebuilt when a FileView asks for one.
+"""
+
+import bisect
+import sys
+from array import array
+
+# Node id of the root of the directory tree (the top of the torrent).
+ROOT = 0
+
+
+class DirectoryTree:
+    """
+    The DirectoryTree class stores directory paths as a prefix tree of interned components and has the following functions:
+    - add: Returns the node id of a directory given as a list of components, adding the missing nodes.
+    - components: Returns the list of components of the directory at a node id.
+    """
+    __slots__ = ("parents", "names", "_children")
+
+    def __init__(self):
+        # Parent node and last component of every node; node 0 is the root
+        self.parents = array("q", [-1])
+        self.names = [""]
+        # (parent node, component) -> node, to find existing nodes
+        self._children = {}
+
+    def add(self, components):
+        node = ROOT
+        for component in components:
+            child = self._children.get((node, component))
+            if child is None:
+                child = len(self.names)
+                self.parents.append(node)
+                self.names.append(sys.intern(component))
+                self._children[(node, self.names[child])] = child
+            node = child
+        return node
+
+    def components(self, node):
+        parts = []
+        while node != ROOT:
+            parts.append(self.names[node])
+            node = self.parents[node]
+        parts.reverse()
+        return parts
+
+    def __len__(self):
+        return len(self.names)
+
+
+class FileView:
+    """
+    The FileView class is a lightweight view of one row of a FileTable and has the following properties:
+    - path: The "/"-joined path of the file, rebuilt from the table on each access.
+    - components: The path of the file as a list of components.
+    - length, size: The file size in bytes (TorrentFile and BTFile spellings).
+    - start_byte: The starting byte in the torrent byte range.
+    - end_byte: The ending byte in the torrent byte range.
+    """
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def path(self):
+        return self.table.path(self.index)
+
+    @property
+    def components(self):
+        return self.table.components(self.index)
+
+    @property
+    def length(self):
+        return self.table.lengths[self.index]
+
+    size = length
+
+    @property
+    def start_byte(self):
+        return self.table.starts[self.index]
+
+    @property
+    def end_byte(self):
+        return self.table.starts[self.index] + self.table.lengths[self.index] - 1
+
+    def __eq__(self, other):
+        if not isinstance(other, FileView):
+            return NotImplemented
+        return (self.path, self.length, self.start_byte) == (other.path, other.length, other.start_byte)
+
+    def __hash__(self):
+        return hash((self.path, self.length, self.start_byte))
+
+    def __str__(self):
+        return f"FileView(path={self.path}, length={self.length}, start_byte={self.start_byte})"
+
+    __repr__ = __str__
+
+
+class FileTable:
+    """
+    The FileTable class stores the files of a torrent in columns and has the following functions:
+    - append: Adds a file given its path (a "/"-separated string or a list of components) and length; it starts where
+      the previous file ends unless a start offset is given.
+    - from_files: Builds a table from objects with a path and a length or size (TorrentFile, BTFile, FileView).
+    - path, components: Rebuild the path of the file at an index.
+    - find: Returns the index of the file holding a byte offset of the torrent, by bisection on the starts column.
+    - total_size: Returns the total size in bytes of all files in the table.
+
+    The table is a sequence: len() gives the number of files, and indexing or iterating gives FileView objects, so it
+    can stand where a list of TorrentFile or BTFile objects was expected.
+    """
+    __slots__ = ("lengths", "starts", "directories", "names", "tree", "_last_directory")
+
+    def __init__(self):
+        self.lengths = array("q")
+        self.starts = array("q")
+        self.directories = array("q")
+        self.names = []
+        self.tree = DirectoryTree()
+        # Components and node of the directory of the last file appended: files of a directory come one after another
+        self._last_directory = ((), ROOT)
+
+    @classmethod
+    def from_files(cls, files):
+        table = cls()
+        for file in files:
+            start = getattr(file, "start_byte", None)
+            table.append(file.path, file.length if hasattr(file, "length") else file.size, start)
+        return table
+
+    def append(self, path, length, start=None):
+        components = path.split("/") if isinstance(path, str) else list(path)
+        if not components:
+            raise ValueError("Empty file path")
+        if length < 0:
+            raise ValueError("Invalid file length")
+        if start is None:
+            start = self.starts[-1] + self.lengths[-1] if self.starts else 0
+        directory = tuple(components[:-1])
+        if directory != self._last_directory[0]:
+            self._last_directory = (directory, self.tree.add(directory))
+        self.lengths.append(length)
+        self.starts.append(start)
+        self.directories.append(self._last_directory[1])
+        self.names.append(components[-1])
+
+    def components(self, index):
+        parts = self.tree.components(self.directories[index])
+        parts.append(self.names[index])
+        return parts
+
+    def path(self, index):
+        return "/".join(self.components(index))
+
+    def find(self, offset):
+        return max(bisect.bisect_right(self.starts, offset) - 1, 0)
+
+    def total_size(self):
+        return sum(self.lengths)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.lengths)
+        if not 0 <= index < len(self.lengths):
+            raise IndexError("file index out of range")
+        return FileView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.lengths)):
+            yield FileView(self, index)
+
+    def __str__(self):
+        return f"FileTable(files={len(self)}, directories={len(self.tree) - 1}, total_size={self.total_size()})"
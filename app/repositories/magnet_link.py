@@ -0,0 +1,123 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Magnet links
+------------
+
+A magnet link names a torrent by its info-hash instead of shipping the .torrent file:
+
+    magnet:?xt=urn:btih:<info-hash>&dn=<name>&tr=<tracker URL>&x.pe=<host:port>&xl=<size>
+
+The info-hash is given as 40 hexadecimal digits or 32 base32 characters. Only xt is required; every tr is a tracker to
+ask for peers and every x.pe a peer to contact directly. The info dictionary itself is then fetched from peers with the
+metadata extension (see app/features/fetch_metadata.py).
+
+For more information, please refer to the [BEP 9 specification](https://www.bittorrent.org/beps/bep_0009.html).
+"""
+
+import base64
+import binascii
+import urllib.parse
+
+BTIH_PREFIX = "urn:btih:"
+
+
+class MagnetLinkError(ValueError):
+    """Raised when a magnet link is malformed or has no BitTorrent v1 info-hash."""
+
+
+class MagnetLink:
+    """
+    The MagnetLink class holds the fields of a magnet link:
+    - info_hash: The 20-byte v1 info-hash of the torrent.
+    - name: The display name (dn), or None.
+    - trackers: The tracker URLs (tr), in link order.
+    - peers: The (host, port) peers to contact directly (x.pe).
+    - length: The exact payload size in bytes (xl), or None.
+    """
+    def __init__(self, info_hash, name=None, trackers=None, peers=None, length=None):
+        self.info_hash = info_hash
+        self.name = name
+        self.trackers = list(trackers or [])
+        self.peers = list(peers or [])
+        self.length = length
+
+    @classmethod
+    def parse(cls, uri):
+        parts = urllib.parse.urlsplit(uri)
+        if parts.scheme.lower() != "magnet":
+            raise MagnetLinkError(f"Not a magnet link: {uri!r}")
+        info_hash, name, trackers, peers, length = None, None, [], [], None
+        for key, value in urllib.parse.parse_qsl(parts.query):
+            # Parameters may be numbered (xt.1, tr.2, ...) when repeated
+            prefix, _, suffix = key.rpartition(".")
+            field = prefix if prefix and suffix.isdigit() else key
+            if field == "xt" and value.lower().startswith(BTIH_PREFIX):
+                info_hash = _decode_info_hash(value[len(BTIH_PREFIX):])
+            elif field == "dn":
+                name = value
+            elif field == "tr" and value not in trackers:
+                trackers.append(value)
+            elif field == "x.pe":
+                peers.append(_decode_peer(value))
+            elif field == "xl":
+                if not value.isdigit():
+                    raise MagnetLinkError(f"Invalid exact length {value!r}")
+                length = int(value)
+        if info_hash is None:
+            raise MagnetLinkError("Magnet link without a BitTorrent v1 info-hash (xt=urn:btih:...)")
+        return cls(info_hash, name, trackers, peers, length)
+
+    def tracker_tiers(self):
+        # Each tracker of a magnet link is a tier of its own
+        return [[url] for url in self.trackers]
+
+    def __str__(self):
+        params = [("xt", BTIH_PREFIX + self.info_hash.hex())]
+        if self.name is not None:
+            params.append(("dn", self.name))
+        if self.length is not None:
+            params.append(("xl", str(self.length)))
+        params += [("tr", url) for url in self.trackers]
+        params += [("x.pe", f"[{host}]:{port}" if ":" in host else f"{host}:{port}") for host, port in self.peers]
+        return "magnet:?" + urllib.parse.urlencode(params, safe=":/[]")
+
+
+def _decode_info_hash(value):
+    try:
+        if len(value) == 40:
+            return bytes.fromhex(value)
+        if len(value) == 32:
+            return base64.b32decode(value.upper())
+    except (ValueError, binascii.Error):
+        pass
+    raise MagnetLinkError(f"Invalid info-hash {value!r}")
+
+
+def _decode_peer(value):
+    host, _, port = value.rpartition(":")
+    host = host[1:-1] if host.startswith("[") and host.endswith("]") else host
+    if not host or not port.isdigit() or not 0 < int(port) < 65536:
+        raise MagnetLinkError(f"Invalid peer address {value!r}")
+    return host, int(port)
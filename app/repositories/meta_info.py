@@ -49,38 +49,56 @@ In the single file case, the name key is the name of a file, in the muliple file
 Text credit: https://wiki.theory.org/BitTorrentSpecification#Metainfo_File_Structure
 """
 
-from urllib import request
-from app.repositories.bt_file import BTFile, BTFileCollection
+from app.repositories.bt_file import BTFileCollection, ALLOCATE_SPARSE
+from app.repositories.file_table import FileTable
+from app.repositories.piece_hash_table import PieceHashTable
 
 # Define the MetaInfo class to store torrent metadata
 class MetaInfo:
-    def __init__(self, announce, info, announce_list=None, comment=None, created_by=None, creation_date=None, encoding=None, files=None):
+    def __init__(self, announce, info, announce_list=None, comment=None, created_by=None, creation_date=None, encoding=None, files=None, info_hash=None, info_hash_v2=None, announce_tiers=None, info_bytes=None):
         self.announce = announce # The main tracker URL
         self.announce_list = announce_list # List of alternative tracker URLs
+        self.announce_tiers = announce_tiers # The announce-list as tiers (lists) of Tracker objects, in file order
         self.comment = comment # Optional comment from the torrent creator
         self.created_by = created_by # Name of the torrent creator
         self.creation_date = creation_date # Timestamp when the torrent was created
         self.encoding = encoding # Encoding used for the torrent
         self.info = info # TorrentInfo object containing information about the torrent
-        self.files = files # List of FileInfo objects, one for each file in the torrent
-
-    def create_btfile_collection(self):
-        btfile_collection = BTFileCollection()
-        current_byte = 0
-
+        self.files = files # FileTable (or list of TorrentFile objects) of the files in the torrent, None for a single file
+        self.info_hash = info_hash # SHA-1 digest of the bencoded info dictionary (v1)
+        self.info_hash_v2 = info_hash_v2 # SHA-256 digest of the bencoded info dictionary (v2), if computed
+        self.info_bytes = info_bytes # The bencoded info dictionary as found in the torrent file, if kept (served to magnet links)
+
+    def tracker_tiers(self):
+        # Trackers to announce to, by tier (BEP 12): the announce-list if present, otherwise the announce URL
+        if self.announce_tiers:
+            return [list(tier) for tier in self.announce_tiers]
+        if self.announce_list:
+            return [[tracker] for tracker in self.announce_list]
+        return [[self.announce]] if self.announce else []
+
+    def create_btfile_collection(self, output_directory=None, allocation=ALLOCATE_SPARSE, use_mmap=False):
+        # Builds the BTFileCollection of the payload. With an output_directory, the files are also
+        # created there (see BTFileCollection.allocate for the allocation modes). use_mmap selects
+        # reads from memory maps (see BTFileCollection).
         if self.files is None:
             # The torrent is a single file
             if self.info.length < 0:
                 raise ValueError("Invalid file length")
-            bt_file = BTFile(self.info.name, self.info.length, 0, self.info.length - 1)
-            btfile_collection.add_file(bt_file)
+            files = FileTable()
+            files.append([self.info.name], self.info.length)
+        elif isinstance(self.files, FileTable):
+            # The torrent contains multiple files, already in a table: the collection shares it
+            files = self.files
         else:
-            # The torrent contains multiple files
+            # The torrent contains multiple files, listed as TorrentFile objects
+            files = FileTable()
             for file_info in self.files:
-                bt_file = BTFile(file_info.path, file_info.length, current_byte, current_byte + file_info.length - 1)
-                btfile_collection.add_file(bt_file)
-                current_byte += file_info.length
+                files.append(file_info.path, file_info.length)
+        btfile_collection = BTFileCollection(files, use_mmap=use_mmap)
 
+        if output_directory is not None:
+            btfile_collection.allocate(output_directory, allocation)
         return btfile_collection
 
 # Define the FileInfo class to store information about individual files in a torrent
@@ -95,35 +113,17 @@ class Tracker:
     def __init__(self, url):
         self.url = url
 
-    def connect_to_tracker(self, info_hash):
-        # Create a connection to the tracker
-        connection = request.Request.get(self.url, params={'info_hash': info_hash})
-        if connection.status_code != 200:
-            raise Exception('Tracker connection failed.')
-        response_body = connection.content.decode('utf-8')
-        parsed_response = bencode.bdecode(response_body)
-        announce_url = parsed_response['announce']
-        return announce_url
-    
-
-    def download_piece(self, info_hash, piece_index, piece_length, announce_url):
-        # Create a connection to the announce URL
-        connection = request.get(announce_url, params={
-            'info_hash': info_hash,
-            'piece_index': piece_index,
-            'piece_length': piece_length,
-        })
-
-        # Check the response status code
-        if connection.status_code != 200:
-            raise Exception('Download failed.')
-
-        # Get the response body
-        response_body = connection.content
-
-        # Write the response body to a file
-        with open('piece-%d' % piece_index, 'wb') as f:
-            f.write(response_body)
+    async def announce(self, client, info_hash, peer_id, port, **params):
+        # Announces to this tracker through a TrackerClient and returns its AnnounceResponse
+        return await client.announce(self.url, info_hash, peer_id, port, **params)
+
+    async def scrape(self, client, info_hashes):
+        # Scrapes this tracker through a TrackerClient and returns {info_hash: ScrapeResult}
+        return await client.scrape(self.url, info_hashes)
+
+    def __str__(self):
+        return self.url
+
 
 class TorrentInfo:
     def __init__(self, name, piece_length, pieces, length=None, files=None, private=None):
@@ -136,6 +136,15 @@ class TorrentInfo:
         self.length = length
         self.files = files
         self.private = private
+        # Indexed view over the piece hashes, validated to hold whole 20-byte hashes
+        self.piece_hashes = PieceHashTable(pieces, piece_length, self.total_length())
+
+    def total_length(self):
+        if isinstance(self.files, FileTable):
+            return self.files.total_size()
+        if self.files:
+            return sum(file.length for file in self.files)
+        return self.length
 
     def __str__(self):
         return f"TorrentInfo(name={self.name}, piece_length={self.piece_length}, pieces={len(self.pieces)}, length={self.length}, files={self.files}, private={self.private})"
@@ -0,0 +1,215 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+peer wire protocol
+------------------
+
+Peers talk over TCP. A connection starts with a handshake in each direction:
+
+    <pstrlen=19><pstr="BitTorrent protocol"><8 reserved bytes><20-byte info_hash><20-byte peer_id>
+
+After that, everything is a length-prefixed message: a 4-byte big-endian length, a 1-byte message id and a payload.
+A zero length is a keep-alive.
+
+    0 choke, 1 unchoke, 2 interested, 3 not interested        (no payload)
+    4 have          <piece index>
+    5 bitfield      <bitfield, high bit of the first byte is piece 0>
+    6 request       <index><begin><length>
+    7 piece         <index><begin><block>
+    8 cancel        <index><begin><length>
+    20 extended     <extended message id><payload>                (BEP 10)
+
+Peers that set the extension bit in the reserved bytes of their handshake (EXTENSION_PROTOCOL) can exchange extended
+messages. Extended message 0 is the extension handshake, a bencoded dictionary whose "m" entry maps the names of the
+extensions a peer supports to the extended message ids it wants to receive them with.
+
+Both ends start choked and not interested. Blocks are requested in 16 KiB units, several at a time (pipelining),
+and a peer only serves requests while it has the other side unchoked.
+
+For more information, please refer to the [official BitTorrent specification](https://www.bittorrent.org/beps/bep_0003.html).
+"""
+
+import asyncio
+import os
+import struct
+
+PROTOCOL = b"BitTorrent protocol"
+HANDSHAKE_LENGTH = 1 + len(PROTOCOL) + 8 + 20 + 20
+BLOCK_SIZE = 16 * 1024
+# Largest message accepted from a peer: enough for a block or a big bitfield.
+MAX_MESSAGE_LENGTH = 2 * 1024 * 1024
+
+CHOKE = 0
+UNCHOKE = 1
+INTERESTED = 2
+NOT_INTERESTED = 3
+HAVE = 4
+BITFIELD = 5
+REQUEST = 6
+PIECE = 7
+CANCEL = 8
+PORT = 9
+EXTENDED = 20
+
+# Extended message id of the extension handshake.
+EXTENDED_HANDSHAKE = 0
+# Reserved handshake bytes announcing support for the extension protocol (bit 20 from the right).
+EXTENSION_PROTOCOL = bytes([0, 0, 0, 0, 0, 0x10, 0, 0])
+
+_LENGTH = struct.Struct(">I")
+_HEADER = struct.Struct(">IB")
+_INDEX = struct.Struct(">I")
+_BLOCK = struct.Struct(">III")
+_PIECE_HEADER = struct.Struct(">IBII")
+
+
+class PeerWireError(Exception):
+    """Raised when a peer violates the protocol."""
+
+
+def generate_peer_id(client=b"-PY0100-"):
+    return client + os.urandom(20 - len(client))
+
+
+def encode_have(index):
+    return _INDEX.pack(index)
+
+
+def encode_block(index, begin, length):
+    # Payload of request and cancel messages
+    return _BLOCK.pack(index, begin, length)
+
+
+def decode_block(payload):
+    if len(payload) != _BLOCK.size:
+        raise PeerWireError("Invalid request/cancel message")
+    return _BLOCK.unpack(payload)
+
+
+def decode_have(payload):
+    if len(payload) != _INDEX.size:
+        raise PeerWireError("Invalid have message")
+    return _INDEX.unpack(payload)[0]
+
+
+def decode_piece(payload):
+    # Returns (index, begin, block) with the block as a view of the payload
+    if len(payload) < 8:
+        raise PeerWireError("Invalid piece message")
+    index, begin = struct.unpack_from(">II", payload)
+    return index, begin, memoryview(payload)[8:]
+
+
+def supports_extensions(reserved):
+    return bool(reserved) and bool(reserved[5] & 0x10)
+
+
+def decode_extended(payload):
+    # Returns the extended message id and its payload
+    if not payload:
+        raise PeerWireError("Empty extended message")
+    return payload[0], memoryview(payload)[1:]
+
+
+class PeerConnection:
+    """
+    The PeerConnection class wraps the asyncio streams of a connection with a peer:
+    - peer_id: The remote peer id, once the handshake has been read.
+    - reserved: The remote reserved (extension) bytes, once the handshake has been read.
+    """
+    def __init__(self, reader, writer, timeout=None):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.peer_id = None
+        self.reserved = None
+
+    @classmethod
+    async def open(cls, host, port, timeout=None):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        return cls(reader, writer, timeout)
+
+    @property
+    def address(self):
+        return self.writer.get_extra_info("peername")
+
+    async def send_handshake(self, info_hash, peer_id, reserved=bytes(8)):
+        self.writer.write(bytes([len(PROTOCOL)]) + PROTOCOL + reserved + info_hash + peer_id)
+        await self.writer.drain()
+
+    # Reads the remote handshake, checking it is for info_hash, and returns the remote peer id.
+    async def read_handshake(self, info_hash=None):
+        data = await self._read(HANDSHAKE_LENGTH)
+        if data[0] != len(PROTOCOL) or data[1:20] != PROTOCOL:
+            raise PeerWireError("Invalid handshake")
+        remote_info_hash = data[28:48]
+        if info_hash is not None and remote_info_hash != info_hash:
+            raise PeerWireError("Handshake for a different torrent")
+        self.reserved = data[20:28]
+        self.peer_id = data[48:68]
+        return remote_info_hash
+
+    # Queues a message; call drain() to wait until it has been handed to the socket.
+    def write_message(self, message_id, payload=b""):
+        self.writer.write(_HEADER.pack(len(payload) + 1, message_id))
+        if payload:
+            self.writer.write(payload)
+
+    async def send_message(self, message_id, payload=b""):
+        self.write_message(message_id, payload)
+        await self.writer.drain()
+
+    # Sends a piece message without copying the block into a new payload.
+    async def send_piece(self, index, begin, block):
+        self.writer.write(_PIECE_HEADER.pack(len(block) + 9, PIECE, index, begin))
+        self.writer.write(block)
+        await self.writer.drain()
+
+    async def send_extended(self, extended_id, payload):
+        self.write_message(EXTENDED, bytes([extended_id]) + bytes(payload))
+        await self.writer.drain()
+
+    async def send_keep_alive(self):
+        self.writer.write(_LENGTH.pack(0))
+        await self.writer.drain()
+
+    async def drain(self):
+        await self.writer.drain()
+
+    # Returns the next (message id, payload), or (None, b"") for a keep-alive.
+    async def read_message(self):
+        length = _LENGTH.unpack(await self._read(4))[0]
+        if length == 0:
+            return None, b""
+        if length > MAX_MESSAGE_LENGTH:
+            raise PeerWireError(f"Message too long: {length} bytes")
+        data = await self._read(length)
+        return data[0], data[1:]
+
+    async def _read(self, count):
+        return await asyncio.wait_for(self.reader.readexactly(count), self.timeout)
+
+    def close(self):
+        if not self.writer.is_closing():
+            self.writer.close()
@@ -0,0 +1,158 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+This code defines the PieceHashTable class, a compact view over the 'pieces' value of a torrent's info dictionary.
+
+The 'pieces' value is the concatenation of the 20-byte SHA-1 hashes of every piece. Instead of slicing that blob again and
+again, consumers index the table by piece index, compare computed digests against it, keep track of which pieces have
+been verified and convert between piece indexes and byte ranges of the torrent payload.
+"""
+
+HASH_LENGTH = 20
+
+
+class PieceHashTable:
+    """
+    The PieceHashTable class wraps the concatenated piece hashes and has the following properties:
+    - piece_length: The nominal size of a piece in bytes.
+    - total_length: The total size of the torrent payload in bytes.
+    - bitfield: The verified pieces as a BitTorrent bitfield (most significant bit first).
+
+    Hashes are returned as 20-byte memoryview slices of the original value, so no hash is ever copied. The per-torrent
+    overhead is the table itself plus one bit per piece.
+    """
+    __slots__ = ("_hashes", "_count", "_verified", "piece_length", "total_length")
+
+    def __init__(self, pieces, piece_length, total_length=None):
+        hashes = memoryview(pieces).cast("B")
+        if len(hashes) % HASH_LENGTH:
+            raise ValueError(f"Invalid pieces length {len(hashes)}: not a multiple of {HASH_LENGTH}")
+        if piece_length <= 0:
+            raise ValueError("Invalid piece length")
+        self._hashes = hashes
+        self._count = len(hashes) // HASH_LENGTH
+        self._verified = bytearray((self._count + 7) // 8)
+        self.piece_length = piece_length
+        self.total_length = total_length
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        index = self._check_index(index)
+        start = index * HASH_LENGTH
+        return self._hashes[start:start + HASH_LENGTH]
+
+    def __iter__(self):
+        hashes = self._hashes
+        for start in range(0, len(hashes), HASH_LENGTH):
+            yield hashes[start:start + HASH_LENGTH]
+
+    def _check_index(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("piece index out of range")
+        return index
+
+    # Compares a single computed digest with the expected hash and records the result.
+    def verify(self, index, digest):
+        matches = self[index] == digest
+        self.set_verified(index, matches)
+        return matches
+
+    # Compares a run of computed digests, starting at piece start, with the table.
+    # The whole run is first compared in one go, so the common all-good case costs a
+    # single memory comparison. Returns a list with one bool per digest.
+    def compare(self, digests, start=0):
+        digests = list(digests)
+        if start < 0 or start + len(digests) > self._count:
+            raise IndexError("piece index out of range")
+        expected = self._hashes[start * HASH_LENGTH:(start + len(digests)) * HASH_LENGTH]
+        if expected == b"".join(digests):
+            results = [True] * len(digests)
+        else:
+            results = [expected[i * HASH_LENGTH:(i + 1) * HASH_LENGTH] == digest for i, digest in enumerate(digests)]
+        for offset, matches in enumerate(results):
+            self.set_verified(start + offset, matches)
+        return results
+
+    def is_verified(self, index):
+        index = self._check_index(index)
+        return bool(self._verified[index >> 3] & (0x80 >> (index & 7)))
+
+    def set_verified(self, index, verified=True):
+        index = self._check_index(index)
+        if verified:
+            self._verified[index >> 3] |= 0x80 >> (index & 7)
+        else:
+            self._verified[index >> 3] &= ~(0x80 >> (index & 7)) & 0xFF
+
+    def verified_count(self):
+        return sum(bin(byte).count("1") for byte in self._verified)
+
+    def is_complete(self):
+        return self.verified_count() == self._count
+
+    @property
+    def bitfield(self):
+        return bytes(self._verified)
+
+    @bitfield.setter
+    def bitfield(self, value):
+        if len(value) != len(self._verified):
+            raise ValueError("Invalid bitfield length")
+        self._verified[:] = value
+        # Spare bits past the last piece must stay clear.
+        if self._count & 7:
+            self._verified[-1] &= (0xFF00 >> (self._count & 7)) & 0xFF
+
+    # Returns the size in bytes of a piece: piece_length, except possibly for the last one.
+    def piece_size(self, index):
+        start, end = self.piece_range(index)
+        return end - start
+
+    # Returns the [start, end) byte range of a piece within the torrent payload.
+    def piece_range(self, index):
+        index = self._check_index(index)
+        start = index * self.piece_length
+        end = start + self.piece_length
+        if self.total_length is not None:
+            end = min(end, self.total_length)
+        return start, end
+
+    # Returns the index of the piece containing the given byte offset.
+    def piece_at(self, offset):
+        if offset < 0:
+            raise IndexError("byte offset out of range")
+        return self._check_index(offset // self.piece_length)
+
+    # Returns the range of piece indexes overlapping the byte range [offset, offset + length).
+    def pieces_for_range(self, offset, length):
+        if length <= 0:
+            return range(0)
+        return range(self.piece_at(offset), self.piece_at(offset + length - 1) + 1)
+
+    def __repr__(self):
+        return f"PieceHashTable(pieces={self._count}, piece_length={self.piece_length}, verified={self.verified_count()})"
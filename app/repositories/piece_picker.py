@@ -0,0 +1,142 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+This code defines the PiecePicker class, which decides which piece to download next.
+
+Pieces are picked rarest first: the picker counts, for every piece, how many connected peers have it (from their
+bitfield and have messages) and always hands out a wanted piece with the lowest count among those the asking peer has.
+Rare pieces are fetched while their few holders are still around, which keeps the swarm from getting stuck on
+long-tail pieces. Ties are broken randomly, so peers downloading at the same time spread over different pieces.
+Pieces can also be given priorities (from the file priorities of the torrent): rarest first then applies within
+each priority level, highest level first.
+"""
+
+import random
+from array import array
+
+
+class PiecePicker:
+    """
+    The PiecePicker class tracks piece availability and the pieces still wanted:
+    - availability: How many peers have each piece, as a compact array of counts.
+    - priorities: The priority of each piece (see app/repositories/file_priorities.py); pieces of priority 0 are
+      never wanted, and pieces of a higher priority are always picked before those of a lower one.
+
+    Wanted pieces are kept in buckets by priority and availability. Each bucket is an insertion-ordered dict filled
+    in a random order, so the first piece a peer has in the lowest bucket is a random choice among the rarest ones,
+    and a pick against a peer that has everything costs O(1).
+    """
+    __slots__ = ("availability", "priorities", "_levels", "_wanted", "_random")
+
+    def __init__(self, piece_count, wanted=None, seed=None, priorities=None):
+        self.availability = array("I", bytes(4 * piece_count))
+        self.priorities = array("b", [1]) * piece_count if priorities is None else array("b", priorities)
+        self._random = random.Random(seed)
+        order = [index for index in (range(piece_count) if wanted is None else wanted) if self.priorities[index]]
+        self._random.shuffle(order)
+        self._levels = {}  # priority -> [{piece index: None} for each availability]
+        for index in order:
+            self._bucket(index, 0)[index] = None
+        self._wanted = set(order)
+
+    def __len__(self):
+        return len(self._wanted)
+
+    def is_wanted(self, index):
+        return index in self._wanted
+
+    def _bucket(self, index, count):
+        buckets = self._levels.setdefault(self.priorities[index], [])
+        while len(buckets) <= count:
+            buckets.append({})
+        return buckets[count]
+
+    def _move(self, index, old, new):
+        if index in self._wanted:
+            del self._bucket(index, old)[index]
+            self._bucket(index, new)[index] = None
+
+    def add_have(self, index):
+        count = self.availability[index]
+        self.availability[index] = count + 1
+        self._move(index, count, count + 1)
+
+    def remove_have(self, index):
+        count = self.availability[index]
+        if count:
+            self.availability[index] = count - 1
+            self._move(index, count, count - 1)
+
+    def add_bitfield(self, bitfield):
+        # Shuffled, so that pieces enter their new bucket in a random order
+        indexes = list(_set_bits(bitfield, len(self.availability)))
+        self._random.shuffle(indexes)
+        for index in indexes:
+            self.add_have(index)
+
+    def remove_bitfield(self, bitfield):
+        for index in _set_bits(bitfield, len(self.availability)):
+            self.remove_have(index)
+
+    # Returns the rarest wanted piece of the highest priority for which has(index) is true (every piece if has
+    # is None) and stops offering it, or returns None when there is no such piece.
+    def pick(self, has=None):
+        for priority in sorted(self._levels, reverse=True):
+            for bucket in self._levels[priority][1:]:
+                for index in bucket:
+                    if has is None or has(index):
+                        del bucket[index]
+                        self._wanted.discard(index)
+                        return index
+        return None
+
+    # Offers a picked piece again, e.g. after it failed the hash check or was abandoned.
+    def unpick(self, index):
+        if index not in self._wanted and self.priorities[index]:
+            self._wanted.add(index)
+            self._bucket(index, self.availability[index])[index] = None
+
+    # Stops offering a piece for good, e.g. once it is verified.
+    def discard(self, index):
+        if index in self._wanted:
+            self._wanted.discard(index)
+            del self._bucket(index, self.availability[index])[index]
+
+    # Changes the priority of a piece; a wanted piece set to priority 0 is no longer offered.
+    def set_priority(self, index, priority):
+        wanted = index in self._wanted
+        self.discard(index)
+        self.priorities[index] = priority
+        if wanted:
+            self.unpick(index)
+
+
+# Yields the indexes of the bits set in a bitfield (most significant bit first), below count.
+def _set_bits(bitfield, count):
+    for byte_index, byte in enumerate(bitfield):
+        if byte:
+            base = byte_index * 8
+            for bit in range(8):
+                if byte & (0x80 >> bit) and base + bit < count:
+                    yield base + bit
@@ -0,0 +1,169 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+This code defines the RoutingTable class, the k-bucket routing table of a DHT node (BEP 5), and the Node entries it holds.
+
+Node ids are 160-bit numbers and the distance between two ids is their XOR. The table keeps at most k nodes per bucket;
+bucket i holds the nodes whose id shares exactly i leading bits with ours, and the last bucket every node sharing at
+least as many. When the last bucket is full it is split in two, so the table knows many nodes close to us and only a
+few far away - which is what iterative lookups need, since each step at least halves the distance to the target.
+
+Ids are kept as Python ints: the bucket of a node is found from the bit length of its distance, without walking a tree.
+Within a bucket, nodes are ordered from least to most recently seen.
+"""
+
+import heapq
+import random
+import time
+from collections import OrderedDict
+
+ID_LENGTH = 20
+ID_BITS = 8 * ID_LENGTH
+# Nodes per bucket.
+K = 8
+# Queries in a row a node may leave unanswered before it is dropped.
+MAX_FAILURES = 3
+
+
+class Node:
+    """
+    The Node class is an entry of the routing table:
+    - id: The node id, as an int.
+    - address: The (host, port) UDP address of the node.
+    - last_seen: When the node last answered or queried us (time.monotonic()).
+    - failures: The queries it left unanswered since.
+    """
+    __slots__ = ("id", "address", "last_seen", "failures")
+
+    def __init__(self, node_id, address, last_seen):
+        self.id = node_id
+        self.address = address
+        self.last_seen = last_seen
+        self.failures = 0
+
+    @property
+    def node_id(self):
+        return self.id.to_bytes(ID_LENGTH, "big")
+
+    def __repr__(self):
+        return f"Node({self.node_id.hex()}, {self.address[0]}:{self.address[1]})"
+
+
+class RoutingTable:
+    """
+    The RoutingTable class holds the nodes known to a DHT node and has the following functions:
+    - add: Adds or refreshes a node. When its bucket is full and cannot be split, returns the least recently seen
+      node of the bucket, which the caller should ping and remove if it does not answer.
+    - get / remove: Look up or drop a node by id.
+    - mark_failed: Counts an unanswered query; the node is dropped after MAX_FAILURES in a row.
+    - closest: Returns the nodes closest to a target id, nearest first.
+    - stale_buckets / random_id: The buckets not refreshed for a while, and an id to look up to refresh one.
+    """
+    __slots__ = ("id", "k", "buckets")
+
+    def __init__(self, node_id, k=K):
+        self.id = int.from_bytes(node_id, "big")
+        self.k = k
+        self.buckets = [OrderedDict()]  # [{node id: Node}], least recently seen first
+
+    def _index(self, node_id):
+        shared = ID_BITS - (self.id ^ node_id).bit_length()
+        return min(shared, len(self.buckets) - 1)
+
+    def add(self, node_id, address, now=None):
+        node_id = int.from_bytes(node_id, "big")
+        if node_id == self.id:
+            return None
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets[self._index(node_id)]
+        node = bucket.get(node_id)
+        if node is not None:
+            node.address, node.last_seen, node.failures = address, now, 0
+            bucket.move_to_end(node_id)
+            return None
+        if len(bucket) >= self.k:
+            if bucket is self.buckets[-1] and len(self.buckets) < ID_BITS:
+                self._split()
+                return self.add(node_id.to_bytes(ID_LENGTH, "big"), address, now)
+            # Full: take the place of a node that stopped answering, if any
+            failing = next((node for node in bucket.values() if node.failures), None)
+            if failing is None:
+                return next(iter(bucket.values()))
+            del bucket[failing.id]
+        bucket[node_id] = Node(node_id, address, now)
+        return None
+
+    # Splits the last bucket: the nodes sharing one more leading bit with us move to a new last bucket.
+    def _split(self):
+        last = self.buckets[-1]
+        self.buckets.append(OrderedDict())
+        depth = len(self.buckets) - 1
+        for node_id in list(last):
+            if ID_BITS - (self.id ^ node_id).bit_length() >= depth:
+                self.buckets[-1][node_id] = last.pop(node_id)
+
+    def get(self, node_id):
+        node_id = int.from_bytes(node_id, "big")
+        return self.buckets[self._index(node_id)].get(node_id)
+
+    def remove(self, node_id):
+        node_id = int.from_bytes(node_id, "big")
+        self.buckets[self._index(node_id)].pop(node_id, None)
+
+    def mark_failed(self, node_id):
+        node = self.get(node_id)
+        if node is not None:
+            node.failures += 1
+            if node.failures >= MAX_FAILURES:
+                self.remove(node_id)
+
+    # Nodes nearest to target first. A table holds at most a few thousand nodes, so selecting from all of them
+    # is cheaper than walking the buckets outwards from the target's.
+    def closest(self, target, count=None):
+        target = int.from_bytes(target, "big")
+        return heapq.nsmallest(count or self.k, self, key=lambda node: node.id ^ target)
+
+    def stale_buckets(self, max_age, now=None):
+        now = time.monotonic() if now is None else now
+        return [index for index, bucket in enumerate(self.buckets)
+                if not bucket or now - max(node.last_seen for node in bucket.values()) > max_age]
+
+    # Returns a random id that falls into bucket index.
+    def random_id(self, index, rng=random):
+        value = rng.getrandbits(ID_BITS)
+        if index < len(self.buckets) - 1:
+            # Same first index bits as ours, then a different one
+            keep = ID_BITS - index
+            value = (self.id >> keep << keep) | ((~self.id) & (1 << (keep - 1))) | (value & ((1 << (keep - 1)) - 1))
+        else:
+            keep = ID_BITS - index
+            value = (self.id >> keep << keep) | (value & ((1 << keep) - 1))
+        return value.to_bytes(ID_LENGTH, "big")
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets)
+
+    def __iter__(self):
+        for bucket in self.buckets:
+            yield from bucket.values()
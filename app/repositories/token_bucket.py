@@ -0,0 +1,65 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+This code defines the TokenBucket class, the rate limiter shared by every connection that must stay under a common
+bandwidth budget (for example all the downloads of a session).
+
+The bucket fills at `rate` bytes per second up to `burst` bytes. Sending or receiving n bytes takes n tokens; when the
+bucket runs dry, the caller waits until the debt has been refilled. Waiters are served one at a time in arrival order,
+so every connection - and so every torrent - gets its turn and none can starve the others.
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    The TokenBucket class limits the throughput of the callers of consume():
+    - rate: The sustained rate in bytes per second, or None for no limit.
+    - burst: The largest amount that can go through at once after a pause (defaults to one second's worth).
+    """
+    def __init__(self, rate=None, burst=None):
+        if rate is not None and rate <= 0:
+            raise ValueError("Invalid rate")
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # Takes amount tokens, waiting as long as needed to stay under the rate.
+    async def consume(self, amount):
+        if self.rate is None:
+            return
+        async with self._lock:
+            self._refill()
+            self.tokens -= amount
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
@@ -0,0 +1,134 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+This code defines the WriteBackCache class, which sits between the download engine and BTFileCollection.
+
+Blocks are assembled into whole pieces in memory by the downloader. Once complete, a piece is checked against its
+SHA-1 from the torrent. Only good pieces enter the cache, so nothing unverified ever reaches the disk. The cache holds
+them until it reaches its memory cap or is flushed explicitly. A flush writes the pieces in ascending order. Pieces
+with consecutive indexes are contiguous in the payload, so each run of them (up to max_batch bytes) is written with a
+single BTFileCollection.write_buffers call. The disk therefore sees a few large sequential writes instead of one
+small write per piece, in arrival order.
+"""
+
+import hashlib
+import threading
+
+# Default memory cap of the cache and size of the largest single write.
+DEFAULT_MEMORY_CAP = 64 * 1024 * 1024
+DEFAULT_MAX_BATCH = 4 * 1024 * 1024
+
+
+class WriteBackCache:
+    """
+    The WriteBackCache class buffers verified pieces before writing them to a BTFileCollection:
+    - bt_file_collection: Where the pieces are written.
+    - piece_hashes: The PieceHashTable pieces are checked against (and marked verified in).
+    - output_directory: The directory holding the payload files.
+    - memory_cap: The number of buffered bytes at which the cache is full and should be flushed.
+    - max_batch: The largest number of bytes written in one call.
+
+    add() and flush() may run at the same time in different threads.
+    """
+    def __init__(self, bt_file_collection, piece_hashes, output_directory, memory_cap=DEFAULT_MEMORY_CAP,
+                 max_batch=DEFAULT_MAX_BATCH):
+        self.bt_file_collection = bt_file_collection
+        self.piece_hashes = piece_hashes
+        self.output_directory = output_directory
+        self.memory_cap = memory_cap
+        self.max_batch = max_batch
+        self.cached_bytes = 0
+        self._pieces = {}  # piece index -> data
+        self._flushing = {}  # pieces being written by flush(), still readable until they are on disk
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pieces)
+
+    def __contains__(self, index):
+        return index in self._pieces
+
+    # Checks a complete piece against its hash and caches it if good. Returns whether it was good.
+    def add(self, index, data):
+        if len(data) != self.piece_hashes.piece_size(index):
+            self.piece_hashes.set_verified(index, False)
+            return False
+        if not self.piece_hashes.verify(index, hashlib.sha1(data).digest()):
+            return False
+        with self._lock:
+            previous = self._pieces.get(index)
+            self.cached_bytes += len(data) - (len(previous) if previous is not None else 0)
+            self._pieces[index] = data
+        return True
+
+    # Returns length bytes at begin of a cached piece, or None if the piece is not in the cache (anymore).
+    def read(self, index, begin, length):
+        with self._lock:
+            data = self._pieces.get(index)
+            if data is None:
+                data = self._flushing.get(index)
+            return None if data is None else bytes(data[begin:begin + length])
+
+    def is_full(self):
+        return self.cached_bytes >= self.memory_cap
+
+    # Writes every cached piece, in ascending order, and empties the cache.
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pieces = self._flushing = self._pieces
+                self._pieces = {}
+            try:
+                for start, indexes in self._batches(pieces):
+                    buffers = [pieces[index] for index in indexes]
+                    self.bt_file_collection.write_buffers(start, buffers, self.output_directory)
+                    with self._lock:
+                        for index in indexes:
+                            del pieces[index]
+                        self.cached_bytes -= sum(len(buffer) for buffer in buffers)
+            finally:
+                # Keep what was not written so a later flush can retry it
+                with self._lock:
+                    self._flushing = {}
+                    for index, data in pieces.items():
+                        if index in self._pieces:
+                            self.cached_bytes -= len(data)  # Replaced by a newer copy meanwhile
+                        else:
+                            self._pieces[index] = data
+
+    # Groups the pieces into runs of consecutive indexes of at most max_batch bytes: (start offset, [index, ...])
+    def _batches(self, pieces):
+        batch = []
+        batch_bytes = 0
+        for index in sorted(pieces):
+            size = len(pieces[index])
+            if batch and (index != batch[-1] + 1 or batch_bytes + size > self.max_batch):
+                yield self.piece_hashes.piece_range(batch[0])[0], batch
+                batch = []
+                batch_bytes = 0
+            batch.append(index)
+            batch_bytes += size
+        if batch:
+            yield self.piece_hashes.piece_range(batch[0])[0], batch
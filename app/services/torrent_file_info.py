@@ -21,34 +21,158 @@ Website: https://sperea.es
 Please give credit to the author and the website when using or redistributing this code.
 """
 
-import unittest
+"""
+Torrent info rendering
+----------------------
+
+TorrentInfo renders the description of a parsed torrent - trackers, info-hashes, creator fields and the file list - in
+one of three formats:
+
+- text: the human readable report, one line per file;
+- json: a single JSON document with the torrent fields and a "files" array;
+- ndjson: one JSON object per line, first {"type": "torrent", ...} and then one {"type": "file", ...} per file, for
+  tools that process the listing as a stream.
+
+The output is produced by a generator, piece by piece, and write() sends it to a file as it is produced. Nothing is
+accumulated, so the first lines of a torrent with hundreds of thousands of files come out at once, memory stays flat
+and the time is linear in the number of files. The file list can be filtered with a glob pattern on the paths and
+cut after `limit` files; the number of matching files left out is reported at the end.
+"""
+
+import fnmatch
+import json
+
+FORMATS = ("text", "json", "ndjson")
+
+# One shared encoder: json.dumps sets one up on every call, which shows with hundreds of thousands of files.
+_encode = json.JSONEncoder().encode
+
+
+# Byte string fields (comment, created by...) are shown as text.
+def _display(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).decode("utf-8", "replace")
+    return value
+
+
+def _json_value(value):
+    value = _display(value)
+    return value if value is None or isinstance(value, (int, float, str)) else str(value)
+
 
 class TorrentInfo:
-    def __init__(self, torrent_file):
+    """
+    The TorrentInfo class renders a MetaInfo:
+    - torrent_file: The MetaInfo to describe.
+    - format: One of text, json and ndjson.
+    - limit: The largest number of files to list, or None for all of them.
+    - pattern: A glob pattern (e.g. "*.iso") the listed file paths must match, or None.
+    """
+    def __init__(self, torrent_file, format="text", limit=None, pattern=None):
+        if format not in FORMATS:
+            raise ValueError(f"Invalid format {format!r}, expected one of {', '.join(FORMATS)}")
         self.torrent_file = torrent_file
-        self.info = ""
-        self.info += "=== TORRENT INFO ===\n"
-        self.info += f"Announce: {self.torrent_file.announce}\n"
-        if self.torrent_file.announce_list:
-            self.info += "Announce list:\n"
-            for tracker in self.torrent_file.announce_list:
-                self.info += f"  - {tracker.url}\n"
-        if self.torrent_file.comment:
-            self.info += f"Comment: {self.torrent_file.comment}\n"
-        if self.torrent_file.created_by:
-            self.info += f"Created by: {self.torrent_file.created_by}\n"
-        if self.torrent_file.creation_date:
-            self.info += f"Creation date: {self.torrent_file.creation_date}\n"
-        if self.torrent_file.encoding:
-            self.info += f"Encoding: {self.torrent_file.encoding}\n"
-        self.info += "=== FILE INFO ===\n"
+        self.format = format
+        self.limit = limit
+        self.pattern = pattern
+
+    # The torrent fields, in display order, without the file list.
+    def fields(self):
+        torrent = self.torrent_file
+        fields = {"announce": str(torrent.announce) if torrent.announce is not None else None}
+        if torrent.info_hash:
+            fields["info_hash"] = torrent.info_hash.hex()
+        if torrent.info_hash_v2:
+            fields["info_hash_v2"] = torrent.info_hash_v2.hex()
+        if torrent.announce_list:
+            fields["announce_list"] = [str(tracker) for tracker in torrent.announce_list]
+        for name in ("comment", "created_by", "creation_date", "encoding"):
+            value = getattr(torrent, name)
+            if value:
+                fields[name] = _display(value)
+        return fields
+
+    # Yields the (path, length) of the listed files, then once None and the number of matching files left out.
+    def _files(self):
+        torrent = self.torrent_file
+        if torrent.files:
+            files = ((file.path, file.length) for file in torrent.files)
+        else:
+            files = iter([(torrent.info.name, torrent.info.length)])
+        if self.pattern is not None:
+            files = (file for file in files if fnmatch.fnmatchcase(str(file[0]), self.pattern))
+        listed = 0
+        for file in files:
+            if self.limit is not None and listed >= self.limit:
+                yield None, 1 + sum(1 for _ in files)
+                return
+            listed += 1
+            yield file
+
+    # Yields the rendered output in pieces (whole lines for text and ndjson).
+    def chunks(self):
+        if self.format == "text":
+            return self._text()
+        if self.format == "json":
+            return self._json()
+        return self._ndjson()
+
+    def _text(self):
+        labels = {"announce": "Announce", "info_hash": "Info hash", "info_hash_v2": "Info hash v2",
+                  "comment": "Comment", "created_by": "Created by", "creation_date": "Creation date",
+                  "encoding": "Encoding"}
+        yield "=== TORRENT INFO ===\n"
+        for name, value in self.fields().items():
+            if name == "announce_list":
+                yield "Announce list:\n"
+                for tracker in value:
+                    yield f"  - {tracker}\n"
+            else:
+                yield f"{labels[name]}: {value}\n"
+        yield "=== FILE INFO ===\n"
         if self.torrent_file.files:
-            self.info += f"Files:\n"
-            for file in self.torrent_file.files:
-                self.info += f" ---> {file.path} ({file.length} bytes)\n"
+            yield "Files:\n"
+            line = " ---> {} ({} bytes)\n"
         else:
-            self.info += f"{self.torrent_file.info.name} ({self.torrent_file.info.length} bytes)\n"
-        self.info += "=== END TORRENT INFO ===\n"
+            line = "{} ({} bytes)\n"
+        for path, length in self._files():
+            if path is None:
+                yield f" ... {length} more files\n"
+            else:
+                yield line.format(path, length)
+        yield "=== END TORRENT INFO ===\n"
+
+    def _json(self):
+        fields = self.fields()
+        yield json.dumps({name: _json_value(value) if name != "announce_list" else value
+                          for name, value in fields.items()})[:-1]
+        yield (", " if fields else "") + '"files": ['
+        separator = ""
+        more = 0
+        for path, length in self._files():
+            if path is None:
+                more = length
+            else:
+                yield f'{separator}{{"path": {_encode(str(path))}, "length": {length:d}}}'
+                separator = ", "
+        yield "]"
+        if more:
+            yield f', "more_files": {more}'
+        yield "}\n"
+
+    def _ndjson(self):
+        fields = self.fields()
+        yield json.dumps(dict(type="torrent", **{name: _json_value(value) if name != "announce_list" else value
+                                                  for name, value in fields.items()})) + "\n"
+        for path, length in self._files():
+            if path is None:
+                yield json.dumps({"type": "more_files", "count": length}) + "\n"
+            else:
+                yield f'{{"type": "file", "path": {_encode(str(path))}, "length": {length:d}}}\n'
+
+    # Writes the rendering to output (e.g. sys.stdout) as it is produced.
+    def write(self, output):
+        output.writelines(self.chunks())
 
     def __str__(self):
-        return self.info
\ No newline at end of file
+        return "".join(self.chunks())
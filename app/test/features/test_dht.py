@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+from app.features.dht import DHTError, DHTNode, decode_nodes, encode_nodes
+from app.repositories.routing_table import Node
+
+
+class TestCompactNodes(unittest.TestCase):
+
+    def test_round_trip(self):
+        nodes = [(os.urandom(20), ("127.0.0.1", 6881)), (os.urandom(20), ("::1", 6882))]
+        nodes4, nodes6 = encode_nodes([Node(int.from_bytes(node_id, "big"), address, 0) for node_id, address in nodes])
+        self.assertEqual((len(nodes4), len(nodes6)), (26, 38))
+        self.assertEqual(decode_nodes(nodes4) + decode_nodes(nodes6, 16), nodes)
+        # Trailing bytes and port 0 entries are ignored
+        self.assertEqual(decode_nodes(nodes4 + b"\x00"), nodes[:1])
+        self.assertEqual(decode_nodes(nodes4[:24] + b"\x00\x00"), [])
+
+
+class TestDHTCluster(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.nodes = [await self.start_node() for _ in range(20)]
+        for node in self.nodes[1:]:
+            await node.bootstrap([self.nodes[0].address])
+
+    async def asyncTearDown(self):
+        for node in self.nodes:
+            await node.close()
+        shutil.rmtree(self.directory)
+
+    async def start_node(self, node=None):
+        node = node or DHTNode(timeout=0.5, bootstrap_nodes=[])
+        await node.start("127.0.0.1", 0)
+        return node
+
+    async def test_bootstrap_fills_routing_tables(self):
+        for node in self.nodes:
+            self.assertGreaterEqual(len(node.routing_table), node.k)
+
+    async def test_announce_and_get_peers(self):
+        info_hash = os.urandom(20)
+        self.assertEqual(await self.nodes[3].announce_peer(info_hash, 51413), [])
+        await self.nodes[5].announce_peer(info_hash)
+        peers = await self.nodes[17].get_peers(info_hash)
+        self.assertEqual(set(peers), {("127.0.0.1", 51413), ("127.0.0.1", self.nodes[5].port)})
+        self.assertEqual(await self.nodes[17].get_peers(os.urandom(20)), [])
+
+    async def test_find_node_returns_closest_nodes(self):
+        target = self.nodes[11].node_id
+        found = await self.nodes[2].find_node(target)
+        self.assertEqual(found[0], (target, self.nodes[11].address))
+        self.assertEqual(len(found), self.nodes[2].k)
+
+    async def test_announce_needs_a_valid_token(self):
+        info_hash = os.urandom(20)
+        with self.assertRaises(DHTError):
+            await self.nodes[1].query(self.nodes[0].address, "announce_peer",
+                                      {"info_hash": info_hash, "port": 6881, "token": b"forged"})
+        response = await self.nodes[1].query(self.nodes[0].address, "get_peers", {"info_hash": info_hash})
+        await self.nodes[1].query(self.nodes[0].address, "announce_peer",
+                                  {"info_hash": info_hash, "port": 6881, "token": response["token"]})
+        response = await self.nodes[1].query(self.nodes[0].address, "get_peers", {"info_hash": info_hash})
+        self.assertEqual(response["values"], [bytes([127, 0, 0, 1]) + (6881).to_bytes(2, "big")])
+
+    async def test_unknown_method(self):
+        with self.assertRaises(DHTError):
+            await self.nodes[1].query(self.nodes[0].address, "vote", {})
+
+    async def test_query_timeout_marks_node_failed(self):
+        node_id, address = self.nodes[4].node_id, self.nodes[4].address
+        await self.nodes[4].close()
+        self.nodes.remove(self.nodes[4])
+        self.assertIsNotNone(self.nodes[0].routing_table.get(node_id))
+        with self.assertRaises(DHTError):
+            await self.nodes[0].query(address, "ping", {}, node_id)
+        self.assertEqual(self.nodes[0].routing_table.get(node_id).failures, 1)
+
+    async def test_warm_restart(self):
+        state_path = os.path.join(self.directory, ".dht")
+        node = await self.start_node(DHTNode(timeout=0.5, bootstrap_nodes=[], state_path=state_path))
+        await node.bootstrap([self.nodes[0].address])
+        known = {entry.node_id for entry in node.routing_table}
+        await node.close()
+
+        restarted = await self.start_node(DHTNode.load(state_path, timeout=0.5, bootstrap_nodes=[]))
+        self.nodes.append(restarted)
+        self.assertEqual(restarted.node_id, node.node_id)
+        self.assertEqual({entry.node_id for entry in restarted.routing_table}, known)
+        info_hash = os.urandom(20)
+        await self.nodes[8].announce_peer(info_hash, 6881)
+        self.assertEqual(await restarted.get_peers(info_hash), [("127.0.0.1", 6881)])
+
+    def test_load_without_state(self):
+        node = DHTNode.load(os.path.join(self.directory, "missing"), bootstrap_nodes=[])
+        self.assertEqual((len(node.node_id), len(node.routing_table)), (20, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
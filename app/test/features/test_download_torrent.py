@@ -0,0 +1,191 @@
+import asyncio
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from app.features.download_torrent import DownloadTorrentUseCase, DownloadError
+from app.features.seed_torrent import SeedTorrentUseCase
+from app.repositories.file_priorities import FilePriorities, PRIORITY_SKIP
+from app.repositories.meta_info import MetaInfo, TorrentInfo, TorrentFile
+from app.repositories.piece_hash_table import PieceHashTable
+
+
+class TestDownloadTorrent(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.seed_dir = tempfile.mkdtemp()
+        self.download_dir = self.root_dir = tempfile.mkdtemp()
+        self.piece_length = 32 * 1024
+        self.contents = {"a.bin": os.urandom(70000), "dir/b.bin": os.urandom(100000), "c.bin": os.urandom(5)}
+        for path, data in self.contents.items():
+            os.makedirs(os.path.dirname(os.path.join(self.seed_dir, path)), exist_ok=True)
+            with open(os.path.join(self.seed_dir, path), "wb") as f:
+                f.write(data)
+        payload = b"".join(self.contents.values())
+        self.pieces = b"".join(hashlib.sha1(payload[i:i + self.piece_length]).digest()
+                               for i in range(0, len(payload), self.piece_length))
+        self.total_length = len(payload)
+        self.seeders = []
+
+    async def asyncTearDown(self):
+        for seeder in self.seeders:
+            await seeder.close()
+        shutil.rmtree(self.seed_dir)
+        shutil.rmtree(self.root_dir)
+
+    def meta_info(self):
+        files = [TorrentFile(path, len(data)) for path, data in self.contents.items()]
+        return MetaInfo("http://tracker", TorrentInfo("test", self.piece_length, self.pieces, files=files),
+                        files=files, info_hash=b"\x02" * 20)
+
+    async def start_seeder(self, pieces=None, directory=None, seeder_class=SeedTorrentUseCase):
+        table = PieceHashTable(self.pieces, self.piece_length, self.total_length)
+        for index in range(len(table)) if pieces is None else pieces:
+            table.set_verified(index)
+        seeder = seeder_class(self.meta_info(), directory or self.seed_dir, piece_hashes=table)
+        await seeder.start("127.0.0.1", 0)
+        self.seeders.append(seeder)
+        return ("127.0.0.1", seeder.port)
+
+    def assert_downloaded(self):
+        for path, data in self.contents.items():
+            with open(os.path.join(self.download_dir, path), "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    async def test_download_from_one_seeder(self):
+        peer = await self.start_seeder()
+        use_case = DownloadTorrentUseCase(self.meta_info(), self.download_dir, [peer], pipeline_depth=4, timeout=5)
+        piece_hashes = await use_case.download_async()
+        self.assertTrue(piece_hashes.is_complete())
+        self.assert_downloaded()
+
+    async def test_small_write_back_cache_is_flushed_while_downloading(self):
+        peer = await self.start_seeder()
+        use_case = DownloadTorrentUseCase(self.meta_info(), self.download_dir, [peer], timeout=5,
+                                          cache_size=self.piece_length)
+        flushes = []
+        flush = use_case.cache.flush
+        use_case.cache.flush = lambda: flushes.append(len(use_case.cache)) or flush()
+        await use_case.download_async()
+        self.assertGreater(len(flushes), 1)
+        self.assertEqual(len(use_case.cache), 0)
+        self.assert_downloaded()
+
+    async def test_pieces_are_checked_off_the_event_loop(self):
+        peer = await self.start_seeder()
+        use_case = DownloadTorrentUseCase(self.meta_info(), self.download_dir, [peer], timeout=5)
+        threads = []
+        add = use_case.cache.add
+        use_case.cache.add = lambda *args: threads.append(threading.current_thread()) or add(*args)
+        await use_case.download_async()
+        self.assert_downloaded()
+        self.assertEqual(len(threads), len(self.pieces) // 20)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    async def test_disk_errors_stop_the_download_without_blaming_peers(self):
+        peers = [await self.start_seeder(), await self.start_seeder()]
+        use_case = DownloadTorrentUseCase(self.meta_info(), self.download_dir, peers, timeout=5,
+                                          cache_size=self.piece_length)
+        writes = []
+
+        def write_buffers(*args):
+            writes.append(args)
+            raise OSError(errno.ENOSPC, "No space left on device")
+        use_case.bt_files.write_buffers = write_buffers
+        with self.assertRaisesRegex(DownloadError, "No space left") as raised:
+            await use_case.download_async()
+        self.assertIsInstance(raised.exception.__cause__, OSError)
+        self.assertGreaterEqual(len(use_case.cache), 1)  # Kept for a later retry
+        # The first failed flushes stopped everything (one per peer at most); then only the final flush tried again
+        self.assertLessEqual(len(writes), len(peers) + 1)
+
+    async def test_download_from_a_seeder_reading_memory_maps(self):
+        peer = await self.start_seeder(seeder_class=lambda *args, **kwargs: SeedTorrentUseCase(
+            *args, use_mmap=True, **kwargs))
+        await DownloadTorrentUseCase(self.meta_info(), self.download_dir, [peer], timeout=5).download_async()
+        self.assert_downloaded()
+        self.assertGreater(len(self.seeders[0].bt_files.maps), 0)
+
+    async def test_download_from_partial_seeders(self):
+        peers = [await self.start_seeder([0, 2, 4]), await self.start_seeder([1, 3, 5]), await self.start_seeder()]
+        use_case = DownloadTorrentUseCase(self.meta_info(), self.download_dir, peers[:2], timeout=5)
+        await use_case.download_async()
+        self.assert_downloaded()
+
+    async def test_corrupt_pieces_are_downloaded_again(self):
+        bad_dir = os.path.join(self.download_dir, "bad")
+        shutil.copytree(self.seed_dir, bad_dir)
+        with open(os.path.join(bad_dir, "c.bin"), "wb") as f:
+            f.write(b"xxxxx")
+        peers = [await self.start_seeder(directory=bad_dir), await self.start_seeder()]
+        output_directory = os.path.join(self.download_dir, "out")
+        use_case = DownloadTorrentUseCase(self.meta_info(), output_directory, peers, timeout=5)
+        await use_case.download_async()
+        self.download_dir = output_directory
+        self.assert_downloaded()
+
+    async def test_endgame_does_not_wait_for_stalled_peers(self):
+        class StalledSeeder(SeedTorrentUseCase):
+            async def read_block(self, index, begin, length):
+                await asyncio.sleep(3600)
+
+        peers = [await self.start_seeder(seeder_class=StalledSeeder), await self.start_seeder()]
+        use_case = DownloadTorrentUseCase(self.meta_info(), self.download_dir, peers, timeout=60)
+        await asyncio.wait_for(use_case.download_async(), 10)
+        self.assert_downloaded()
+        self.assertEqual(use_case.requesters, {})
+
+    async def test_download_selected_files(self):
+        peer = await self.start_seeder()
+        meta_info = self.meta_info()
+        priorities = FilePriorities.from_meta_info(meta_info).select(["*.bin"], ["c.bin"])
+        priorities.set(1, PRIORITY_SKIP)
+        use_case = DownloadTorrentUseCase(meta_info, self.download_dir, [peer], timeout=5, file_priorities=priorities)
+        piece_hashes = await use_case.download_async()
+        # dir/b.bin only shares pieces 2 and 5 with a.bin and c.bin
+        self.assertEqual([piece_hashes.is_verified(i) for i in range(len(piece_hashes))],
+                         [True, True, True, False, False, True])
+        for path in ("a.bin", "c.bin"):
+            with open(os.path.join(self.download_dir, path), "rb") as f:
+                self.assertEqual(f.read(), self.contents[path])
+        with open(os.path.join(self.download_dir, "dir/b.bin"), "rb") as f:
+            partial = f.read()
+        # Its parts of pieces 2 and 5 are stored, the rest is a hole
+        head, tail = 3 * self.piece_length - 70000, 5 * self.piece_length - 70000
+        self.assertEqual(partial[:head], self.contents["dir/b.bin"][:head])
+        self.assertEqual(partial[head:tail], bytes(tail - head))
+        self.assertEqual(partial[tail:], self.contents["dir/b.bin"][tail:])
+
+    async def test_seeder_missing_its_files_closes_the_connection(self):
+        class RecordingSeeder(SeedTorrentUseCase):
+            async def accept(self, connection, handshake_read=False):
+                try:
+                    await super().accept(connection, handshake_read)
+                except BaseException as error:
+                    self.error = error
+                    raise
+                self.closed = connection.writer.is_closing()
+
+        empty_dir = tempfile.mkdtemp(dir=self.root_dir)
+        peer = await self.start_seeder(directory=empty_dir, seeder_class=RecordingSeeder)
+        use_case = DownloadTorrentUseCase(self.meta_info(), self.download_dir, [peer], timeout=5)
+        with self.assertRaises(DownloadError):
+            await use_case.download_async()
+        self.assertFalse(hasattr(self.seeders[0], "error"))
+        self.assertTrue(self.seeders[0].closed)
+
+    async def test_no_reachable_peers(self):
+        use_case = DownloadTorrentUseCase(self.meta_info(), self.download_dir, [("127.0.0.1", 1)], timeout=5)
+        with self.assertRaises(DownloadError):
+            await use_case.download_async()
+
+    async def test_seeder_rejects_other_torrents(self):
+        peer = await self.start_seeder()
+        meta_info = self.meta_info()
+        meta_info.info_hash = b"\x03" * 20
+        use_case = DownloadTorrentUseCase(meta_info, self.download_dir, [peer], timeout=5)
+        with self.assertRaises(DownloadError):
+            await use_case.download_async()
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from app.features.fast_recheck import FastRecheck, resume_path
+from app.repositories.meta_info import MetaInfo, TorrentInfo, TorrentFile
+
+
+class TestFastRecheck(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.piece_length = 1024
+        self.contents = {"a": os.urandom(1500), "b": os.urandom(2000), "c": os.urandom(700)}
+        payload = b"".join(self.contents.values())
+        for path, data in self.contents.items():
+            with open(os.path.join(self.test_dir, path), "wb") as f:
+                f.write(data)
+        pieces = b"".join(hashlib.sha1(payload[i:i + self.piece_length]).digest()
+                          for i in range(0, len(payload), self.piece_length))
+        files = [TorrentFile(path, len(data)) for path, data in self.contents.items()]
+        self.info = TorrentInfo("test", self.piece_length, pieces, files=files)
+        self.meta_info = MetaInfo("http://tracker", self.info, files=files, info_hash=b"\x01" * 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def recheck(self):
+        return FastRecheck(self.meta_info, self.test_dir, workers=2).execute()
+
+    def test_first_run_hashes_everything_and_saves(self):
+        piece_hashes, rehashed = self.recheck()
+        self.assertEqual(rehashed, 5)
+        self.assertTrue(piece_hashes.is_complete())
+        self.assertTrue(os.path.exists(resume_path(self.test_dir, b"\x01" * 20)))
+
+    def test_second_run_hashes_nothing(self):
+        self.recheck()
+        piece_hashes, rehashed = self.recheck()
+        self.assertEqual(rehashed, 0)
+        self.assertTrue(piece_hashes.is_complete())
+
+    def test_only_pieces_of_changed_files_are_rehashed(self):
+        self.recheck()
+        path = os.path.join(self.test_dir, "c")
+        with open(path, "r+b") as f:
+            f.write(b"corrupt")
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+        with mock.patch("hashlib.sha1", wraps=hashlib.sha1) as sha1:
+            piece_hashes, rehashed = self.recheck()
+        # 'c' covers bytes 3500-4199: pieces 3 and 4
+        self.assertEqual(rehashed, 2)
+        self.assertEqual(sha1.call_count, 2)
+        self.assertEqual([piece_hashes.is_verified(i) for i in range(5)], [True, True, True, False, True])
+
+    def test_missing_files_are_not_verified(self):
+        self.recheck()
+        os.remove(os.path.join(self.test_dir, "a"))
+        piece_hashes, rehashed = self.recheck()
+        self.assertEqual(rehashed, 0)
+        self.assertEqual([piece_hashes.is_verified(i) for i in range(5)], [False, False, True, True, True])
+
+    def test_invalid_resume_file_is_ignored(self):
+        self.recheck()
+        with open(resume_path(self.test_dir, b"\x01" * 20), "w") as f:
+            f.write("not json")
+        _, rehashed = self.recheck()
+        self.assertEqual(rehashed, 5)
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from app.features.dht import DHTNode
+from app.features.fetch_metadata import (FetchMetadataUseCase, MetadataAssembler, MetadataError, METADATA_PIECE_SIZE,
+                                         METADATA_DATA, decode_metadata_message, encode_metadata_message)
+from app.features.metainfo_cache import MetaInfoCache
+from app.features.parse_torrent_file import BencodeEncoder, ParseTorrentFile
+from app.features.seed_torrent import SeedTorrentUseCase
+from app.repositories.magnet_link import MagnetLink
+
+
+def make_torrent(file_count=1500):
+    # About 50 KiB of metadata: four ut_metadata pieces
+    info = {"name": "dataset", "piece length": 16384, "pieces": os.urandom(20 * 300),
+            "files": [{"length": 10 + index, "path": ["part", f"file-{index:05d}.bin"]} for index in range(file_count)]}
+    return BencodeEncoder().encode({"announce": "http://tracker/announce", "info": info})
+
+
+class CountingSeeder(SeedTorrentUseCase):
+    async def _on_extended(self, connection, remote_ids, extended_id, payload):
+        self.extended = getattr(self, "extended", 0) + 1
+        await super()._on_extended(connection, remote_ids, extended_id, payload)
+
+
+class TestFetchMetadata(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.meta_info = ParseTorrentFile("test").parse_bytes(make_torrent())
+        self.seeders = []
+
+    async def asyncTearDown(self):
+        for seeder in self.seeders:
+            await seeder.close()
+        shutil.rmtree(self.directory)
+
+    async def start_seeder(self, seeder_class=CountingSeeder, **kwargs):
+        seeder = seeder_class(self.meta_info, self.directory, **kwargs)
+        await seeder.start("127.0.0.1", 0)
+        self.seeders.append(seeder)
+        return "127.0.0.1", seeder.port
+
+    def magnet(self, peers):
+        return MagnetLink(self.meta_info.info_hash, "dataset", peers=peers)
+
+    async def test_fetch_from_several_peers(self):
+        peers = [await self.start_seeder() for _ in range(3)]
+        use_case = FetchMetadataUseCase(self.magnet(peers), pipeline_depth=1, timeout=5)
+        meta_info = await use_case.execute_async()
+        self.assertEqual(meta_info.info_hash, self.meta_info.info_hash)
+        self.assertEqual(meta_info.info.name, "dataset")
+        self.assertEqual(len(meta_info.files), 1500)
+        self.assertEqual(meta_info.files[7].path, "part/file-00007.bin")
+        self.assertEqual(ParseTorrentFile("saved").parse_bytes(use_case.torrent_bytes).info_hash, meta_info.info_hash)
+        # The pieces were requested from more than one peer
+        self.assertGreater(sum(1 for seeder in self.seeders if getattr(seeder, "extended", 0) > 1), 1)
+
+    async def test_fetch_from_a_seeder_loaded_from_the_cache(self):
+        path = os.path.join(self.directory, "dataset.torrent")
+        with open(path, "wb") as f:
+            f.write(make_torrent(50))
+        cache = MetaInfoCache(os.path.join(self.directory, "cache"))
+        cache.load(path)
+        self.meta_info = cache.load(path)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(hashlib.sha1(self.meta_info.info_bytes).digest(), self.meta_info.info_hash)
+        peer = await self.start_seeder(SeedTorrentUseCase)
+        meta_info = await FetchMetadataUseCase(self.magnet([peer]), timeout=5).execute_async()
+        self.assertEqual(len(meta_info.files), 50)
+
+    async def test_fetch_from_peers_found_on_the_dht(self):
+        peer = await self.start_seeder()
+        nodes = []
+        try:
+            for _ in range(3):
+                node = DHTNode(timeout=0.5, bootstrap_nodes=[nodes[0].address] if nodes else [])
+                await node.start("127.0.0.1")
+                await node.bootstrap()
+                nodes.append(node)
+            await nodes[1].announce_peer(self.meta_info.info_hash, peer[1])
+            use_case = FetchMetadataUseCase(MagnetLink(self.meta_info.info_hash), timeout=5, dht=nodes[2])
+            meta_info = await use_case.execute_async()
+            self.assertEqual(meta_info.info_hash, self.meta_info.info_hash)
+            self.assertEqual(use_case.peers, [peer])
+        finally:
+            for node in nodes:
+                await node.close()
+
+    async def test_metadata_not_matching_the_info_hash(self):
+        bad = bytearray(self.meta_info.info_bytes)
+        bad[-2] ^= 1
+        peer = await self.start_seeder(metadata=bytes(bad))
+        with self.assertRaises(MetadataError):
+            await FetchMetadataUseCase(self.magnet([peer]), timeout=5).execute_async()
+
+    async def test_peers_reporting_a_wrong_size(self):
+        wrong = bytes(self.meta_info.info_bytes) + b"x" * 100
+        peers = [await self.start_seeder(metadata=wrong) for _ in range(2)] + [await self.start_seeder()]
+        use_case = FetchMetadataUseCase(self.magnet(peers), timeout=5)
+        meta_info = await use_case.execute_async()
+        self.assertEqual(meta_info.info_hash, self.meta_info.info_hash)
+        self.assertLessEqual(use_case.assembler.failures, 1)
+
+    async def test_peers_without_the_extension(self):
+        self.meta_info.info_bytes = None
+        peer = await self.start_seeder(SeedTorrentUseCase)
+        with self.assertRaises(MetadataError):
+            await FetchMetadataUseCase(self.magnet([peer, ("127.0.0.1", 1)]), timeout=5).execute_async()
+
+
+class TestMetadataAssembler(unittest.TestCase):
+
+    def test_pieces_and_endgame(self):
+        metadata = os.urandom(2 * METADATA_PIECE_SIZE + 100)
+        assembler = MetadataAssembler(hashlib.sha1(metadata).digest())
+        self.assertFalse(assembler.add_peer(0))
+        self.assertTrue(assembler.add_peer(len(metadata)))
+        self.assertTrue(assembler.add_peer(len(metadata) + 1))
+        self.assertEqual(assembler.size, len(metadata))
+        self.assertEqual([assembler.next_piece(), assembler.next_piece(), assembler.next_piece()], [0, 1, 2])
+        # Everything handed out: duplicate the missing pieces not requested from this peer
+        self.assertEqual(assembler.next_piece({0}), 1)
+        assembler.release(2)
+        self.assertEqual(assembler.next_piece(), 2)
+        self.assertFalse(assembler.add(0, metadata[:METADATA_PIECE_SIZE]))
+        self.assertFalse(assembler.add(2, metadata[2 * METADATA_PIECE_SIZE:]))
+        self.assertTrue(assembler.add(1, metadata[METADATA_PIECE_SIZE:2 * METADATA_PIECE_SIZE]))
+        self.assertEqual(assembler.data(), metadata)
+
+    def test_size_chosen_again_after_a_failed_check(self):
+        metadata = os.urandom(METADATA_PIECE_SIZE + 100)
+        assembler = MetadataAssembler(hashlib.sha1(metadata).digest())
+        # The first peer reports a wrong size, the two next ones the right one
+        for size in (len(metadata) + 1, len(metadata), len(metadata)):
+            self.assertTrue(assembler.add_peer(size))
+        self.assertEqual(assembler.size, len(metadata) + 1)
+        self.assertFalse(assembler.add(0, bytes(METADATA_PIECE_SIZE)))
+        self.assertFalse(assembler.add(1, bytes(101)))
+        self.assertEqual((assembler.size, assembler.failures), (len(metadata), 1))
+        self.assertFalse(assembler.add(0, metadata[:METADATA_PIECE_SIZE]))
+        assembler.remove_peer(len(metadata))
+        self.assertTrue(assembler.add(1, metadata[METADATA_PIECE_SIZE:]))
+        # The last peer with the size in use leaves: another size is used
+        assembler = MetadataAssembler(hashlib.sha1(metadata).digest())
+        assembler.add_peer(10)
+        assembler.add_peer(20)
+        assembler.remove_peer(10)
+        self.assertEqual(assembler.size, 20)
+        assembler.remove_peer(20)
+        self.assertIsNone(assembler.size)
+
+    def test_metadata_message(self):
+        message = encode_metadata_message(METADATA_DATA, 3, 70000, b"d1:ae" + b"x" * 10)
+        msg_type, piece, total_size, data = decode_metadata_message(message)
+        self.assertEqual((msg_type, piece, total_size, bytes(data)), (METADATA_DATA, 3, 70000, b"d1:ae" + b"x" * 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from app.features.index_torrents import IndexTorrentsUseCase, index_torrent, iter_torrent_paths
+
+
+def info_bytes(name):
+    return (b"d5:filesld6:lengthi100e4:pathl5:a.bineed6:lengthi50e4:pathl5:b.bineee4:name%d:%s"
+            b"12:piece lengthi16384e6:pieces20:%se" % (len(name), name.encode(), bytes(20)))
+
+
+def torrent_bytes(name):
+    return (b"d8:announce10:http://t/a13:announce-listll10:http://t/ael9:udp://u:1ee4:info"
+            + info_bytes(name) + b"e")
+
+
+class TestIndexTorrents(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+        layout = {"b.torrent": torrent_bytes("b"), "a/z.torrent": torrent_bytes("z"), "a/y/x.torrent": torrent_bytes("x"),
+                  "a/broken.torrent": b"d8:announce", "notes.txt": b"not a torrent"}
+        for path, data in layout.items():
+            os.makedirs(os.path.dirname(os.path.join(self.root, path)), exist_ok=True)
+            with open(os.path.join(self.root, path), "wb") as f:
+                f.write(data)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def relative(self, paths):
+        return [os.path.relpath(path, self.root) for path in paths]
+
+    def test_walks_torrent_files_in_order(self):
+        self.assertEqual(self.relative(iter_torrent_paths(self.root)),
+                         ["b.torrent", "a/broken.torrent", "a/z.torrent", "a/y/x.torrent"])
+
+    def test_index_record(self):
+        record = index_torrent(os.path.join(self.root, "b.torrent"))
+        self.assertEqual(record["name"], "b")
+        self.assertEqual(record["info_hash"], hashlib.sha1(info_bytes("b")).hexdigest())
+        self.assertEqual((record["total_size"], record["file_count"]), (150, 2))
+        self.assertEqual(record["trackers"], ["http://t/a", "udp://u:1"])
+
+    def test_errors_are_isolated(self):
+        record = index_torrent(os.path.join(self.root, "a/broken.torrent"))
+        self.assertIn("error", record)
+        self.assertEqual(index_torrent(os.path.join(self.root, "missing.torrent"))["error"].split(":")[0],
+                         "FileNotFoundError")
+
+    def check_output(self, workers):
+        output = io.StringIO()
+        counts = IndexTorrentsUseCase(self.root, output, workers=workers, chunk_size=1).execute()
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(counts, (3, 1))
+        self.assertEqual(self.relative(record["path"] for record in records),
+                         ["b.torrent", "a/broken.torrent", "a/z.torrent", "a/y/x.torrent"])
+        self.assertEqual([record.get("name") for record in records], ["b", None, "z", "x"])
+
+    def test_in_process(self):
+        self.check_output(workers=1)
+
+    def test_process_pool(self):
+        self.check_output(workers=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
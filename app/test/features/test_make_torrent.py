@@ -0,0 +1,93 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from app.features.make_torrent import MakeTorrentUseCase, auto_piece_length, walk_files
+from app.features.parse_torrent_file import ParseTorrentFile
+
+
+class TestMakeTorrent(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, "dataset")
+        self.contents = {"b.bin": os.urandom(70000), "a/x.bin": os.urandom(40000), "a/empty": b"", "c.bin": b"c"}
+        for path, data in self.contents.items():
+            os.makedirs(os.path.dirname(os.path.join(self.source, path)), exist_ok=True)
+            with open(os.path.join(self.source, path), "wb") as f:
+                f.write(data)
+        self.output = os.path.join(self.directory.name, "dataset.torrent")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def expected_pieces(self, payload, piece_length):
+        return b"".join(hashlib.sha1(payload[i:i + piece_length]).digest() for i in range(0, len(payload), piece_length))
+
+    def test_auto_piece_length(self):
+        self.assertEqual(auto_piece_length(1), 16 * 1024)
+        self.assertEqual(auto_piece_length(2000 * 16 * 1024), 16 * 1024)
+        self.assertEqual(auto_piece_length(2000 * 16 * 1024 + 1), 32 * 1024)
+        self.assertEqual(auto_piece_length(4 * 1024 ** 3), 4 * 1024 * 1024)
+        self.assertEqual(auto_piece_length(10 * 1024 ** 4), 16 * 1024 * 1024)
+
+    def test_walk_files_in_name_order(self):
+        self.assertEqual([path for path, _ in walk_files(self.source)],
+                         [os.path.join("a", "empty"), os.path.join("a", "x.bin"), "b.bin", "c.bin"])
+
+    def test_make_multi_file_torrent(self):
+        info_hash = MakeTorrentUseCase(self.source, self.output, trackers=[["http://t/a", "http://t/b"], "udp://u:1"],
+                                       piece_length=16384, comment="data", workers=2).execute()
+        meta_info = ParseTorrentFile(self.output).execute()
+        self.assertEqual(meta_info.info_hash, info_hash)
+        self.assertEqual(meta_info.info.name, "dataset")
+        self.assertEqual([(f.path, f.length) for f in meta_info.files],
+                         [("a/empty", 0), ("a/x.bin", 40000), ("b.bin", 70000), ("c.bin", 1)])
+        payload = self.contents["a/x.bin"] + self.contents["b.bin"] + self.contents["c.bin"]
+        self.assertEqual(bytes(meta_info.info.pieces), self.expected_pieces(payload, 16384))
+        self.assertEqual([[str(t) for t in tier] for tier in meta_info.tracker_tiers()],
+                         [["http://t/a", "http://t/b"], ["udp://u:1"]])
+        self.assertEqual(meta_info.comment, b"data")
+
+    def test_empty_tracker_tiers_are_left_out(self):
+        MakeTorrentUseCase(self.source, self.output, trackers=[[], ["http://t/a"], ()]).execute()
+        meta_info = ParseTorrentFile(self.output).execute()
+        self.assertEqual(str(meta_info.announce), "http://t/a")
+        self.assertEqual([[str(t) for t in tier] for tier in meta_info.tracker_tiers()], [["http://t/a"]])
+        MakeTorrentUseCase(self.source, self.output, trackers=[[]]).execute()
+        self.assertIsNone(ParseTorrentFile(self.output).execute().announce)
+
+    def test_hashing_from_memory_maps(self):
+        payload = self.contents["a/x.bin"] + self.contents["b.bin"] + self.contents["c.bin"]
+        for use_processes in (False, True):
+            MakeTorrentUseCase(self.source, self.output, piece_length=16384, workers=2, use_processes=use_processes,
+                               use_mmap=True).execute()
+            meta_info = ParseTorrentFile(self.output).execute()
+            self.assertEqual(bytes(meta_info.info.pieces), self.expected_pieces(payload, 16384))
+
+    def test_make_single_file_torrent_without_trackers(self):
+        source = os.path.join(self.source, "b.bin")
+        MakeTorrentUseCase(source, self.output).execute()
+        meta_info = ParseTorrentFile(self.output).execute()
+        self.assertIsNone(meta_info.announce)
+        self.assertEqual((meta_info.info.name, meta_info.info.length, meta_info.files), ("b.bin", 70000, None))
+        self.assertEqual(bytes(meta_info.info.pieces), self.expected_pieces(self.contents["b.bin"], 16384))
+
+    def test_streaming_reports_progress(self):
+        reports = []
+        MakeTorrentUseCase(self.source, self.output, piece_length=16384, memory_budget=16384,
+                           progress=lambda done, total: reports.append((done, total))).execute()
+        self.assertEqual(len(reports), 7)
+        self.assertEqual(reports[-1], (110001, 110001))
+        self.assertEqual(sorted(reports), reports)
+
+    def test_nothing_to_share(self):
+        empty = os.path.join(self.directory.name, "empty")
+        os.mkdir(empty)
+        with self.assertRaises(ValueError):
+            MakeTorrentUseCase(empty, self.output).execute()
+        self.assertFalse(os.path.exists(self.output))
+
+
+if __name__ == '__main__':
+    unittest.main()
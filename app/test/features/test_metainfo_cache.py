@@ -0,0 +1,120 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from app.features.metainfo_cache import MetaInfoCache, dump_meta_info, load_meta_info
+from app.features.parse_torrent_file import ParseTorrentFile
+
+
+def torrent_bytes(name, piece_count=3):
+    pieces = bytes(range(20)) * piece_count
+    info = (b"d5:filesld6:lengthi100e4:pathl3:dir5:a.bineed6:lengthi50e4:pathl5:b.bineee"
+            b"4:name%d:%s12:piece lengthi65536e6:pieces%d:%s7:privatei1ee"
+            % (len(name), name.encode(), len(pieces), pieces))
+    return (b"d8:announce14:http://t/annce13:announce-listll14:http://t/annce9:udp://u:1el11:http://t2/aee"
+            b"7:comment5:hello13:creation datei1700000000e4:info" + info + b"e")
+
+
+class TestMetaInfoCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.directory.name, "cache")
+        self.cache = MetaInfoCache(self.cache_dir)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_torrent(self, name, data=None):
+        path = os.path.join(self.directory.name, name + ".torrent")
+        with open(path, "wb") as f:
+            f.write(data or torrent_bytes(name))
+        return path
+
+    def assert_same(self, cached, parsed):
+        self.assertEqual(str(cached.announce), str(parsed.announce))
+        self.assertEqual([[str(t) for t in tier] for tier in cached.tracker_tiers()],
+                         [[str(t) for t in tier] for tier in parsed.tracker_tiers()])
+        self.assertEqual([str(t) for t in cached.announce_list], [str(t) for t in parsed.announce_list])
+        for field in ("comment", "created_by", "creation_date", "encoding", "info_hash", "info_hash_v2"):
+            self.assertEqual(getattr(cached, field), getattr(parsed, field), field)
+        for field in ("name", "piece_length", "length", "private"):
+            self.assertEqual(getattr(cached.info, field), getattr(parsed.info, field), field)
+        self.assertEqual(bytes(cached.info.pieces), bytes(parsed.info.pieces))
+        self.assertEqual([(f.path, f.length) for f in cached.files], [(f.path, f.length) for f in parsed.files])
+
+    def test_miss_then_hit(self):
+        path = self.write_torrent("one")
+        first = self.cache.load(path)
+        self.assert_same(first, ParseTorrentFile(path).execute())
+        with mock.patch.object(ParseTorrentFile, "execute", side_effect=AssertionError("decoded again")):
+            second = self.cache.load(path)
+        self.assert_same(second, first)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_keeps_the_info_dictionary(self):
+        path = self.write_torrent("one")
+        parsed = ParseTorrentFile(path).execute()
+        self.cache.load(path)
+        meta_info = MetaInfoCache(self.cache_dir).load(path)
+        self.assertEqual(bytes(meta_info.info_bytes), bytes(parsed.info_bytes))
+        self.assertEqual(bytes(meta_info.info.pieces), bytes(parsed.info.pieces))
+        parsed.info_bytes = None
+        self.assertIsNone(load_meta_info(dump_meta_info(parsed)).info_bytes)
+        self.assert_same(load_meta_info(dump_meta_info(parsed)), meta_info)
+
+    def test_hit_maps_pieces_lazily(self):
+        path = self.write_torrent("one")
+        self.cache.load(path)
+        meta_info = MetaInfoCache(self.cache_dir).load(path)
+        self.assertIsInstance(meta_info.info.pieces, memoryview)
+        self.assertEqual(bytes(meta_info.info.piece_hashes[2]), bytes(range(20)))
+        self.assertEqual(meta_info.create_btfile_collection().total_size(), 150)
+
+    def test_touched_file_is_found_by_content(self):
+        path = self.write_torrent("one")
+        self.cache.load(path)
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        with mock.patch.object(ParseTorrentFile, "execute", side_effect=AssertionError("decoded again")):
+            self.cache.load(path)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_changed_file_is_parsed_again(self):
+        path = self.write_torrent("one")
+        self.cache.load(path)
+        self.write_torrent("one", torrent_bytes("one", piece_count=5))
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        self.assertEqual(len(self.cache.load(path).info.piece_hashes), 5)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_corrupt_entry_is_parsed_again(self):
+        path = self.write_torrent("one")
+        self.cache.load(path)
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".meta"):
+                with open(os.path.join(self.cache_dir, name), "wb") as f:
+                    f.write(b"BTMC garbage")
+        self.assertEqual(self.cache.load(path).info.name, "one")
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        paths = [self.write_torrent(name) for name in ("one", "two", "six")]
+        self.cache.load(paths[0])
+        entry_size = self.cache.size()
+        self.cache.max_size = entry_size * 2
+        self.cache.load(paths[1])
+        time.sleep(0.01)
+        self.cache.load(paths[0])  # Refreshes "one"
+        time.sleep(0.01)
+        self.cache.load(paths[2])  # Evicts "two" (entries of the same size)
+        self.assertLessEqual(self.cache.size(), self.cache.max_size)
+        with mock.patch.object(ParseTorrentFile, "execute", side_effect=AssertionError("decoded again")):
+            self.cache.load(paths[0])
+            self.cache.load(paths[2])
+        self.cache.load(paths[1])
+        self.assertEqual(self.cache.misses, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
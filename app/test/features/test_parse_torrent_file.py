@@ -1,6 +1,10 @@
+import hashlib
+import io
 import unittest
 import os
-from app.features.parse_torrent_file import BencodeDecoder, ParseTorrentFile
+import tempfile
+from unittest import mock
+from app.features.parse_torrent_file import BencodeDecoder, BencodeDecodeError, BencodeEncoder, LazyBencodeDecoder, LazyBencodeDict, LazyBencodeList, ParseTorrentFile
 
 
 class TestBencodeDecoder(unittest.TestCase):
@@ -32,6 +36,182 @@ class TestBencodeDecoder(unittest.TestCase):
         result = decoder.decode()
         self.assertEqual(result, {"key": b"value"})
 
+    def test_decode_integer(self):
+        self.assertEqual(BencodeDecoder(b"i0e").decode(), 0)
+        self.assertEqual(BencodeDecoder(b"i-42e").decode(), -42)
+        self.assertEqual(BencodeDecoder(b"i12345678901234567890e").decode(), 12345678901234567890)
+
+    def test_decode_rejects_non_canonical_integers(self):
+        for data in (b"i-0e", b"i03e", b"ie", b"i+3e", b"i 3e", b"i1_0e", b"i3"):
+            with self.assertRaises(BencodeDecodeError, msg=data):
+                BencodeDecoder(data).decode()
+
+    def test_decode_rejects_invalid_strings(self):
+        for data in (b"05:hello", b"5:hell", b"-1:a", b"5hello", b""):
+            with self.assertRaises(BencodeDecodeError, msg=data):
+                BencodeDecoder(data).decode()
+
+    def test_decode_rejects_unsorted_or_duplicate_keys(self):
+        with self.assertRaises(BencodeDecodeError):
+            BencodeDecoder(b"d1:bi1e1:ai2ee").decode()
+        with self.assertRaises(BencodeDecodeError):
+            BencodeDecoder(b"d1:ai1e1:ai2ee").decode()
+        self.assertEqual(BencodeDecoder(b"d1:bi1e1:ai2ee", strict=False).decode(), {"b": 1, "a": 2})
+
+    def test_decode_rejects_unterminated_containers(self):
+        for data in (b"l5:hello", b"d3:key5:value"):
+            with self.assertRaises(BencodeDecodeError, msg=data):
+                BencodeDecoder(data).decode()
+
+    def test_decode_large_strings_as_views(self):
+        pieces = bytes(range(256)) * 8
+        data = b"d6:pieces" + str(len(pieces)).encode() + b":" + pieces + b"5:shorti1ee"
+        result = BencodeDecoder(data, view_threshold=1024).decode()
+        self.assertIsInstance(result["pieces"], memoryview)
+        self.assertEqual(result["pieces"], pieces)
+        self.assertIs(result["pieces"].obj, data)
+
+    def test_decode_small_strings_as_bytes(self):
+        result = BencodeDecoder(b"l5:helloe", view_threshold=1024).decode()
+        self.assertIsInstance(result[0], bytes)
+
+    def test_decode_accepts_memoryview_input(self):
+        result = BencodeDecoder(memoryview(b"l5:helloi42ee")).decode()
+        self.assertEqual(result, [b"hello", 42])
+
+TORRENT = (b"d8:announce19:http://tracker/path"
+           b"13:announce-listll8:http://ael8:http://bee"
+           b"4:infod5:filesld6:lengthi3e4:pathl1:aeed6:lengthi4e4:pathl1:bee"
+           b"e4:name4:test12:piece lengthi16384e6:pieces20:" + b"x" * 20 + b"ee")
+
+
+class TestLazyBencodeDecoder(unittest.TestCase):
+
+    def setUp(self):
+        self.root = LazyBencodeDecoder(TORRENT).decode()
+
+    def test_returns_proxies_for_containers(self):
+        self.assertIsInstance(self.root, LazyBencodeDict)
+        self.assertIsInstance(self.root["info"], LazyBencodeDict)
+        self.assertIsInstance(self.root["info"]["files"], LazyBencodeList)
+        self.assertEqual(self.root["announce"], b"http://tracker/path")
+        self.assertEqual(self.root["info"]["piece length"], 16384)
+
+    def test_scans_only_as_far_as_needed(self):
+        self.assertEqual(self.root["announce"], b"http://tracker/path")
+        self.assertEqual(list(self.root._spans), ["announce"])
+        self.assertNotIn("announce-aaa", self.root)
+        self.assertEqual(list(self.root._spans), ["announce", "announce-list"])
+
+    def test_missing_key(self):
+        with self.assertRaises(KeyError):
+            self.root["missing"]
+        self.assertIsNone(self.root.get("zzz"))
+
+    def test_list_access(self):
+        files = self.root["info"]["files"]
+        self.assertEqual(files[1]["length"], 4)
+        self.assertEqual(len(files), 2)
+        self.assertEqual(files[-1]["path"][0], b"b")
+        self.assertEqual([f["length"] for f in files], [3, 4])
+        with self.assertRaises(IndexError):
+            files[2]
+
+    def test_raw_span(self):
+        start, end = self.root.span("info")
+        self.assertEqual(TORRENT[start:end], TORRENT[TORRENT.index(b"4:info") + 6:-1])
+        self.assertEqual(bytes(self.root.raw("info")), TORRENT[start:end])
+        self.assertEqual(self.root.span(), (0, len(TORRENT)))
+
+    def test_materialize(self):
+        self.assertEqual(self.root.materialize(), BencodeDecoder(TORRENT).decode())
+        self.assertEqual(dict(self.root["info"].items())["name"], b"test")
+        self.assertEqual(list(self.root.keys()), ["announce", "announce-list", "info"])
+
+    def test_scalar_root(self):
+        self.assertEqual(LazyBencodeDecoder(b"i7e").decode(), 7)
+
+    def test_strict_keys(self):
+        root = LazyBencodeDecoder(b"d1:bi1e1:ai2ee").decode()
+        with self.assertRaises(BencodeDecodeError):
+            root.keys()
+
+    def test_skipped_values_are_not_decoded(self):
+        # The invalid integer inside 'a' is never decoded, only skipped over.
+        root = LazyBencodeDecoder(b"d1:ali03ee1:bi1ee").decode()
+        self.assertEqual(root["b"], 1)
+        with self.assertRaises(BencodeDecodeError):
+            root["a"][0]
+
+    def test_unterminated(self):
+        with self.assertRaises(BencodeDecodeError):
+            LazyBencodeDecoder(b"d1:ai1e").decode().keys()
+
+
+class TestBencodeEncoder(unittest.TestCase):
+
+    def test_encode_types(self):
+        encoded = BencodeEncoder().encode({"spam": [b"a", "b", -3, (0,)], "cow": bytearray(b"moo"), "n": True})
+        self.assertEqual(encoded, b"d3:cow3:moo1:ni1e4:spaml1:a1:bi-3eli0eeee")
+
+    def test_keys_sorted_as_raw_bytes(self):
+        encoded = BencodeEncoder().encode({"\u00e9": 1, "z": 2, b"\xff": 3, "Z": 4})
+        self.assertEqual(encoded, b"d1:Zi4e1:zi2e2:\xc3\xa9i1e1:\xffi3ee")
+
+    def test_round_trip_is_byte_identical(self):
+        data = TORRENT.replace(b"x" * 20, os.urandom(20))
+        self.assertEqual(BencodeEncoder().encode(BencodeDecoder(data).decode()), data)
+        scrape = b"d5:filesd20:" + b"\xff" * 20 + b"d8:completei1eeee"
+        self.assertEqual(BencodeEncoder().encode(BencodeDecoder(scrape).decode()), scrape)
+
+    def test_lazy_values_are_copied_raw(self):
+        root = LazyBencodeDecoder(TORRENT).decode()
+        self.assertEqual(BencodeEncoder().encode({"announce": "x", "info": root["info"]}),
+                         b"d8:announce1:x4:info" + root.raw("info").tobytes() + b"e")
+
+    def test_streams_to_file_passing_large_values_through(self):
+        pieces = os.urandom(20 * 1000)
+        writes = []
+
+        class Sink(io.BytesIO):
+            def write(self, data):
+                writes.append(data)
+                return super().write(data)
+        sink = Sink()
+        value = {"info": {"name": "x" * 10, "pieces": pieces}, "list": list(range(2000))}
+        BencodeEncoder(sink, buffer_size=1024).encode(value)
+        self.assertEqual(sink.getvalue(), BencodeEncoder().encode(value))
+        self.assertTrue(any(isinstance(data, memoryview) and data.obj is pieces for data in writes))
+        self.assertLessEqual(max(len(data) for data in writes if not isinstance(data, memoryview)), 1024 + 16)
+
+    def test_streaming_writes_stay_bounded_without_strings(self):
+        writes = []
+
+        class Sink(io.BytesIO):
+            def write(self, data):
+                writes.append(len(data))
+                return super().write(data)
+        sink = Sink()
+        value = {"list": list(range(200000)), "nested": [[index, {"k": index}] for index in range(1000)]}
+        BencodeEncoder(sink, buffer_size=1024).encode(value)
+        self.assertEqual(sink.getvalue(), BencodeEncoder().encode(value))
+        self.assertGreater(len(writes), 1000)
+        self.assertLessEqual(max(writes), 1024 + 16)
+
+    def test_appends_to_bytearray(self):
+        output = bytearray(b"prefix")
+        self.assertIsNone(BencodeEncoder(output).encode([1, b"ab"]))
+        self.assertEqual(output, b"prefixli1e2:abe")
+
+    def test_invalid_values(self):
+        with self.assertRaises(TypeError):
+            BencodeEncoder().encode(1.5)
+        with self.assertRaises(TypeError):
+            BencodeEncoder().encode({1: 2})
+        with self.assertRaises(ValueError):
+            BencodeEncoder().encode({"a": 1, b"a": 2})
+
+
 class TestParseTorrentFile(unittest.TestCase):
 
     def setUp(self):
@@ -41,4 +221,58 @@ class TestParseTorrentFile(unittest.TestCase):
         parser = ParseTorrentFile(self.test_torrent_file )
         torrent = parser.execute()
         self.assertEqual(torrent.info.piece_length, 262144)
-        self.assertEqual(torrent.files, None)
\ No newline at end of file
+        self.assertEqual(torrent.files, None)
+
+    def test_execute_lazy(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "test.torrent")
+            with open(path, "wb") as f:
+                f.write(TORRENT)
+            torrent = ParseTorrentFile(path).execute_lazy()
+            self.assertEqual(torrent["info"]["name"], b"test")
+            self.assertEqual(bytes(torrent.raw("announce")), b"19:http://tracker/path")
+            del torrent
+
+    def test_info_hash_closes_the_map(self):
+        maps = []
+
+        def mapper(parser):
+            maps.append(real_map(parser))
+            return maps[-1]
+        real_map = ParseTorrentFile._map
+        with tempfile.TemporaryDirectory() as directory:
+            path = self._write(directory, TORRENT)
+            with mock.patch.object(ParseTorrentFile, "_map", mapper):
+                info_hash = ParseTorrentFile(path).info_hash()
+            self.assertEqual(info_hash, hashlib.sha1(TORRENT[TORRENT.index(b"4:info") + 6:-1]).digest())
+            self.assertTrue(maps[0].closed)
+            with open(path, "wb") as f:
+                f.write(b"li1ee")
+            with self.assertRaises(BencodeDecodeError):
+                ParseTorrentFile(path).info_hash()
+
+    def _write(self, directory, data):
+        path = os.path.join(directory, "test.torrent")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_execute_computes_info_hash_from_raw_span(self):
+        raw_info = TORRENT[TORRENT.index(b"4:info") + 6:-1]
+        with tempfile.TemporaryDirectory() as directory:
+            path = self._write(directory, TORRENT)
+            torrent = ParseTorrentFile(path).execute()
+            self.assertEqual(torrent.info_hash, hashlib.sha1(raw_info).digest())
+            self.assertIsNone(torrent.info_hash_v2)
+            self.assertEqual(ParseTorrentFile(path).info_hash(), torrent.info_hash)
+
+            torrent = ParseTorrentFile(path, hash_v2=True).execute()
+            self.assertEqual(torrent.info_hash_v2, hashlib.sha256(raw_info).digest())
+
+    def test_execute_hashes_v2_for_meta_version_2(self):
+        info = b"d6:lengthi1e12:meta versioni2e4:name1:a12:piece lengthi16384e6:pieces20:" + b"x" * 20 + b"e"
+        data = b"d8:announce5:http:4:info" + info + b"e"
+        with tempfile.TemporaryDirectory() as directory:
+            torrent = ParseTorrentFile(self._write(directory, data)).execute()
+            self.assertEqual(torrent.info_hash, hashlib.sha1(info).digest())
+            self.assertEqual(torrent.info_hash_v2, hashlib.sha256(info).digest())
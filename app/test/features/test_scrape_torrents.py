@@ -0,0 +1,124 @@
+import asyncio
+import struct
+import time
+import unittest
+import urllib.parse
+from app.features.scrape_torrents import ScrapeTorrentsUseCase
+from app.features.tracker_client import ScrapeResult, TrackerClient, scrape_url
+from app.repositories.meta_info import MetaInfo, Tracker
+
+
+def stats(info_hash):
+    return info_hash[0], info_hash[1], info_hash[0] + info_hash[1]
+
+
+class HTTPScrapeTracker:
+    """An HTTP tracker answering scrapes with stats derived from each info-hash."""
+    def __init__(self):
+        self.requests = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/announce"
+
+    async def handle(self, reader, writer):
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            target = urllib.parse.urlsplit(request_line.split()[1].decode())
+            info_hashes = [value.encode("latin-1") for name, value
+                           in urllib.parse.parse_qsl(target.query, encoding="latin-1") if name == "info_hash"]
+            self.requests.append((target.path, info_hashes, time.monotonic()))
+            files = b"".join(b"20:" + info_hash + b"d8:completei%de10:downloadedi%de10:incompletei%dee" % (
+                stats(info_hash)[0], stats(info_hash)[2], stats(info_hash)[1]) for info_hash in sorted(info_hashes))
+            body = b"d5:filesd" + files + b"ee"
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+            await writer.drain()
+        writer.close()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class UDPScrapeTracker(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.scrapes = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        _, action, transaction_id = struct.unpack_from(">QII", data)
+        if action == 0:
+            self.transport.sendto(struct.pack(">IIQ", 0, transaction_id, 99), address)
+        elif action == 2:
+            info_hashes = [data[i:i + 20] for i in range(16, len(data), 20)]
+            self.scrapes.append(info_hashes)
+            body = b"".join(struct.pack(">III", seeders, completed, leechers)
+                            for seeders, leechers, completed in map(stats, info_hashes))
+            self.transport.sendto(struct.pack(">II", 2, transaction_id) + body, address)
+
+
+def meta_info(url, index):
+    return MetaInfo(Tracker(url), None, info_hash=bytes([index % 256, index // 256]) + b"\xff" * 18)
+
+
+class TestScrapeTorrents(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.http = HTTPScrapeTracker()
+        await self.http.start()
+        loop = asyncio.get_running_loop()
+        self.transport, self.udp = await loop.create_datagram_endpoint(UDPScrapeTracker, local_addr=("127.0.0.1", 0))
+        self.udp_url = f"udp://127.0.0.1:{self.transport.get_extra_info('sockname')[1]}"
+        self.client = TrackerClient(timeout=2, udp_retries=1)
+
+    async def asyncTearDown(self):
+        self.client.close()
+        self.transport.close()
+        await self.http.close()
+
+    async def test_batch_scrape_groups_and_splits_requests(self):
+        torrents = [meta_info(self.http.url, i) for i in range(70)] + \
+                   [meta_info(self.udp_url, i) for i in range(100, 180)]
+        use_case = ScrapeTorrentsUseCase(torrents, self.client, min_request_interval=0)
+        results = await use_case.execute_async()
+        self.assertEqual(len(results), 150)
+        for torrent in torrents:
+            self.assertEqual(results[torrent.info_hash], ScrapeResult(*stats(torrent.info_hash)))
+        self.assertEqual(sorted(len(hashes) for _, hashes, _ in self.http.requests), [6, 64])
+        self.assertTrue(all(path == "/scrape" for path, _, _ in self.http.requests))
+        self.assertEqual(sorted(map(len, self.udp.scrapes)), [6, 74])
+        self.assertEqual(use_case.errors, {})
+
+    async def test_requests_to_one_tracker_are_rate_limited(self):
+        torrents = [meta_info(self.http.url, i) for i in range(130)]
+        await ScrapeTorrentsUseCase(torrents, self.client, min_request_interval=0.1).execute_async()
+        times = sorted(request[2] for request in self.http.requests)
+        self.assertEqual(len(times), 3)
+        self.assertGreaterEqual(times[2] - times[0], 0.19)
+
+    async def test_unreachable_tracker_is_reported(self):
+        dead = "http://127.0.0.1:1/announce"
+        torrents = [meta_info(dead, 1), meta_info(self.http.url, 2)]
+        use_case = ScrapeTorrentsUseCase(torrents, self.client)
+        results = await use_case.execute_async()
+        self.assertEqual(list(results), [torrents[1].info_hash])
+        self.assertIn(dead, use_case.errors)
+
+    def test_groups_use_first_scrapable_tracker(self):
+        torrent = MetaInfo(Tracker("http://a/announce"), None, info_hash=b"\x01" * 20,
+                           announce_tiers=[[Tracker("http://a/tracker")], [Tracker("http://b/announce.php")]])
+        self.assertEqual(ScrapeTorrentsUseCase([torrent, torrent]).groups(),
+                         {"http://b/announce.php": [b"\x01" * 20]})
+
+
+def test_scrape_url():
+    assert scrape_url("http://t.example/announce") == "http://t.example/scrape"
+    assert scrape_url("http://t.example/x/announce.php?passkey=1") == "http://t.example/x/scrape.php?passkey=1"
+    assert scrape_url("http://t.example/a") is None
+    assert scrape_url("udp://t.example:80") == "udp://t.example:80"
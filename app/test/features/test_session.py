@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import unittest
+import urllib.parse
+from app.features.dht import DHTNode
+from app.features.metainfo_cache import MetaInfoCache
+from app.features.seed_torrent import SeedTorrentUseCase
+from app.features.session import Session, COMPLETE, FAILED
+from app.repositories.meta_info import MetaInfo, TorrentInfo, TorrentFile
+from app.repositories.token_bucket import TokenBucket
+
+PIECE_LENGTH = 16 * 1024
+
+
+def make_torrent(name, data):
+    pieces = b"".join(hashlib.sha1(data[i:i + PIECE_LENGTH]).digest() for i in range(0, len(data), PIECE_LENGTH))
+    files = [TorrentFile(name, len(data))]
+    return MetaInfo("http://tracker", TorrentInfo(name, PIECE_LENGTH, pieces, files=files), files=files,
+                    info_hash=hashlib.sha1(name.encode()).digest())
+
+
+class Tracker:
+    """An HTTP tracker asking for an announce every second, returning the next list of peers each time."""
+    def __init__(self, peer_lists):
+        self.peer_lists = peer_lists
+        self.events = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/announce"
+
+    async def handle(self, reader, writer):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit((await reader.readline()).split()[1].decode()).query)
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        self.events.append(query.get("event", [None])[0])
+        peers = b"".join(socket.inet_aton(host) + struct.pack(">H", port)
+                         for host, port in self.peer_lists[min(len(self.events), len(self.peer_lists)) - 1])
+        body = b"d8:intervali1e12:min intervali1e5:peers%d:%se" % (len(peers), peers)
+        writer.write(b"HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+        await writer.drain()
+        writer.close()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class TestSession(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.seed_dir = tempfile.mkdtemp()
+        self.download_dir = tempfile.mkdtemp()
+        self.contents = {"a.bin": os.urandom(50000), "b.bin": os.urandom(80000), "c.bin": os.urandom(1000)}
+        for name, data in self.contents.items():
+            with open(os.path.join(self.seed_dir, name), "wb") as f:
+                f.write(data)
+        self.seeders = []
+
+    async def asyncTearDown(self):
+        for seeder in self.seeders:
+            await seeder.close()
+        shutil.rmtree(self.seed_dir)
+        shutil.rmtree(self.download_dir)
+
+    async def start_seeder(self, meta_info, **kwargs):
+        for index in range(len(meta_info.info.piece_hashes)):
+            meta_info.info.piece_hashes.set_verified(index)
+        seeder = SeedTorrentUseCase(meta_info, self.seed_dir, **kwargs)
+        await seeder.start("127.0.0.1", 0)
+        self.seeders.append(seeder)
+        return [("127.0.0.1", seeder.port)]
+
+    def assert_downloaded(self, name):
+        with open(os.path.join(self.download_dir, name), "rb") as f:
+            self.assertEqual(f.read(), self.contents[name])
+
+    async def test_downloads_several_torrents(self):
+        session = Session(self.download_dir, max_connections=4, host="127.0.0.1", timeout=5)
+        for name in self.contents:
+            session.add_torrent(make_torrent(name, self.contents[name]), await self.start_seeder(
+                make_torrent(name, self.contents[name])))
+        jobs = await session.run_async()
+        self.assertEqual([job.state for job in jobs], [COMPLETE] * 3)
+        for name in self.contents:
+            self.assert_downloaded(name)
+
+    async def test_failed_torrent_does_not_stop_the_others(self):
+        session = Session(self.download_dir, host="127.0.0.1", timeout=5)
+        good = session.add_torrent(make_torrent("a.bin", self.contents["a.bin"]),
+                                   await self.start_seeder(make_torrent("a.bin", self.contents["a.bin"])))
+        bad = session.add_torrent(make_torrent("b.bin", self.contents["b.bin"]), [("127.0.0.1", 1)])
+        await session.run_async()
+        self.assertEqual((good.state, bad.state), (COMPLETE, FAILED))
+        self.assertIn("incomplete", bad.error)
+
+    async def test_complete_torrents_are_rechecked_not_downloaded(self):
+        shutil.copy(os.path.join(self.seed_dir, "c.bin"), self.download_dir)
+        session = Session(self.download_dir, host="127.0.0.1")
+        job = session.add_torrent(make_torrent("c.bin", self.contents["c.bin"]), [])
+        await session.run_async()
+        self.assertEqual((job.state, job.rehashed), (COMPLETE, 1))
+
+    async def test_seeding_session_serves_every_torrent_on_one_port(self):
+        seeding = Session(self.seed_dir, host="127.0.0.1", upload_rate=10 ** 7)
+        for name in self.contents:
+            seeding.add_torrent(make_torrent(name, self.contents[name]), [])
+        task = asyncio.create_task(seeding.run_async(seed=True))
+        try:
+            while seeding.server is None or any(job.state != COMPLETE for job in seeding.jobs.values()):
+                await asyncio.sleep(0.01)
+            peers = [("127.0.0.1", seeding.listen_port)]
+            session = Session(self.download_dir, host="127.0.0.1", download_rate=10 ** 7, timeout=5)
+            for name in self.contents:
+                session.add_torrent(make_torrent(name, self.contents[name]), peers)
+            jobs = await session.run_async()
+            self.assertEqual([job.state for job in jobs], [COMPLETE] * 3)
+            for name in self.contents:
+                self.assert_downloaded(name)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def test_add_path_loads_directory(self):
+        for name in ("one", "two"):
+            info = b"d6:lengthi1e4:name3:" + name.encode() + b"12:piece lengthi16384e6:pieces20:" + bytes(20) + b"e"
+            with open(os.path.join(self.seed_dir, name + ".torrent"), "wb") as f:
+                f.write(b"d8:announce8:http://a4:info" + info + b"e")
+        session = Session(self.download_dir)
+        jobs = session.add_path(self.seed_dir)
+        self.assertEqual([job.meta_info.info.name for job in jobs], ["one", "two"])
+        with self.assertRaises(ValueError):
+            session.add_path(os.path.join(self.seed_dir, "one.torrent"))
+
+    def test_add_torrent_through_metainfo_cache(self):
+        info = b"d6:lengthi1e4:name3:one12:piece lengthi16384e6:pieces20:" + bytes(20) + b"e"
+        path = os.path.join(self.seed_dir, "one.torrent")
+        with open(path, "wb") as f:
+            f.write(b"d8:announce8:http://a4:info" + info + b"e")
+        cache = MetaInfoCache(os.path.join(self.download_dir, "cache"))
+        Session(self.download_dir, metainfo_cache=cache).add_torrent(path)
+        job = Session(self.download_dir, metainfo_cache=cache).add_torrent(path)
+        self.assertEqual((cache.misses, cache.hits), (1, 1))
+        self.assertEqual(job.meta_info.info_hash, hashlib.sha1(info).digest())
+
+    async def test_reannounces_every_interval_and_uses_the_new_peers(self):
+        # The first seeder is slow; the second one only shows up in the next announce
+        slow = await self.start_seeder(make_torrent("b.bin", self.contents["b.bin"]),
+                                       upload_limiter=TokenBucket(20000, burst=16384))
+        fast = await self.start_seeder(make_torrent("b.bin", self.contents["b.bin"]))
+        tracker = Tracker([slow, slow + fast])
+        meta_info = make_torrent("b.bin", self.contents["b.bin"])
+        meta_info.announce = await tracker.start()
+        try:
+            session = Session(self.download_dir, host="127.0.0.1", timeout=5)
+            job = session.add_torrent(meta_info)
+            started = asyncio.get_running_loop().time()
+            await session.run_async()
+            self.assertEqual(job.state, COMPLETE)
+            self.assertLess(asyncio.get_running_loop().time() - started, 3)
+            self.assert_downloaded("b.bin")
+            self.assertEqual((tracker.events[0], tracker.events[1], tracker.events[-1]), ("started", None, "completed"))
+            self.assertIsNone(job.announcer)
+        finally:
+            await tracker.close()
+
+    async def test_finds_peers_on_the_dht_when_trackers_fail(self):
+        router = DHTNode(bootstrap_nodes=[])
+        await router.start("127.0.0.1")
+        seeder_node = DHTNode(bootstrap_nodes=[router.address])
+        try:
+            await seeder_node.start("127.0.0.1")
+            await seeder_node.bootstrap()
+            meta_info = make_torrent("b.bin", self.contents["b.bin"])
+            seeder = await self.start_seeder(make_torrent("b.bin", self.contents["b.bin"]))
+            await seeder_node.announce_peer(meta_info.info_hash, seeder[0][1])
+
+            meta_info.announce = "http://127.0.0.1:1/announce"
+            session = Session(self.download_dir, host="127.0.0.1", timeout=5,
+                              dht=DHTNode(timeout=0.5, bootstrap_nodes=[router.address]))
+            job = session.add_torrent(meta_info)
+            await session.run_async()
+            self.assertEqual(job.state, COMPLETE)
+            self.assertIsNone(session.dht.transport)
+            self.assert_downloaded("b.bin")
+        finally:
+            await seeder_node.close()
+            await router.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+import asyncio
+import pytest
+import random
+import socket
+import struct
+import unittest
+import urllib.parse
+from unittest import mock
+from app.features.parse_torrent_file import ParseTorrentFile
+from app.features.tracker_client import (TrackerClient, TrackerError, TrackerTiers, decode_compact_peers,
+                                         parse_announce_response, UDP_PROTOCOL_ID)
+from app.repositories.meta_info import MetaInfo, Tracker
+
+INFO_HASH = bytes(range(20))
+PEER_ID = b"-DT0001-abcdefghijkl"
+COMPACT = socket.inet_aton("10.0.0.1") + struct.pack(">H", 6881) + socket.inet_aton("10.0.0.2") + struct.pack(">H", 80)
+COMPACT6 = socket.inet_pton(socket.AF_INET6, "2001:db8::1") + struct.pack(">H", 6881)
+
+
+class HTTPTracker:
+    """A keep-alive HTTP tracker answering every announce with `body`."""
+    def __init__(self, body):
+        self.body = body
+        self.raw = None  # Whole answer to send instead, if set
+        self.connections = 0
+        self.queries = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/announce"
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            self.queries.append(urllib.parse.urlsplit(request_line.split()[1].decode()).query)
+            writer.write(self.raw or b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(self.body) + self.body)
+            await writer.drain()
+        writer.close()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class UDPTracker(asyncio.DatagramProtocol):
+    """A BEP 15 tracker returning two peers (or the given compact peers)."""
+    def __init__(self, peers=COMPACT):
+        self.peers = peers
+        self.connects = 0
+        self.announces = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        connection_id, action, transaction_id = struct.unpack_from(">QII", data)
+        if action == 0:
+            assert connection_id == UDP_PROTOCOL_ID
+            self.connects += 1
+            self.transport.sendto(struct.pack(">IIQ", 0, transaction_id, 1234), address)
+        elif action == 1:
+            assert connection_id == 1234
+            self.announces.append(struct.unpack_from(">20s20sQQQIIIiH", data, 16))
+            self.transport.sendto(struct.pack(">IIIII", 1, transaction_id, 900, 3, 7) + self.peers, address)
+
+
+class TestTrackerClient(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.client = TrackerClient(timeout=2, udp_retries=1)
+        self.trackers = []
+
+    async def asyncTearDown(self):
+        self.client.close()
+        for tracker in self.trackers:
+            await tracker.close()
+
+    async def http_tracker(self, body):
+        tracker = HTTPTracker(body)
+        await tracker.start()
+        self.trackers.append(tracker)
+        return tracker
+
+    async def test_http_announce_with_compact_peers(self):
+        tracker = await self.http_tracker(
+            b"d8:completei5e10:incompletei2e8:intervali1800e12:min intervali60e5:peers12:" + COMPACT + b"e")
+        response = await self.client.announce(tracker.url, INFO_HASH, PEER_ID, 6881, left=100, event="started")
+        self.assertEqual(response.peers, [("10.0.0.1", 6881), ("10.0.0.2", 80)])
+        self.assertEqual((response.interval, response.min_interval), (1800, 60))
+        self.assertEqual((response.complete, response.incomplete), (5, 2))
+        query = urllib.parse.parse_qs(tracker.queries[0])
+        self.assertEqual(urllib.parse.unquote_to_bytes(tracker.queries[0].split("info_hash=")[1].split("&")[0]),
+                         INFO_HASH)
+        self.assertEqual(query["compact"], ["1"])
+        self.assertEqual(query["event"], ["started"])
+        self.assertEqual(query["left"], ["100"])
+
+    async def test_http_connection_is_reused(self):
+        tracker = await self.http_tracker(b"d8:intervali60e5:peers0:e")
+        for _ in range(3):
+            await self.client.announce(tracker.url, INFO_HASH, PEER_ID, 6881)
+        self.assertEqual(len(tracker.queries), 3)
+        self.assertEqual(tracker.connections, 1)
+
+    async def test_http_failure_reason(self):
+        tracker = await self.http_tracker(b"d14:failure reason12:unregisterede")
+        with self.assertRaisesRegex(TrackerError, "unregistered"):
+            await self.client.announce(tracker.url, INFO_HASH, PEER_ID, 6881)
+
+    async def test_udp_announce(self):
+        loop = asyncio.get_running_loop()
+        transport, tracker = await loop.create_datagram_endpoint(UDPTracker, local_addr=("127.0.0.1", 0))
+        try:
+            url = f"udp://127.0.0.1:{transport.get_extra_info('sockname')[1]}/announce"
+            for _ in range(2):
+                response = await self.client.announce(url, INFO_HASH, PEER_ID, 6881, left=10, event="started")
+            self.assertEqual(response.peers, [("10.0.0.1", 6881), ("10.0.0.2", 80)])
+            self.assertEqual((response.interval, response.complete, response.incomplete), (900, 7, 3))
+            self.assertEqual(tracker.connects, 1)  # The connection id is cached
+            info_hash, peer_id, downloaded, left, uploaded, event = tracker.announces[0][:6]
+            self.assertEqual((info_hash, peer_id, left, event), (INFO_HASH, PEER_ID, 10, 2))
+        finally:
+            transport.close()
+
+    async def test_udp_announce_over_ipv6_by_name(self):
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(lambda: UDPTracker(COMPACT6), local_addr=("::1", 0))
+        port = transport.get_extra_info("sockname")[1]
+
+        async def getaddrinfo(host, port, **kwargs):
+            self.assertEqual(host, "tracker.example")
+            return [(socket.AF_INET6, socket.SOCK_DGRAM, 17, "", ("::1", port, 0, 0)),
+                    (socket.AF_INET, socket.SOCK_DGRAM, 17, "", ("127.0.0.1", port))]
+        try:
+            with mock.patch.object(loop, "getaddrinfo", getaddrinfo):
+                response = await self.client.announce(f"udp://tracker.example:{port}/announce", INFO_HASH, PEER_ID,
+                                                      6881)
+            self.assertEqual(response.peers, [("2001:db8::1", 6881)])
+        finally:
+            transport.close()
+
+    async def test_tiers_fall_back_and_promote(self):
+        tracker = await self.http_tracker(b"d8:intervali120e12:min intervali30e5:peers6:" + COMPACT[:6] + b"e")
+        dead = "http://127.0.0.1:1/announce"
+        tiers = TrackerTiers([[dead], [dead, tracker.url]], rng=random.Random(0))
+        response = await tiers.announce(self.client, INFO_HASH, PEER_ID, 6881)
+        self.assertEqual(response.peers, [("10.0.0.1", 6881)])
+        self.assertEqual(tiers.tiers[1][0], tracker.url)
+        self.assertEqual((tiers.interval, tiers.min_interval), (120, 30))
+        self.assertFalse(tiers.can_announce())
+        self.assertTrue(tiers.can_announce(tiers.last_announce + 30))
+        self.assertEqual(tiers.next_announce_in(tiers.last_announce + 100), 20)
+
+    async def test_unresolvable_udp_tier_falls_back_to_the_next(self):
+        loop = asyncio.get_running_loop()
+        getaddrinfo = loop.getaddrinfo
+
+        async def resolve(host, port, **kwargs):
+            if host == "dead.invalid":
+                raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+            return await getaddrinfo(host, port, **kwargs)
+        tracker = await self.http_tracker(b"d8:intervali60e5:peers6:" + COMPACT[:6] + b"e")
+        tiers = TrackerTiers([["udp://dead.invalid:6969/announce"], [tracker.url]])
+        with mock.patch.object(loop, "getaddrinfo", resolve):
+            response = await tiers.announce(self.client, INFO_HASH, PEER_ID, 6881)
+            with self.assertRaisesRegex(TrackerError, "Cannot reach UDP tracker"):
+                await self.client.announce("udp://dead.invalid:6969/announce", INFO_HASH, PEER_ID, 6881)
+        self.assertEqual(response.peers, [("10.0.0.1", 6881)])
+        self.assertIn("dead.invalid", tiers.tiers[0][0])
+
+    async def test_http_invalid_body_length(self):
+        for headers in (b"Content-Length: x", b"Transfer-Encoding: chunked\r\n\r\nzz"):
+            tracker = await self.http_tracker(b"")
+            tracker.raw = b"HTTP/1.1 200 OK\r\n" + headers + b"\r\n\r\n"
+            with self.assertRaisesRegex(TrackerError, "Invalid HTTP response body"):
+                await self.client.announce(tracker.url, INFO_HASH, PEER_ID, 6881)
+
+    async def test_all_trackers_failing(self):
+        tiers = TrackerTiers([["http://127.0.0.1:1/announce"]])
+        with self.assertRaisesRegex(TrackerError, "All trackers failed"):
+            await tiers.announce(self.client, INFO_HASH, PEER_ID, 6881)
+
+
+def test_decode_compact_peers_ipv6():
+    data = socket.inet_pton(socket.AF_INET6, "::1") + struct.pack(">H", 51413)
+    assert decode_compact_peers(data, 16) == [("::1", 51413)]
+
+
+def test_parse_dictionary_peers():
+    response = parse_announce_response(b"d8:intervali60e5:peersld2:ip9:127.0.0.14:porti6881eeee")
+    assert response.peers == [("127.0.0.1", 6881)]
+
+
+def test_dictionary_peers_without_ip():
+    with pytest.raises(TrackerError):
+        parse_announce_response(b"d8:intervali60e5:peersld4:porti6881eeee")
+
+
+def test_tracker_tiers_from_announce_list(tmp_path):
+    torrent = tmp_path / "tiers.torrent"
+    torrent.write_bytes(b"d8:announce8:http://a13:announce-listll8:http://a7:udp://bel8:http://cee"
+                        b"4:infod6:lengthi1e4:name1:a12:piece lengthi16384e6:pieces20:" + bytes(20) + b"ee")
+    meta_info = ParseTorrentFile(str(torrent)).execute()
+    assert [[str(tracker) for tracker in tier] for tier in meta_info.tracker_tiers()] == [["http://a", "udp://b"],
+                                                                                            ["http://c"]]
+
+
+def test_tracker_tiers_without_announce_list():
+    assert [[str(t) for t in tier] for tier in MetaInfo(Tracker("http://a"), None).tracker_tiers()] == [["http://a"]]
@@ -0,0 +1,56 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from app.features.verify_pieces import VerifyPieces
+from app.repositories.bt_file import BTFile, BTFileCollection
+from app.repositories.piece_hash_table import PieceHashTable
+
+
+class TestVerifyPieces(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.piece_length = 1024
+        self.payload = os.urandom(10 * 1024 + 300)
+        sizes = [3000, 0, 5000, len(self.payload) - 8000]
+        self.collection = BTFileCollection()
+        offset = 0
+        for index, size in enumerate(sizes):
+            with open(os.path.join(self.test_dir, f"file{index}"), "wb") as f:
+                f.write(self.payload[offset:offset + size])
+            self.collection.add_file(BTFile(f"file{index}", size, offset, offset + size - 1))
+            offset += size
+        self.expected = [hashlib.sha1(self.payload[i:i + self.piece_length]).digest()
+                         for i in range(0, len(self.payload), self.piece_length)]
+
+    def tearDown(self):
+        self.collection.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_digests_match_serial_hashing(self):
+        self.assertEqual(self.collection.all_sha1_split_every(self.piece_length, self.test_dir), self.expected)
+        verifier = VerifyPieces(self.collection, self.piece_length, self.test_dir, workers=4)
+        self.assertEqual(verifier.execute(), self.expected)
+
+    def test_small_memory_budget_keeps_order(self):
+        verifier = VerifyPieces(self.collection, self.piece_length, self.test_dir, workers=3, memory_budget=1)
+        self.assertEqual(verifier.max_in_flight, 3)
+        self.assertEqual([index for index, _ in verifier.digests()], list(range(len(self.expected))))
+
+    def test_process_pool(self):
+        verifier = VerifyPieces(self.collection, self.piece_length, self.test_dir, workers=2, use_processes=True)
+        self.assertEqual(verifier.execute(), self.expected)
+
+    def test_bitfield_against_piece_hashes(self):
+        self.collection.write_offset(5 * self.piece_length + 10, b"corrupt", self.test_dir)
+        table = PieceHashTable(b"".join(self.expected), self.piece_length, len(self.payload))
+        bitfield = VerifyPieces(self.collection, self.piece_length, self.test_dir, workers=2).execute(table)
+        self.assertEqual(bitfield, b"\xfb\xe0")
+        self.assertFalse(table.is_verified(5))
+
+    def test_piece_count_mismatch(self):
+        table = PieceHashTable(b"x" * 20, self.piece_length)
+        with self.assertRaises(ValueError):
+            VerifyPieces(self.collection, self.piece_length, self.test_dir).execute(table)
@@ -156,9 +156,11 @@ def test_write_offset(mocker):
     bt_file2 = BTFile('test_file2', 200, 100, 299)
     btfile_collection = BTFileCollection([bt_file1, bt_file2])
 
-    open_mock = mocker.mock_open()  # Assign the result of mocker.mock_open() to open_mock
-    mocker.patch('builtins.open', open_mock)  # Patch builtins.open with the open_mock variable
+    open_mock = mocker.patch('os.open', return_value=42)  # Files are opened once and written with os.pwrite
+    pwrite_mock = mocker.patch('os.pwrite', side_effect=lambda fd, data, offset: len(data))
+    mocker.patch('os.close')
 
     btfile_collection.write_offset(50, b'test_data', 'output_dir')
-    
-    open_mock().write.assert_called_once_with(b'test_data')
\ No newline at end of file
+
+    open_mock.assert_called_once()
+    pwrite_mock.assert_called_once_with(42, b'test_data', 50)
\ No newline at end of file
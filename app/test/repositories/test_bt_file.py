@@ -1,8 +1,14 @@
+import concurrent.futures
+import errno
+import hashlib
+import mmap
 import unittest
+from unittest import mock
 import tempfile
 import shutil
 import os
-from app.repositories.bt_file import BTFileCollection, BTFile
+from app.repositories.bt_file import BTFileCollection, BTFile, FileHandlePool, MappedFilePool, \
+    ALLOCATE_NONE, ALLOCATE_SPARSE, ALLOCATE_FULL
 from base64 import encode, encodebytes
 import os
 
@@ -40,12 +46,15 @@ class BTFileTest(unittest.TestCase):
         self.assertEqual(bt_file.end_byte, 1023)
 
     def test_get_info_hash(self):
-        with open('test.torrent', 'wb') as f:
-            f.write(encodebytes.bencode(torrent_file_mock))
+        info = b"d6:lengthi1024e4:name8:test.mp412:piece lengthi16384e6:pieces20:0123456789abcdef0123e"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.torrent')
+            with open(path, 'wb') as f:
+                f.write(b"d8:announce5:http:4:info" + info + b"e")
 
-        bt_file = BTFile('test.torrent', 1024, 0, 1024)
-        info_hash = bt_file.get_info_hash()
-        self.assertEqual(info_hash, '0123456789abcdef')
+            bt_file = BTFile(path, 1024, 0, 1023)
+            self.assertEqual(bt_file.get_info_hash(), hashlib.sha1(info).digest())
+            self.assertEqual(BTFileCollection.get_info_hash(path), hashlib.sha1(info).digest())
 
 class TestBTFileCollection(unittest.TestCase):
 
@@ -69,6 +78,7 @@ class TestBTFileCollection(unittest.TestCase):
             current_byte += len(file_data)
 
     def tearDown(self):
+        self.btfile_collection.close()
         shutil.rmtree(self.test_dir)
 
     def test_read(self):
@@ -85,3 +95,232 @@ class TestBTFileCollection(unittest.TestCase):
             self.assertEqual(updated_data[:len(new_data)], new_data)
 
 
+    def test_read_across_files(self):
+        all_data = b"".join(self.files_data.values())
+        self.assertEqual(self.btfile_collection.read_offset(0, len(all_data), self.test_dir), all_data)
+        self.assertEqual(self.btfile_collection.read_offset(20, 40, self.test_dir), all_data[20:60])
+
+    def test_write_across_files(self):
+        all_data = bytearray(b"".join(self.files_data.values()))
+        self.btfile_collection.write_offset(25, b"x" * 30, self.test_dir)
+        all_data[25:55] = b"x" * 30
+        self.assertEqual(self.btfile_collection.read_offset(0, len(all_data), self.test_dir), all_data)
+
+    def test_write_buffers_across_files(self):
+        all_data = bytearray(b"".join(self.files_data.values()))
+        buffers = [b"a" * 10, b"", bytearray(b"b" * 30), memoryview(b"c" * 7)]
+        self.btfile_collection.write_buffers(3, buffers, self.test_dir)
+        all_data[3:50] = b"".join(buffers)
+        self.assertEqual(self.btfile_collection.read_offset(0, len(all_data), self.test_dir), all_data)
+
+    @unittest.skipUnless(hasattr(os, "pwritev"), "pwritev is not available")
+    def test_zero_byte_writes_raise(self):
+        with mock.patch("os.pwritev", return_value=0), self.assertRaises(OSError) as raised:
+            self.btfile_collection.write_buffers(3, [b"a" * 10], self.test_dir)
+        self.assertEqual(raised.exception.errno, errno.EIO)
+        with mock.patch("os.pwrite", return_value=0), self.assertRaises(OSError) as raised:
+            self.btfile_collection.write_offset(3, b"a" * 10, self.test_dir)
+        self.assertEqual(raised.exception.errno, errno.EIO)
+
+    def test_file_spans_skips_empty_files(self):
+        collection = BTFileCollection([BTFile("a", 10, 0, 9), BTFile("empty", 0, 10, 9),
+                                       BTFile("b", 10, 10, 19), BTFile("c", 10, 20, 29)])
+        spans = [(f.path, start, length) for f, start, length in collection.file_spans(5, 20)]
+        self.assertEqual(spans, [("a", 5, 5), ("b", 0, 10), ("c", 0, 5)])
+        spans = [(f.path, start, length) for f, start, length in collection.file_spans(10, 1)]
+        self.assertEqual(spans, [("b", 0, 1)])
+
+    def test_add_file_keeps_index_in_sync(self):
+        collection = BTFileCollection([BTFile("a", 10, 0, 9)])
+        collection.add_file(BTFile("b", 10, 10, 19))
+        spans = [(f.path, start, length) for f, start, length in collection.file_spans(12, 2)]
+        self.assertEqual(spans, [("b", 2, 2)])
+
+class TestAllocate(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.collection = BTFileCollection([BTFile("a/b/one.bin", 100000, 0, 99999),
+                                            BTFile("two.bin", 5000, 100000, 104999), BTFile("a/empty", 0, 105000, 104999)])
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def sizes(self):
+        return [os.path.getsize(os.path.join(self.test_dir, f.path)) for f in self.collection.get_files()]
+
+    def test_none_creates_empty_files(self):
+        self.collection.allocate(self.test_dir, ALLOCATE_NONE)
+        self.assertEqual(self.sizes(), [0, 0, 0])
+
+    def test_sparse_sets_final_sizes(self):
+        self.collection.allocate(self.test_dir, ALLOCATE_SPARSE)
+        self.assertEqual(self.sizes(), [100000, 5000, 0])
+
+    def test_full_reserves_blocks(self):
+        self.collection.allocate(self.test_dir, ALLOCATE_FULL)
+        self.assertEqual(self.sizes(), [100000, 5000, 0])
+        path = os.path.join(self.test_dir, "a/b/one.bin")
+        self.assertGreaterEqual(os.stat(path).st_blocks * 512, 100000)
+
+    def test_full_without_fallocate_writes_zeros(self):
+        with mock.patch("os.posix_fallocate", side_effect=OSError(errno.EOPNOTSUPP, "not supported")):
+            self.collection.allocate(self.test_dir, ALLOCATE_FULL)
+        with open(os.path.join(self.test_dir, "two.bin"), "rb") as f:
+            self.assertEqual(f.read(), bytes(5000))
+
+    def test_existing_data_is_kept(self):
+        os.makedirs(os.path.join(self.test_dir, "a/b"))
+        with open(os.path.join(self.test_dir, "a/b/one.bin"), "wb") as f:
+            f.write(b"data")
+        with open(os.path.join(self.test_dir, "two.bin"), "wb") as f:
+            f.write(b"x" * 6000)
+        self.collection.allocate(self.test_dir, ALLOCATE_FULL)
+        self.assertEqual(self.sizes(), [100000, 6000, 0])
+        self.assertEqual(self.collection.read_offset(0, 4, self.test_dir), b"data")
+
+    def test_rejects_paths_outside_output_directory(self):
+        collection = BTFileCollection([BTFile("../escape", 10, 0, 9)])
+        with self.assertRaises(ValueError):
+            collection.allocate(self.test_dir)
+        with self.assertRaises(ValueError):
+            self.collection.allocate(self.test_dir, "preallocate")
+
+
+class TestFileHandlePool(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.paths = []
+        for index in range(3):
+            path = os.path.join(self.test_dir, f"file{index}")
+            with open(path, "wb") as f:
+                f.write(b"0123456789")
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_reuses_open_descriptors(self):
+        pool = FileHandlePool(max_open_files=2)
+        with pool.open(self.paths[0]) as fd:
+            first = fd
+        with pool.open(self.paths[0]) as fd:
+            self.assertEqual(fd, first)
+        self.assertEqual(os.pread(first, 4, 2), b"2345")
+        pool.close()
+        self.assertEqual(len(pool), 0)
+
+    def test_evicts_least_recently_used(self):
+        pool = FileHandlePool(max_open_files=2)
+        for path in self.paths:
+            with pool.open(path):
+                pass
+        self.assertEqual(len(pool), 2)
+        self.assertEqual([key[0] for key in pool._handles], self.paths[1:])
+        pool.close()
+
+    def test_busy_descriptors_are_not_evicted(self):
+        pool = FileHandlePool(max_open_files=1)
+        with pool.open(self.paths[0]) as fd:
+            with pool.open(self.paths[1]):
+                pass
+            self.assertEqual(os.pread(fd, 2, 0), b"01")
+        self.assertEqual(len(pool), 1)
+        pool.close()
+
+    def test_writes_use_read_write_descriptor(self):
+        pool = FileHandlePool()
+        with pool.open(self.paths[0], writable=True) as fd:
+            os.pwrite(fd, b"ab", 0)
+        with pool.open(self.paths[0]) as fd:
+            self.assertEqual(os.pread(fd, 3, 0), b"ab2")
+        self.assertEqual(len(pool), 1)
+        pool.close()
+
+    def test_collection_shares_pool(self):
+        files = [BTFile(os.path.basename(path), 10, index * 10, index * 10 + 9) for index, path in enumerate(self.paths)]
+        with BTFileCollection(files, max_open_files=2) as collection:
+            self.assertEqual(collection.read_offset(5, 20, self.test_dir), b"56789012345678901234")
+            collection.write_offset(8, b"xxxx", self.test_dir)
+            self.assertEqual(collection.read_offset(8, 4, self.test_dir), b"xxxx")
+            self.assertLessEqual(len(collection.handles), 2)
+        self.assertEqual(len(collection.handles), 0)
+
+
+class TestMappedStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.data = bytes(range(256)) * 12
+        files = []
+        for index in range(3):
+            with open(os.path.join(self.test_dir, f"file{index}"), "wb") as f:
+                f.write(self.data[index * 1024:(index + 1) * 1024])
+            files.append(BTFile(f"file{index}", 1024, index * 1024, index * 1024 + 1023))
+        self.collection = BTFileCollection(files, max_open_files=2, use_mmap=True)
+
+    def tearDown(self):
+        self.collection.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_read_inside_one_file_is_a_view_of_the_map(self):
+        data = self.collection.read_offset(1030, 100, self.test_dir)
+        self.assertIsInstance(data, memoryview)
+        self.assertIsInstance(data.obj, mmap.mmap)
+        self.assertEqual(data, self.data[1030:1130])
+        data.release()
+
+    def test_read_across_files_is_gathered(self):
+        data = self.collection.read_offset(1000, 2000, self.test_dir)
+        self.assertIsInstance(data, memoryview)
+        self.assertEqual(data, self.data[1000:3000])
+
+    def test_writes_are_visible_through_maps(self):
+        before = self.collection.read_offset(0, 4, self.test_dir)
+        self.collection.write_offset(0, b"abcd", self.test_dir)
+        self.assertEqual(before, b"abcd")
+        before.release()
+
+    def test_eviction_with_exported_views(self):
+        views = [self.collection.read_offset(index * 1024, 10, self.test_dir) for index in range(3)]
+        self.assertEqual(len(self.collection.maps), 2)
+        self.assertEqual(views[0], self.data[:10])
+        for view in views:
+            view.release()
+
+    def test_empty_files_read_short(self):
+        open(os.path.join(self.test_dir, "file1"), "wb").close()
+        self.assertEqual(self.collection.read_offset(1030, 100, self.test_dir), b"")
+        self.assertEqual(self.collection.read_offset(1000, 2000, self.test_dir), self.data[1000:1024])
+        self.assertEqual(len(self.collection.maps), 1)
+
+    def test_views_survive_eviction(self):
+        pool = MappedFilePool(max_open_files=1)
+        view = pool.view(os.path.join(self.test_dir, "file0"), 10, 20)
+        self.assertEqual(pool.read(os.path.join(self.test_dir, "file1"), 0, 4), self.data[1024:1028])
+        self.assertEqual(len(pool), 1)
+        self.assertEqual(view, self.data[10:30])
+        view.release()
+        pool.close()
+
+    def test_concurrent_reads_with_evictions(self):
+        collection = BTFileCollection(self.collection.get_files(), max_open_files=1, use_mmap=True)
+
+        def read(start):
+            for offset in range(start, 3000, 97):
+                data = collection.read_offset(offset, 100, self.test_dir)
+                assert data == self.data[offset:offset + 100]
+                del data
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            list(executor.map(read, range(4)))
+        collection.close()
+
+    def test_pool_remaps_grown_files(self):
+        path = os.path.join(self.test_dir, "file0")
+        pool = MappedFilePool()
+        self.assertEqual(len(pool.get(path)), 1024)
+        with open(path, "ab") as f:
+            f.write(b"more")
+        self.assertEqual(len(pool.get(path, 1028)), 1028)
+        pool.close()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+from app.repositories.bt_file import BTFileCollection, ALLOCATE_SPARSE
+from app.repositories.file_priorities import FilePriorities, PRIORITY_SKIP, PRIORITY_NORMAL, PRIORITY_HIGH
+from app.repositories.file_table import FileTable
+
+
+class TestFilePriorities(unittest.TestCase):
+
+    def setUp(self):
+        # Piece length 10: a.bin covers pieces 0-2, empty.txt none, b/c.bin pieces 2-4 and b/d.bin piece 4
+        self.files = FileTable()
+        self.files.append(["a.bin"], 25)
+        self.files.append(["empty.txt"], 0)
+        self.files.append(["b", "c.bin"], 20)
+        self.files.append(["b", "d.bin"], 3)
+        self.priorities = FilePriorities(self.files, 10)
+
+    def test_file_pieces(self):
+        self.assertEqual([self.priorities.file_pieces(i) for i in range(4)],
+                         [range(0, 3), range(0), range(2, 5), range(4, 5)])
+        self.assertEqual(self.priorities.piece_count, 5)
+
+    def test_all_wanted_by_default(self):
+        self.assertEqual(list(self.priorities.piece_priorities()), [PRIORITY_NORMAL] * 5)
+        self.assertEqual(self.priorities.boundary_pieces(), set())
+        self.assertEqual(self.priorities.needed_files(), {0, 1, 2, 3})
+
+    def test_boundary_pieces_of_skipped_files(self):
+        self.priorities.select(["b/*"], ["b/d.bin"])
+        self.assertEqual(list(self.priorities.priorities), [PRIORITY_SKIP, PRIORITY_SKIP, PRIORITY_NORMAL, PRIORITY_HIGH])
+        self.assertEqual(list(self.priorities.piece_priorities()), [0, 0, 1, 1, 2])
+        self.assertEqual(self.priorities.wanted_pieces(), [2, 3, 4])
+        # Piece 2 holds the end of a.bin
+        self.assertEqual(self.priorities.boundary_pieces(), {2})
+        self.assertEqual(self.priorities.needed_files(), {0, 2, 3})
+
+    def test_set_matching(self):
+        self.assertEqual(self.priorities.set_matching("*.bin", PRIORITY_SKIP), 3)
+        self.assertEqual(self.priorities.wanted_pieces(), [])
+        with self.assertRaises(ValueError):
+            self.priorities.set(0, 7)
+
+    def test_allocate_only_needed_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.priorities.set(2, PRIORITY_SKIP)
+            BTFileCollection(self.files).allocate(directory, ALLOCATE_SPARSE, self.priorities)
+            sizes = {path: os.path.getsize(os.path.join(directory, path))
+                     for path in ("a.bin", "empty.txt", "b/c.bin", "b/d.bin")
+                     if os.path.exists(os.path.join(directory, path))}
+            # b/c.bin shares pieces with both neighbours: created, but left empty
+            self.assertEqual(sizes, {"a.bin": 25, "empty.txt": 0, "b/c.bin": 0, "b/d.bin": 3})
+        finally:
+            shutil.rmtree(directory)
+
+    def test_allocate_skips_unneeded_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.priorities.select(["a.bin"])
+            BTFileCollection(self.files).allocate(directory, ALLOCATE_SPARSE, self.priorities)
+            self.assertTrue(os.path.exists(os.path.join(directory, "b", "c.bin")))
+            self.assertFalse(os.path.exists(os.path.join(directory, "b", "d.bin")))
+            self.assertFalse(os.path.exists(os.path.join(directory, "empty.txt")))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from app.repositories.bt_file import BTFile, BTFileCollection
+from app.repositories.file_table import FileTable, FileView
+from app.repositories.meta_info import MetaInfo, TorrentInfo, TorrentFile
+
+
+class TestFileTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = FileTable()
+        self.table.append(["dir", "sub", "a.bin"], 10)
+        self.table.append("dir/sub/b.bin", 0)
+        self.table.append(["dir", "c.bin"], 5)
+        self.table.append(["top.bin"], 7)
+
+    def test_columns(self):
+        self.assertEqual(len(self.table), 4)
+        self.assertEqual(list(self.table.lengths), [10, 0, 5, 7])
+        self.assertEqual(list(self.table.starts), [0, 10, 10, 15])
+        self.assertEqual(self.table.total_size(), 22)
+
+    def test_paths(self):
+        self.assertEqual([file.path for file in self.table], ["dir/sub/a.bin", "dir/sub/b.bin", "dir/c.bin", "top.bin"])
+        self.assertEqual(self.table[-2].components, ["dir", "c.bin"])
+
+    def test_directories_are_shared(self):
+        # root, dir and dir/sub
+        self.assertEqual(len(self.table.tree), 3)
+        self.assertEqual(self.table.directories[0], self.table.directories[1])
+        first, second = self.table.tree.names[1], FileTable()
+        second.append(["".join(["d", "ir"]), "x"], 1)
+        self.assertIs(second.tree.names[1], first)
+
+    def test_view(self):
+        view = self.table[2]
+        self.assertIsInstance(view, FileView)
+        self.assertEqual((view.length, view.size, view.start_byte, view.end_byte), (5, 5, 10, 14))
+        self.assertEqual(view, self.table[2])
+        with self.assertRaises(IndexError):
+            self.table[4]
+
+    def test_find(self):
+        self.assertEqual(self.table.find(0), 0)
+        self.assertEqual(self.table.find(12), 2)
+        self.assertEqual(self.table.find(21), 3)
+
+    def test_invalid_length(self):
+        with self.assertRaises(ValueError):
+            self.table.append(["bad"], -1)
+
+
+class TestFileTableIntegration(unittest.TestCase):
+
+    def test_collection_from_btfile_list(self):
+        collection = BTFileCollection([BTFile("a", 3, 0, 2), BTFile("b/c", 4, 3, 6)])
+        spans = [(bt_file.path, start, length) for bt_file, start, length in collection.file_spans(2, 3)]
+        self.assertEqual(spans, [("a", 2, 1), ("b/c", 0, 2)])
+        self.assertEqual(collection.total_size(), 7)
+
+    def test_collection_shares_the_meta_info_table(self):
+        table = FileTable()
+        table.append(["d", "x"], 100)
+        table.append(["d", "y"], 50)
+        info = TorrentInfo("d", 64, bytes(60), files=table)
+        meta_info = MetaInfo(announce=None, info=info, files=table)
+        self.assertEqual(info.total_length(), 150)
+        self.assertIs(meta_info.create_btfile_collection().get_files(), table)
+
+    def test_from_torrent_files(self):
+        table = FileTable.from_files([TorrentFile("a/b", 2), TorrentFile("a/c", 3)])
+        self.assertEqual([(file.path, file.start_byte) for file in table], [("a/b", 0), ("a/c", 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
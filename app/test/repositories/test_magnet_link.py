@@ -0,0 +1,44 @@
+import base64
+import unittest
+from app.repositories.magnet_link import MagnetLink, MagnetLinkError
+
+INFO_HASH = bytes(range(20))
+
+
+class TestMagnetLink(unittest.TestCase):
+
+    def test_parse(self):
+        link = MagnetLink.parse(f"magnet:?xt=urn:btih:{INFO_HASH.hex()}&dn=Some+name&tr=udp%3A%2F%2Ft%3A80"
+                                f"&tr=http://a/announce&tr=udp://t:80&x.pe=10.0.0.1:6881&x.pe=[::1]:51413&xl=1234")
+        self.assertEqual(link.info_hash, INFO_HASH)
+        self.assertEqual(link.name, "Some name")
+        self.assertEqual(link.trackers, ["udp://t:80", "http://a/announce"])
+        self.assertEqual(link.tracker_tiers(), [["udp://t:80"], ["http://a/announce"]])
+        self.assertEqual(link.peers, [("10.0.0.1", 6881), ("::1", 51413)])
+        self.assertEqual(link.length, 1234)
+
+    def test_base32_info_hash(self):
+        link = MagnetLink.parse("magnet:?xt=urn:btih:" + base64.b32encode(INFO_HASH).decode().lower())
+        self.assertEqual(link.info_hash, INFO_HASH)
+        self.assertEqual((link.name, link.trackers, link.peers, link.length), (None, [], [], None))
+
+    def test_numbered_parameters(self):
+        link = MagnetLink.parse(f"magnet:?xt.1=urn:btih:{INFO_HASH.hex()}&tr.1=http://a&tr.2=http://b")
+        self.assertEqual((link.info_hash, link.trackers), (INFO_HASH, ["http://a", "http://b"]))
+
+    def test_round_trip(self):
+        link = MagnetLink(INFO_HASH, "a b&c", ["http://a/announce?x=1"], [("::1", 1), ("h", 2)], 5)
+        parsed = MagnetLink.parse(str(link))
+        self.assertEqual((parsed.info_hash, parsed.name, parsed.trackers, parsed.peers, parsed.length),
+                         (INFO_HASH, "a b&c", ["http://a/announce?x=1"], [("::1", 1), ("h", 2)], 5))
+
+    def test_invalid(self):
+        for uri in ("http://example.com", "magnet:?dn=x", "magnet:?xt=urn:btih:1234",
+                    f"magnet:?xt=urn:btmh:1220{'00' * 32}", f"magnet:?xt=urn:btih:{INFO_HASH.hex()}&x.pe=host",
+                    f"magnet:?xt=urn:btih:{INFO_HASH.hex()}&xl=-1"):
+            with self.assertRaises(MagnetLinkError, msg=uri):
+                MagnetLink.parse(uri)
+
+
+if __name__ == '__main__':
+    unittest.main()
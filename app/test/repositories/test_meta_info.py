@@ -105,6 +105,22 @@ def test_create_btfile_collection_multiple_files(mocker):
     assert btfile_collection.get_files()[1].size == 200
 
 
+# Tests that the create_btfile_collection method creates the files when given an output directory. tags: [happy path]
+def test_create_btfile_collection_allocates_files(mocker, tmp_path):
+    file_info_1 = mocker.Mock()
+    file_info_1.path = "dir/test_file_1.txt"
+    file_info_1.length = 100
+    file_info_2 = mocker.Mock()
+    file_info_2.path = "test_file_2.txt"
+    file_info_2.length = 200
+    meta_info = MetaInfo("test_announce", mocker.Mock(), files=[file_info_1, file_info_2])
+
+    meta_info.create_btfile_collection(str(tmp_path))
+
+    assert (tmp_path / "dir" / "test_file_1.txt").stat().st_size == 100
+    assert (tmp_path / "test_file_2.txt").stat().st_size == 200
+
+
 # Tests that the create_btfile_collection method raises an exception when the torrent file contains invalid or missing file information. tags: [edge case]
 def test_create_btfile_collection_invalid_file_info(mocker):
     # Setup
@@ -154,9 +170,11 @@ def test_write_offset(mocker):
     bt_file2 = BTFile('test_file2', 200, 100, 299)
     btfile_collection = BTFileCollection([bt_file1, bt_file2])
 
-    open_mock = mocker.mock_open()  # Assign the result of mocker.mock_open() to open_mock
-    mocker.patch('builtins.open', open_mock)  # Patch builtins.open with the open_mock variable
+    open_mock = mocker.patch('os.open', return_value=42)  # Files are opened once and written with os.pwrite
+    pwrite_mock = mocker.patch('os.pwrite', side_effect=lambda fd, data, offset: len(data))
+    mocker.patch('os.close')
 
     btfile_collection.write_offset(50, b'test_data', 'output_dir')
-    
-    open_mock().write.assert_called_once_with(b'test_data')
\ No newline at end of file
+
+    open_mock.assert_called_once()
+    pwrite_mock.assert_called_once_with(42, b'test_data', 50)
\ No newline at end of file
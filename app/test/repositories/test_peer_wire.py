@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+from app.repositories import peer_wire
+
+
+class TestPeerWireMessages(unittest.TestCase):
+
+    def test_block_round_trip(self):
+        payload = peer_wire.encode_block(1, 16384, 16384)
+        self.assertEqual(peer_wire.decode_block(payload), (1, 16384, 16384))
+        with self.assertRaises(peer_wire.PeerWireError):
+            peer_wire.decode_block(payload[:-1])
+
+    def test_have_round_trip(self):
+        self.assertEqual(peer_wire.decode_have(peer_wire.encode_have(7)), 7)
+
+    def test_decode_piece(self):
+        index, begin, block = peer_wire.decode_piece(b"\0\0\0\x02\0\0\0\x10data")
+        self.assertEqual((index, begin, bytes(block)), (2, 16, b"data"))
+
+    def test_generate_peer_id(self):
+        peer_id = peer_wire.generate_peer_id()
+        self.assertEqual(len(peer_id), 20)
+        self.assertTrue(peer_id.startswith(b"-PY"))
+
+
+class TestPeerConnection(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.accepted = asyncio.Queue()
+
+        async def accept(reader, writer):
+            await self.accepted.put(peer_wire.PeerConnection(reader, writer, timeout=5))
+        self.server = await asyncio.start_server(accept, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.client = await peer_wire.PeerConnection.open("127.0.0.1", port, timeout=5)
+        self.remote = await self.accepted.get()
+
+    async def asyncTearDown(self):
+        self.client.close()
+        self.remote.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_handshake(self):
+        await self.client.send_handshake(b"i" * 20, b"p" * 20)
+        self.assertEqual(await self.remote.read_handshake(b"i" * 20), b"i" * 20)
+        self.assertEqual(self.remote.peer_id, b"p" * 20)
+
+    async def test_handshake_for_other_torrent(self):
+        await self.client.send_handshake(b"i" * 20, b"p" * 20)
+        with self.assertRaises(peer_wire.PeerWireError):
+            await self.remote.read_handshake(b"x" * 20)
+
+    async def test_messages(self):
+        await self.client.send_message(peer_wire.INTERESTED)
+        await self.client.send_keep_alive()
+        await self.client.send_piece(1, 0, memoryview(b"block"))
+        self.assertEqual(await self.remote.read_message(), (peer_wire.INTERESTED, b""))
+        self.assertEqual(await self.remote.read_message(), (None, b""))
+        message_id, payload = await self.remote.read_message()
+        self.assertEqual(message_id, peer_wire.PIECE)
+        self.assertEqual(bytes(peer_wire.decode_piece(payload)[2]), b"block")
+
+    async def test_message_too_long(self):
+        self.client.writer.write((peer_wire.MAX_MESSAGE_LENGTH + 1).to_bytes(4, "big"))
+        with self.assertRaises(peer_wire.PeerWireError):
+            await self.remote.read_message()
@@ -0,0 +1,73 @@
+import hashlib
+import unittest
+from app.repositories.piece_hash_table import PieceHashTable
+from app.repositories.meta_info import TorrentInfo
+
+
+class TestPieceHashTable(unittest.TestCase):
+
+    def setUp(self):
+        self.payload = bytes(range(256)) * 10  # 2560 bytes
+        self.piece_length = 1024
+        self.digests = [hashlib.sha1(self.payload[i:i + self.piece_length]).digest()
+                        for i in range(0, len(self.payload), self.piece_length)]
+        self.pieces = b"".join(self.digests)
+        self.table = PieceHashTable(self.pieces, self.piece_length, len(self.payload))
+
+    def test_invalid_length(self):
+        with self.assertRaises(ValueError):
+            PieceHashTable(b"x" * 21, 1024)
+
+    def test_getitem_is_zero_copy(self):
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(self.table[1], self.digests[1])
+        self.assertEqual(self.table[-1], self.digests[2])
+        self.assertIs(self.table[0].obj, self.pieces)
+        with self.assertRaises(IndexError):
+            self.table[3]
+
+    def test_iter(self):
+        self.assertEqual([bytes(h) for h in self.table], self.digests)
+
+    def test_compare_all_good(self):
+        self.assertEqual(self.table.compare(self.digests), [True, True, True])
+        self.assertTrue(self.table.is_complete())
+        self.assertEqual(self.table.bitfield, b"\xe0")
+
+    def test_compare_with_mismatch(self):
+        self.assertEqual(self.table.compare([self.digests[1], b"\0" * 20], start=1), [True, False])
+        self.assertFalse(self.table.is_verified(0))
+        self.assertTrue(self.table.is_verified(1))
+        self.assertFalse(self.table.is_verified(2))
+        self.assertEqual(self.table.verified_count(), 1)
+        with self.assertRaises(IndexError):
+            self.table.compare(self.digests, start=1)
+
+    def test_verify(self):
+        self.assertTrue(self.table.verify(2, self.digests[2]))
+        self.assertFalse(self.table.verify(0, self.digests[2]))
+        self.assertEqual(self.table.bitfield, b"\x20")
+        self.table.set_verified(2, False)
+        self.assertEqual(self.table.bitfield, b"\x00")
+
+    def test_bitfield_setter_clears_spare_bits(self):
+        self.table.bitfield = b"\xff"
+        self.assertEqual(self.table.bitfield, b"\xe0")
+        with self.assertRaises(ValueError):
+            self.table.bitfield = b"\xff\xff"
+
+    def test_piece_ranges(self):
+        self.assertEqual(self.table.piece_range(0), (0, 1024))
+        self.assertEqual(self.table.piece_range(2), (2048, 2560))
+        self.assertEqual(self.table.piece_size(2), 512)
+        self.assertEqual(self.table.piece_at(1024), 1)
+        self.assertEqual(self.table.pieces_for_range(1000, 100), range(0, 2))
+        self.assertEqual(self.table.pieces_for_range(2048, 512), range(2, 3))
+        self.assertEqual(self.table.pieces_for_range(0, 0), range(0))
+
+    def test_torrent_info_builds_table(self):
+        info = TorrentInfo("test", self.piece_length, self.pieces, length=len(self.payload))
+        self.assertEqual(len(info.piece_hashes), 3)
+        self.assertEqual(info.piece_hashes.piece_size(2), 512)
+        with self.assertRaises(ValueError):
+            TorrentInfo("test", self.piece_length, b"x" * 30, length=10)
@@ -0,0 +1,64 @@
+import unittest
+from app.repositories.piece_picker import PiecePicker
+
+
+class TestPiecePicker(unittest.TestCase):
+
+    def test_nothing_to_pick_without_peers(self):
+        picker = PiecePicker(4)
+        self.assertIsNone(picker.pick())
+        self.assertEqual(len(picker), 4)
+
+    def test_picks_rarest_first(self):
+        picker = PiecePicker(10, seed=1)
+        picker.add_bitfield(b"\xff\xc0")  # everything
+        picker.add_bitfield(b"\xff\x00")  # pieces 0-7
+        picker.add_have(9)
+        # Piece 8 is the only one with a single peer
+        self.assertEqual(picker.pick(), 8)
+        self.assertEqual(picker.availability[9], 2)
+        self.assertEqual(sorted(picker.pick() for _ in range(9)), list(range(8)) + [9])
+        self.assertIsNone(picker.pick())
+
+    def test_higher_priority_first(self):
+        picker = PiecePicker(6, seed=1, priorities=[1, 0, 2, 1, 2, 0])
+        self.assertEqual(len(picker), 4)
+        picker.add_bitfield(b"\xfc")
+        picker.add_bitfield(b"\x80")  # piece 0 is the most common one
+        self.assertEqual(sorted([picker.pick(), picker.pick()]), [2, 4])
+        self.assertEqual(picker.pick(), 3)
+        picker.set_priority(0, 0)
+        self.assertIsNone(picker.pick())
+
+    def test_pick_only_pieces_the_peer_has(self):
+        picker = PiecePicker(8)
+        picker.add_bitfield(b"\xff")
+        self.assertIn(picker.pick(lambda index: index in (2, 5)), (2, 5))
+        self.assertIsNone(picker.pick(lambda index: False))
+
+    def test_ties_are_broken_randomly(self):
+        orders = set()
+        for seed in range(5):
+            picker = PiecePicker(16, seed=seed)
+            picker.add_bitfield(b"\xff\xff")
+            orders.add(tuple(picker.pick() for _ in range(16)))
+        self.assertGreater(len(orders), 1)
+        self.assertNotIn(tuple(range(16)), orders)
+
+    def test_remove_peer(self):
+        picker = PiecePicker(8)
+        picker.add_bitfield(b"\x80")
+        picker.remove_bitfield(b"\x80")
+        picker.remove_have(0)
+        self.assertEqual(picker.availability[0], 0)
+        self.assertIsNone(picker.pick())
+
+    def test_unpick_and_discard(self):
+        picker = PiecePicker(2, wanted=[1])
+        picker.add_bitfield(b"\xc0")
+        self.assertEqual(picker.pick(), 1)
+        picker.unpick(1)
+        self.assertTrue(picker.is_wanted(1))
+        picker.discard(1)
+        self.assertEqual(len(picker), 0)
+        self.assertIsNone(picker.pick())
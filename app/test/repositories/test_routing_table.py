@@ -0,0 +1,74 @@
+import os
+import random
+import unittest
+from app.repositories.routing_table import RoutingTable, MAX_FAILURES, ID_BITS
+
+
+def node_id(value):
+    return value.to_bytes(20, "big")
+
+
+class TestRoutingTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = RoutingTable(node_id(0), k=2)
+
+    def test_buckets_split_near_our_id(self):
+        # Far nodes (first bit set) share bucket 0, which is not split once there is a deeper one
+        for value in (1 << 159, (1 << 159) + 1, 1 << 158, 1, 2, 3):
+            self.assertIsNone(self.table.add(node_id(value), ("127.0.0.1", value % 60000 + 1)))
+        self.assertEqual(len(self.table), 6)
+        self.assertGreater(len(self.table.buckets), 2)
+        stale = self.table.add(node_id((1 << 159) + 5), ("127.0.0.1", 9))
+        self.assertEqual(stale.id, 1 << 159)
+        self.assertEqual(len(self.table.buckets[0]), 2)
+        # Our own id is never added
+        self.assertIsNone(self.table.add(node_id(0), ("127.0.0.1", 1)))
+        self.assertEqual(len(self.table), 6)
+
+    def test_refresh_moves_node_to_the_end(self):
+        self.table.add(node_id(1 << 159), ("a", 1), now=1)
+        self.table.add(node_id((1 << 159) + 1), ("b", 2), now=2)
+        self.table.add(node_id(1 << 159), ("c", 3), now=3)
+        stale = self.table.add(node_id((1 << 159) + 2), ("d", 4), now=4)
+        self.assertEqual((stale.id, self.table.get(node_id(1 << 159)).address), ((1 << 159) + 1, ("c", 3)))
+
+    def test_failing_nodes_are_replaced_then_dropped(self):
+        self.table.add(node_id(1 << 159), ("a", 1))
+        self.table.add(node_id((1 << 159) + 1), ("b", 2))
+        self.table.mark_failed(node_id(1 << 159))
+        self.assertIsNone(self.table.add(node_id((1 << 159) + 2), ("c", 3)))
+        self.assertIsNone(self.table.get(node_id(1 << 159)))
+        for _ in range(MAX_FAILURES):
+            self.table.mark_failed(node_id((1 << 159) + 1))
+        self.assertEqual([node.id for node in self.table], [(1 << 159) + 2])
+
+    def test_closest(self):
+        table = RoutingTable(os.urandom(20))
+        ids = [os.urandom(20) for _ in range(300)]
+        for index, value in enumerate(ids):
+            table.add(value, ("127.0.0.1", index + 1))
+        target = os.urandom(20)
+        closest = [node.node_id for node in table.closest(target)]
+        expected = sorted((node.node_id for node in table), key=lambda value: int.from_bytes(value, "big") ^ int.from_bytes(target, "big"))
+        self.assertEqual(closest, expected[:8])
+        self.assertLessEqual(len(table), 8 * len(table.buckets))
+
+    def test_random_id_falls_into_the_bucket(self):
+        table = RoutingTable(os.urandom(20), k=1)
+        for _ in range(100):
+            table.add(os.urandom(20), ("127.0.0.1", 1))
+        rng = random.Random(1)
+        for index in range(len(table.buckets)):
+            value = int.from_bytes(table.random_id(index, rng), "big")
+            self.assertEqual(table._index(value), index)
+        self.assertLess(len(table.buckets), ID_BITS)
+
+    def test_stale_buckets(self):
+        self.table.add(node_id(1 << 159), ("a", 1), now=100)
+        self.assertEqual(self.table.stale_buckets(50, now=120), [])
+        self.assertEqual(self.table.stale_buckets(50, now=200), [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import asyncio
+import time
+import unittest
+from app.repositories.token_bucket import TokenBucket
+
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+
+    async def test_unlimited(self):
+        bucket = TokenBucket()
+        start = time.monotonic()
+        for _ in range(100):
+            await bucket.consume(10 ** 9)
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    async def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=1000000, burst=100000)
+        start = time.monotonic()
+        await bucket.consume(100000)
+        self.assertLess(time.monotonic() - start, 0.05)
+        for _ in range(4):
+            await bucket.consume(50000)
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    async def test_shared_by_concurrent_consumers(self):
+        bucket = TokenBucket(rate=1000000, burst=10000)
+        done = []
+
+        async def consumer(name):
+            for _ in range(5):
+                await bucket.consume(20000)
+                done.append(name)
+        start = time.monotonic()
+        await asyncio.gather(consumer("a"), consumer("b"))
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+        # Served in turn, neither consumer starves the other
+        self.assertEqual(done[:4], ["a", "b", "a", "b"])
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from app.repositories.bt_file import BTFile, BTFileCollection
+from app.repositories.piece_hash_table import PieceHashTable
+from app.repositories.write_back_cache import WriteBackCache
+
+
+class TestWriteBackCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.piece_length = 16
+        self.payload = os.urandom(100)
+        self.collection = BTFileCollection([BTFile("a", 40, 0, 39), BTFile("b", 60, 40, 99)])
+        for bt_file in self.collection.get_files():
+            open(os.path.join(self.directory, bt_file.path), "wb").close()
+        pieces = b"".join(hashlib.sha1(self.piece(i)).digest() for i in range(7))
+        self.piece_hashes = PieceHashTable(pieces, self.piece_length, len(self.payload))
+
+    def tearDown(self):
+        self.collection.close()
+        shutil.rmtree(self.directory)
+
+    def piece(self, index):
+        return self.payload[index * self.piece_length:(index + 1) * self.piece_length]
+
+    def cache(self, **kwargs):
+        return WriteBackCache(self.collection, self.piece_hashes, self.directory, **kwargs)
+
+    def test_only_good_pieces_are_cached(self):
+        cache = self.cache()
+        self.assertFalse(cache.add(0, b"x" * self.piece_length))
+        self.assertFalse(cache.add(1, self.piece(1)[:-1]))
+        self.assertTrue(cache.add(2, self.piece(2)))
+        self.assertEqual((len(cache), cache.cached_bytes), (1, self.piece_length))
+        self.assertTrue(self.piece_hashes.is_verified(2))
+        self.assertFalse(self.piece_hashes.is_verified(0))
+
+    def test_nothing_is_written_before_flush(self):
+        cache = self.cache()
+        cache.add(0, self.piece(0))
+        self.assertEqual(os.path.getsize(os.path.join(self.directory, "a")), 0)
+        cache.flush()
+        self.assertEqual(self.collection.read_offset(0, 16, self.directory), self.piece(0))
+        self.assertEqual((len(cache), cache.cached_bytes), (0, 0))
+
+    def test_flush_writes_runs_in_order(self):
+        cache = self.cache(max_batch=48)
+        for index in (6, 1, 0, 4, 2, 3, 5):
+            cache.add(index, self.piece(index))
+        with mock.patch.object(self.collection, "write_buffers", wraps=self.collection.write_buffers) as write:
+            cache.flush()
+        # 0-2 fill one batch, 3-5 the next, 6 is left
+        self.assertEqual([(call.args[0], len(call.args[1])) for call in write.call_args_list],
+                         [(0, 3), (48, 3), (96, 1)])
+        self.assertEqual(self.collection.read_offset(0, 100, self.directory), self.payload)
+
+    def test_gaps_split_batches(self):
+        cache = self.cache()
+        for index in (0, 1, 3):
+            cache.add(index, self.piece(index))
+        with mock.patch.object(self.collection, "write_buffers", wraps=self.collection.write_buffers) as write:
+            cache.flush()
+        self.assertEqual([call.args[0] for call in write.call_args_list], [0, 48])
+
+    def test_memory_cap(self):
+        cache = self.cache(memory_cap=32)
+        cache.add(0, self.piece(0))
+        self.assertFalse(cache.is_full())
+        cache.add(1, self.piece(1))
+        self.assertTrue(cache.is_full())
+        cache.flush()
+        self.assertFalse(cache.is_full())
+
+    def test_failed_flush_keeps_unwritten_pieces(self):
+        cache = self.cache(max_batch=16)
+        for index in (0, 1):
+            cache.add(index, self.piece(index))
+        write_buffers = self.collection.write_buffers
+
+        def fail_second(offset, buffers, directory):
+            if offset:
+                raise OSError("disk full")
+            write_buffers(offset, buffers, directory)
+        with mock.patch.object(self.collection, "write_buffers", side_effect=fail_second):
+            with self.assertRaises(OSError):
+                cache.flush()
+        self.assertEqual((list(cache._pieces), cache.cached_bytes), ([1], 16))
+        cache.flush()
+        self.assertEqual(self.collection.read_offset(0, 32, self.directory), self.payload[:32])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,10 @@
+import io
+import json
+import types
 import unittest
+from unittest import mock
 from unittest.mock import Mock
+from app.repositories.meta_info import MetaInfo, TorrentFile, Tracker, TorrentInfo as Info
 from app.services.torrent_file_info import TorrentInfo
 
 
@@ -34,4 +39,58 @@ class TestTorrentInfo(unittest.TestCase):
     def test_torrent_info_str_with_no_files(self):
         torrent_info = TorrentInfo(self.mock_torrent_file)
         assert str(torrent_info).startswith("=== TORRENT INFO ===")
-        assert str(torrent_info).endswith("=== END TORRENT INFO ===\n")
\ No newline at end of file
+        assert str(torrent_info).endswith("=== END TORRENT INFO ===\n")
+
+    def test_torrent_info_str_with_info_hash(self):
+        self.mock_torrent_file.info_hash = bytes(range(20))
+        self.mock_torrent_file.info_hash_v2 = None
+        torrent_info = TorrentInfo(self.mock_torrent_file)
+        assert "Info hash: 000102030405060708090a0b0c0d0e0f10111213\n" in str(torrent_info)
+        assert "Info hash v2" not in str(torrent_info)
+
+
+class TestTorrentInfoFormats(unittest.TestCase):
+
+    def setUp(self):
+        files = [TorrentFile(f"dir/file-{i}.{'iso' if i % 2 else 'txt'}", i) for i in range(10)]
+        self.meta_info = MetaInfo(Tracker("http://t/announce"), Info("x", 16384, bytes(20), files=files),
+                                  announce_list=[Tracker("http://t/announce"), Tracker("udp://u:1")],
+                                  comment=b"c\xc3\xa9", creation_date=1700000000, files=files,
+                                  info_hash=bytes(range(20)))
+
+    def test_text_lists_every_file(self):
+        text = str(TorrentInfo(self.meta_info))
+        self.assertIn("Comment: cé\n", text)
+        self.assertIn("  - udp://u:1\n", text)
+        self.assertEqual(text.count(" ---> "), 10)
+
+    def test_json(self):
+        document = json.loads(str(TorrentInfo(self.meta_info, "json")))
+        self.assertEqual(document["announce_list"], ["http://t/announce", "udp://u:1"])
+        self.assertEqual(document["info_hash"], bytes(range(20)).hex())
+        self.assertEqual(document["files"][3], {"path": "dir/file-3.iso", "length": 3})
+        self.assertNotIn("more_files", document)
+
+    def test_ndjson_with_filter_and_limit(self):
+        lines = [json.loads(line) for line in str(TorrentInfo(self.meta_info, "ndjson", limit=2,
+                                                              pattern="*.iso")).splitlines()]
+        self.assertEqual(lines[0]["type"], "torrent")
+        self.assertEqual([line.get("path") for line in lines[1:3]], ["dir/file-1.iso", "dir/file-3.iso"])
+        self.assertEqual(lines[3], {"type": "more_files", "count": 3})
+
+    def test_single_file_torrent(self):
+        meta_info = MetaInfo(None, Info("single.bin", 16384, bytes(20), length=5))
+        document = json.loads(str(TorrentInfo(meta_info, "json")))
+        self.assertEqual(document, {"announce": None, "files": [{"path": "single.bin", "length": 5}]})
+
+    def test_write_streams_without_building_the_report(self):
+        output = io.StringIO()
+        output.writelines = mock.Mock(side_effect=lambda chunks: [output.write(chunk) for chunk in chunks])
+        TorrentInfo(self.meta_info, limit=3).write(output)
+        chunks = output.writelines.call_args.args[0]
+        self.assertIsInstance(chunks, types.GeneratorType)
+        self.assertIn(" ... 7 more files\n", output.getvalue())
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            TorrentInfo(self.meta_info, "xml")
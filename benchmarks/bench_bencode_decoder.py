@@ -0,0 +1,163 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Benchmark: bencode decoding of synthetic metainfo files.
+
+Compares the memoryview-based BencodeDecoder against the previous byte-at-a-time
+implementation (kept below as LegacyBencodeDecoder) on multi-file torrents of
+roughly 1 MB, 10 MB and 100 MB. Roughly half of each file is the 'pieces' blob,
+the rest is the 'files' list. Best-of-N wall time and peak allocated memory
+are reported for both decoders.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_bencode_decoder [--sizes 1 10 100] [--repeat 3]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from app.features.parse_torrent_file import BencodeDecoder
+
+
+# The decoder as it was before the memoryview rewrite, kept for comparison.
+class LegacyBencodeDecoder:
+    def __init__(self, data, index=0):
+        self.data = data
+        self.index = index
+
+    def decode(self):
+        if self.data[self.index] == ord(b'd'):
+            return self.decode_dictionary()
+        elif self.data[self.index] == ord(b'l'):
+            return self.decode_list()
+        elif self.data[self.index] == ord(b'i'):
+            return self.decode_integer()
+        else:
+            return self.decode_string()
+
+    def decode_dictionary(self):
+        dct = {}
+        self.index += 1
+        while self.data[self.index] != ord(b'e'):
+            key = self.decode_string()
+            value = self.decode()
+            dct[key.decode()] = value
+        self.index += 1
+        return dct
+
+    def decode_list(self):
+        lst = []
+        self.index += 1
+        while self.data[self.index] != ord(b'e'):
+            item = self.decode()
+            lst.append(item)
+        self.index += 1
+        return lst
+
+    def decode_integer(self):
+        end = self.data.index(b'e', self.index)
+        integer = int(self.data[self.index + 1:end])
+        self.index = end + 1
+        return integer
+
+    def decode_string(self):
+        start = self.index
+        while chr(self.data[self.index]).isdigit():
+            self.index += 1
+        colon = self.data.index(b':', self.index)
+        length = int(self.data[start:colon].decode())
+        end = colon + 1 + length
+        string = self.data[colon + 1:end]
+        self.index = end
+        return string
+
+
+def _string(value):
+    return b"%d:%s" % (len(value), value)
+
+
+# Builds a canonical multi-file metainfo of about target_size bytes.
+def make_metainfo(target_size):
+    pieces_size = (target_size // 2) // 20 * 20
+    pieces = bytes(range(256)) * (pieces_size // 256) + bytes(pieces_size % 256)
+
+    entries = []
+    budget = target_size - pieces_size
+    index = 0
+    while budget > 0:
+        entry = b"d6:lengthi%de4:pathl%s%see" % (
+            1000 + index, _string(b"dir-%d" % (index // 100)), _string(b"file-%08d.bin" % index))
+        entries.append(entry)
+        budget -= len(entry)
+        index += 1
+
+    info = (b"d5:filesl" + b"".join(entries) + b"e"
+            + b"4:name" + _string(b"synthetic")
+            + b"12:piece lengthi262144e"
+            + b"6:pieces" + _string(pieces) + b"e")
+    return b"d8:announce" + _string(b"http://tracker.example.com/announce") + b"4:info" + info + b"e"
+
+
+def _best_of(repeat, func):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# Peak memory allocated while decoding, in MB (measured in a separate run
+# because tracing slows allocation down considerably).
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bencode decoder benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100], help="Metainfo sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, best one is reported")
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'legacy (s)':>12} {'memoryview (s)':>16} {'speedup':>9} {'legacy peak':>13} {'memoryview peak':>17}")
+    for size in args.sizes:
+        data = make_metainfo(size * 1024 * 1024)
+        assert LegacyBencodeDecoder(data).decode()["info"]["name"] == BencodeDecoder(data).decode()["info"]["name"]
+        legacy = _best_of(args.repeat, lambda: LegacyBencodeDecoder(data).decode())
+        current = _best_of(args.repeat, lambda: BencodeDecoder(data).decode())
+        legacy_peak = _peak_memory(lambda: LegacyBencodeDecoder(data).decode())
+        current_peak = _peak_memory(lambda: BencodeDecoder(data).decode())
+        print(f"{size:>6}MB {legacy:>12.3f} {current:>16.3f} {legacy / current:>8.1f}x"
+              f" {legacy_peak:>11.1f}MB {current_peak:>15.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Benchmark: bencode encoding of synthetic metainfo dictionaries.
+
+Encodes torrents whose 'files' list has 10k, 100k and 1M entries (plus a matching 'pieces' blob) with BencodeEncoder,
+into a bytearray and streamed into a file, and with a straightforward recursive encoder that joins the encodings of
+the children (kept below as NaiveBencodeEncoder) for comparison. Best-of-N wall time and peak allocated memory are
+reported. Every encoding is checked to decode back to a byte-identical file.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_bencode_encoder [--files 10000 100000] [--repeat 3]
+"""
+
+import argparse
+import os
+import tempfile
+
+from app.features.parse_torrent_file import BencodeDecoder, BencodeEncoder
+from benchmarks.bench_bencode_decoder import _best_of, _peak_memory
+
+
+# A recursive encoder building the output from the joined encodings of the children.
+def naive_encode(value):
+    if isinstance(value, dict):
+        items = sorted((key.encode() if isinstance(key, str) else key, item) for key, item in value.items())
+        return b"d" + b"".join(naive_encode(key) + naive_encode(item) for key, item in items) + b"e"
+    if isinstance(value, list):
+        return b"l" + b"".join(naive_encode(item) for item in value) + b"e"
+    if isinstance(value, int):
+        return b"i%de" % value
+    if isinstance(value, str):
+        value = value.encode()
+    return b"%d:%s" % (len(value), bytes(value))
+
+
+# Builds a metainfo dictionary with file_count files of about 1 MB each, using 256 KiB pieces.
+def make_metainfo(file_count):
+    files = [{"length": 1000000 + index, "path": [b"dir-%d" % (index // 100), b"file-%08d.bin" % index]}
+             for index in range(file_count)]
+    total = sum(entry["length"] for entry in files)
+    piece_count = -(-total // 262144)
+    pieces = bytes(range(256)) * (piece_count * 20 // 256) + bytes(piece_count * 20 % 256)
+    return {"announce": b"http://tracker.example.com/announce", "creation date": 1700000000,
+            "info": {"files": files, "name": b"synthetic", "piece length": 262144, "pieces": pieces}}
+
+
+def encode_to_bytearray(metainfo):
+    output = bytearray()
+    BencodeEncoder(output).encode(metainfo)
+    return output
+
+
+def encode_to_file(metainfo, path):
+    with open(path, "wb") as f:
+        BencodeEncoder(f).encode(metainfo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bencode encoder benchmark")
+    parser.add_argument("--files", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="Number of entries in the 'files' list")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, best one is reported")
+    args = parser.parse_args()
+
+    print(f"{'files':>9} {'size':>9} {'naive (s)':>10} {'bytearray (s)':>14} {'file (s)':>9}"
+          f" {'naive peak':>11} {'bytearray peak':>15} {'file peak':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "out.torrent")
+        for file_count in args.files:
+            metainfo = make_metainfo(file_count)
+            expected = naive_encode(metainfo)
+            encoded = encode_to_bytearray(metainfo)
+            encode_to_file(metainfo, path)
+            with open(path, "rb") as f:
+                assert encoded == expected == f.read()
+            assert BencodeEncoder().encode(BencodeDecoder(encoded).decode()) == encoded
+            del encoded
+
+            naive = _best_of(args.repeat, lambda: naive_encode(metainfo))
+            in_memory = _best_of(args.repeat, lambda: encode_to_bytearray(metainfo))
+            streamed = _best_of(args.repeat, lambda: encode_to_file(metainfo, path))
+            naive_peak = _peak_memory(lambda: naive_encode(metainfo))
+            in_memory_peak = _peak_memory(lambda: encode_to_bytearray(metainfo))
+            streamed_peak = _peak_memory(lambda: encode_to_file(metainfo, path))
+            print(f"{file_count:>9} {len(expected) / 2 ** 20:>7.1f}MB {naive:>10.3f} {in_memory:>14.3f}"
+                  f" {streamed:>9.3f} {naive_peak:>9.1f}MB {in_memory_peak:>13.1f}MB {streamed_peak:>8.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
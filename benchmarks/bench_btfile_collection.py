@@ -0,0 +1,98 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Benchmark: BTFileCollection.read_offset / write_offset cost versus file count.
+
+Builds collections of small files on a temporary directory and measures the
+average time of single-piece reads and writes at random offsets. With the
+sorted start-offset index the cost per call stays flat as the number of files
+grows; the "scan" column shows the cost of only locating the overlapping files
+with the previous linear scan over every BTFile, for comparison.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_btfile_collection [--files 100 1000 10000 50000]
+"""
+
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+from app.repositories.bt_file import BTFile, BTFileCollection
+
+FILE_SIZE = 4096
+BLOCK_SIZE = 16384
+
+
+def make_collection(directory, count):
+    collection = BTFileCollection()
+    payload = bytes(FILE_SIZE)
+    for index in range(count):
+        path = f"file-{index:06d}"
+        with open(f"{directory}/{path}", "wb") as f:
+            f.write(payload)
+        collection.add_file(BTFile(path, FILE_SIZE, index * FILE_SIZE, (index + 1) * FILE_SIZE - 1))
+    return collection
+
+
+# Locating the overlapping files the way read_offset used to: visiting every file.
+def linear_scan(collection, offset, amount):
+    return [bt_file for bt_file in collection.get_files()
+            if bt_file.start_byte < offset + amount and bt_file.end_byte >= offset]
+
+
+def _per_call(func, offsets):
+    start = time.perf_counter()
+    for offset in offsets:
+        func(offset)
+    return (time.perf_counter() - start) / len(offsets) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BTFileCollection offset I/O benchmark")
+    parser.add_argument("--files", type=int, nargs="+", default=[100, 1000, 10000, 50000], help="File counts")
+    parser.add_argument("--calls", type=int, default=2000, help="Reads and writes per measurement")
+    args = parser.parse_args()
+
+    block = bytes(BLOCK_SIZE)
+    print(f"{'files':>8} {'read (us)':>10} {'write (us)':>11} {'scan (us)':>10}")
+    for count in args.files:
+        directory = tempfile.mkdtemp()
+        collection = make_collection(directory, count)
+        try:
+            total = collection.total_size()
+            offsets = [random.randrange(0, total - BLOCK_SIZE) for _ in range(args.calls)]
+            read = _per_call(lambda offset: collection.read_offset(offset, BLOCK_SIZE, directory), offsets)
+            write = _per_call(lambda offset: collection.write_offset(offset, block, directory), offsets)
+            scan = _per_call(lambda offset: linear_scan(collection, offset, BLOCK_SIZE), offsets[:200])
+            print(f"{count:>8} {read:>10.1f} {write:>11.1f} {scan:>10.1f}")
+        finally:
+            collection.close()
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Benchmark: DHT lookup latency versus the number of nodes.
+
+Starts a cluster of DHTNodes on loopback UDP in one event loop, each joining through
+the nodes started before it, then has random nodes announce random info-hashes and
+other random nodes look them up with get_peers. Reports, for each cluster size, the
+median and 90th percentile lookup latency, the queries sent per lookup, and the
+lookups that did not find the announced peer. Lookup cost grows with the logarithm of
+the number of nodes, since every round halves (at least) the distance to the target.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_dht_lookup [--nodes 32 128 512] [--lookups 50] [--alpha 3]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+from app.features.dht import DHTNode, ALPHA
+
+
+async def start_cluster(count, alpha, rng):
+    nodes = []
+    for _ in range(count):
+        node = DHTNode(alpha=alpha, timeout=1.0, bootstrap_nodes=[])
+        await node.start("127.0.0.1", 0)
+        if nodes:
+            await node.bootstrap([other.address for other in rng.sample(nodes, min(3, len(nodes)))])
+        nodes.append(node)
+    return nodes
+
+
+async def measure(count, lookups, alpha, seed):
+    rng = random.Random(seed)
+    nodes = await start_cluster(count, alpha, rng)
+    try:
+        latencies, queries, misses = [], [], 0
+        for _ in range(lookups):
+            info_hash = os.urandom(20)
+            announcer, searcher = rng.sample(nodes, 2)
+            await announcer.announce_peer(info_hash, 6881)
+            sent = searcher.queries_sent
+            start = time.perf_counter()
+            peers = await searcher.get_peers(info_hash)
+            latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(searcher.queries_sent - sent)
+            misses += ("127.0.0.1", 6881) not in peers
+        return latencies, queries, misses
+    finally:
+        for node in nodes:
+            await node.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DHT lookup latency benchmark")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[32, 128, 512], help="Cluster sizes")
+    parser.add_argument("--lookups", type=int, default=50, help="Lookups per cluster size")
+    parser.add_argument("--alpha", type=int, default=ALPHA, help="Lookup parallelism")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the node choices")
+    args = parser.parse_args()
+
+    print(f"{'nodes':>6} {'median (ms)':>12} {'p90 (ms)':>9} {'queries/lookup':>15} {'misses':>7}")
+    for count in args.nodes:
+        latencies, queries, misses = asyncio.run(measure(count, args.lookups, args.alpha, args.seed))
+        p90 = statistics.quantiles(latencies, n=10)[-1] if len(latencies) > 1 else latencies[0]
+        print(f"{count:>6} {statistics.median(latencies):>12.2f} {p90:>9.2f} {statistics.mean(queries):>15.1f}"
+              f" {misses:>7}")
+
+
+if __name__ == "__main__":
+    main()
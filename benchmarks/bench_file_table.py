@@ -0,0 +1,101 @@
+
+"""
+Copyright (C) 2023 Sergio Perea
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Author: Sergio Perea
+Website: https://sperea.es
+
+Please give credit to the author and the website when using or redistributing this code.
+"""
+
+"""
+Benchmark: memory held by the file list of a torrent, FileTable versus TorrentFile + BTFile objects.
+
+Builds the file list of a synthetic torrent (files spread over nested directories, as
+in large datasets) from bencoded path components, the way ParseTorrentFile and
+MetaInfo.create_btfile_collection do, and reports the memory still allocated once it
+is built:
+- "objects": one TorrentFile per file with a "/"-joined path, then one BTFile per file,
+  as before the file table;
+- "table": a single FileTable, shared by the MetaInfo and its BTFileCollection.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_file_table [--files 10000 100000 500000]
+"""
+
+import argparse
+import tracemalloc
+
+from app.repositories.bt_file import BTFile
+from app.repositories.file_table import FileTable
+from app.repositories.meta_info import TorrentFile
+
+FILES_PER_DIRECTORY = 100
+
+
+# Path components of count files as the decoder returns them (bytes), in nested directories.
+def make_paths(count):
+    return [[b"dataset", b"part-%03d" % (index // 10000), b"shard-%03d" % (index // FILES_PER_DIRECTORY % 100),
+             b"sample-%07d.jpg" % index] for index in range(count)]
+
+
+def build_objects(paths):
+    files = []
+    for index, components in enumerate(paths):
+        files.append(TorrentFile("/".join([str(part, "utf-8") for part in components]), 1000 + index % 5000))
+    bt_files = []
+    current_byte = 0
+    for file_info in files:
+        bt_files.append(BTFile(file_info.path, file_info.length, current_byte, current_byte + file_info.length - 1))
+        current_byte += file_info.length
+    return files, bt_files
+
+
+def build_table(paths):
+    table = FileTable()
+    for index, components in enumerate(paths):
+        table.append([str(part, "utf-8") for part in components], 1000 + index % 5000)
+    return table
+
+
+# Memory still allocated by what build returns, in MB.
+def _retained_memory(build, paths):
+    tracemalloc.start()
+    try:
+        result = build(paths)
+        return tracemalloc.get_traced_memory()[0] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+        del result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="File table memory benchmark")
+    parser.add_argument("--files", type=int, nargs="+", default=[10000, 100000, 500000], help="File counts")
+    args = parser.parse_args()
+
+    print(f"{'files':>8} {'objects (MB)':>13} {'table (MB)':>11} {'B/file before':>14} {'B/file after':>13} {'ratio':>6}")
+    for count in args.files:
+        paths = make_paths(count)
+        objects = _retained_memory(build_objects, paths)
+        table = _retained_memory(build_table, paths)
+        print(f"{count:>8} {objects:>13.1f} {table:>11.1f} {objects * 1048576 / count:>14.0f}"
+              f" {table * 1048576 / count:>13.0f} {objects / table:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
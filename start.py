@@ -21,39 +21,189 @@ Website: https://sperea.es
 Please give credit to the author and the website when using or redistributing this code.
 """
 
+import asyncio
 import os
 import sys
 import argparse
 
 from app.services.torrent_file_info import TorrentInfo
 from app.features.parse_torrent_file import ParseTorrentFile
+from app.features.fast_recheck import FastRecheck
+from app.features.session import Session
+from app.features.metainfo_cache import MetaInfoCache
+from app.features.index_torrents import IndexTorrentsUseCase
+from app.features.make_torrent import MakeTorrentUseCase
+from app.features.fetch_metadata import FetchMetadataUseCase
+from app.features.dht import DHTNode
+from app.repositories.file_priorities import FilePriorities
+
+# DHT node id and routing table, saved in the output directory between runs.
+DHT_STATE_FILE = ".dht"
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser(
         description="Cli Torrent Downloader. version 1.0. Run: %(prog)s. Written by Sergio Perea (https://sperea.es)")
     parser.add_argument("--t", type=str, default="media",
-                        help="Torrent file download. Specifies the path of the torrent file")
+                        help="Torrent file download. Specifies the path of the torrent file, or a magnet link whose torrent file is fetched from peers and saved into --o")
+    parser.add_argument("--o", type=str, default=None,
+                        help="Output directory. Data already in it is rechecked, reusing the previous check where files are unchanged")
+    parser.add_argument("--s", type=str, nargs="+", default=None,
+                        help="Session mode: download several torrents together into --o. Accepts .torrent files, directories of them and magnet links")
+    parser.add_argument("--c", type=int, default=200,
+                        help="Session mode: maximum number of peer connections across all torrents")
+    parser.add_argument("--d", type=int, default=None,
+                        help="Session mode: global download rate limit in bytes per second")
+    parser.add_argument("--u", type=int, default=None,
+                        help="Session mode: global upload rate limit in bytes per second")
+    parser.add_argument("--p", type=str, nargs="+", default=None,
+                        help="Session mode: only download the files whose path matches one of these glob patterns")
+    parser.add_argument("--q", type=str, nargs="+", default=None,
+                        help="Session mode: download the files whose path matches one of these glob patterns first")
+    parser.add_argument("--b", type=str, nargs="*", default=None,
+                        help="Session mode: also find peers on the DHT, joining it through these host:port nodes (the public routers if none). The routing table is kept in --o")
+    parser.add_argument("--r", action="store_true",
+                        help="Read payload data through memory maps instead of copies when rechecking, seeding and creating torrents")
+    parser.add_argument("--m", type=str, default=None,
+                        help="Metainfo cache directory. Parsed torrent files are kept there and not decoded again")
+    parser.add_argument("--i", type=str, default=None,
+                        help="Index mode: parse every .torrent file under this directory and print one JSON line per torrent")
+    parser.add_argument("--w", type=int, default=None,
+                        help="Index and create modes: number of workers (defaults to the number of CPUs)")
+    parser.add_argument("--n", type=str, default=None,
+                        help="Create a new torrent file for this file or directory (written as <name>.torrent into --o)")
+    parser.add_argument("--a", type=str, nargs="+", default=None,
+                        help="Create mode: tracker announce URLs, one tier each")
+    parser.add_argument("--f", type=str, default="text", choices=["text", "json", "ndjson"],
+                        help="Torrent info output format. json and ndjson print only the torrent info, for other tools")
+    parser.add_argument("--l", type=int, default=None,
+                        help="Torrent info: list at most this many files")
+    parser.add_argument("--g", type=str, default=None,
+                        help="Torrent info: only list files whose path matches this glob pattern, e.g. '*.iso'")
     parser.add_argument("--v", action='version', version='%(prog)s 1.0')
     parser.add_argument("--h", action='help', help="Show available options")
 
     return parser.parse_args()
 
 
+def run_session(args):
+    dht = None
+    if args.b is not None:
+        dht = DHTNode.load(os.path.join(args.o or ".", DHT_STATE_FILE))
+        if args.b:
+            dht.bootstrap_nodes = [(host, int(port)) for host, _, port in (node.rpartition(":") for node in args.b)]
+    session = Session(args.o or ".", max_connections=args.c, download_rate=args.d, upload_rate=args.u,
+                      metainfo_cache=MetaInfoCache(args.m) if args.m else None, dht=dht, use_mmap=args.r)
+    for job in asyncio.run(run_session_async(args, session)):
+        print(str(job))
+
+
+# Adds the torrents of args.s to session and runs it. The DHT node, if any, is joined first, so that magnet links are
+# looked up on it too.
+async def run_session_async(args, session):
+    dht = session.dht
+    if dht is not None:
+        await dht.start()
+        await dht.bootstrap()
+    try:
+        for path in args.s:
+            if path.startswith("magnet:"):
+                path = await fetch_magnet_async(path, args.o or ".", dht)
+            if not os.path.exists(path):
+                print(f"No torrent file found: {path}")
+                continue
+            for job in session.add_path(path):
+                if args.p or args.q:
+                    job.file_priorities = FilePriorities.from_meta_info(job.meta_info).select(args.p, args.q)
+                print(f"Added {job.meta_info.info.name}")
+        return await session.run_async()
+    finally:
+        if dht is not None:
+            await dht.close()
+
+
+# Fetches the torrent file of a magnet link in an event loop of its own; see fetch_magnet_async.
+def fetch_magnet(uri, output_directory):
+    return asyncio.run(fetch_magnet_async(uri, output_directory))
+
+
+# Fetches the torrent file of a magnet link from peers (also those of the dht, a running DHTNode, if given), saves it
+# into output_directory and returns its path.
+async def fetch_magnet_async(uri, output_directory, dht=None):
+    use_case = FetchMetadataUseCase(uri, dht=dht)
+    print(f"Fetching metadata of {use_case.magnet.name or use_case.magnet.info_hash.hex()}", file=sys.stderr)
+    meta_info = await use_case.execute_async()
+    torrent_file = os.path.join(output_directory, os.path.basename(meta_info.info.name) + ".torrent")
+    with open(torrent_file, "wb") as f:
+        f.write(use_case.torrent_bytes)
+    print(f"Saved {torrent_file}", file=sys.stderr)
+    return torrent_file
+
+
+def run_index(args):
+    indexed, errors = IndexTorrentsUseCase(args.i, sys.stdout, workers=args.w).execute()
+    print(f"Indexed {indexed} torrents, {errors} errors", file=sys.stderr)
+
+
+def run_make_torrent(args):
+    source = os.path.abspath(args.n)
+    output_path = os.path.join(args.o or ".", os.path.basename(source) + ".torrent")
+    shown = []
+
+    def progress(done, total):
+        percent = done * 100 // total
+        if not shown or percent != shown[-1]:
+            shown.append(percent)
+            print(f"\rHashing: {percent}%", end="", file=sys.stderr, flush=True)
+    info_hash = MakeTorrentUseCase(source, output_path, trackers=args.a, workers=args.w, progress=progress,
+                                   use_mmap=args.r).execute()
+    print(file=sys.stderr)
+    print(f"Created {output_path}")
+    print(f"Info hash: {info_hash.hex()}")
+
+
 def main(args):
+    if args.n:
+        run_make_torrent(args)
+        return
+
+    if args.i:
+        run_index(args)
+        return
+
+    if args.s:
+        run_session(args)
+        return
+
     script_path = os.path.dirname(os.path.abspath(sys.argv[0]))
-    torrent_file = os.path.join(script_path, args.t)
+    if args.t.startswith("magnet:"):
+        torrent_file = fetch_magnet(args.t, args.o or ".")
+    else:
+        torrent_file = os.path.join(script_path, args.t)
 
     if os.path.exists(torrent_file):
+        if args.m:
+            torrent = MetaInfoCache(args.m).load(torrent_file)
+        else:
+            torrent = ParseTorrentFile(torrent_file).execute()
+        torrent_info = TorrentInfo(torrent, format=args.f, limit=args.l, pattern=args.g)
+        if args.f != "text":
+            # Machine readable output: nothing else on stdout
+            torrent_info.write(sys.stdout)
+            return
+
         print("Running with the following parameters:")
         print(f"Torrent file: {args.t}")
-
-        torrent = ParseTorrentFile(torrent_file).execute()
-        print(str(TorrentInfo(torrent)))
+        torrent_info.write(sys.stdout)
+        print()
 
         bt_files = torrent.create_btfile_collection()
         print(str(bt_files))
 
+        if args.o and os.path.isdir(args.o):
+            piece_hashes, rehashed = FastRecheck(torrent, args.o, use_mmap=args.r).execute()
+            print(f"Verified pieces: {piece_hashes.verified_count()}/{len(piece_hashes)} ({rehashed} rehashed)")
+
     else:
         print("No torrent file found.")
 